@@ -0,0 +1,172 @@
+from datetime import date as Date, timedelta
+
+# ==== DANH SÁCH THÀNH TÍCH ====
+# (mã, icon, tên, mô tả, chỉ số, ngưỡng); chỉ số là cột của user_stats
+# hoặc 'balance' (số dư trong bảng users)
+ACHIEVEMENTS = (
+    ('first_transaction', '🌱', 'Bước đầu tiên', 'Thực hiện giao dịch đầu tiên', 'tx_count', 1),
+    ('transactions_50', '📊', 'Chuyên gia ghi chép', '50 giao dịch đã ghi', 'tx_count', 50),
+    ('transactions_100', '🏆', 'Siêu sao tài chính', '100 giao dịch đã ghi', 'tx_count', 100),
+    ('income_10m', '💰', 'Triệu phú nhỏ', 'Tổng thu nhập 10M+', 'total_income', 10000000),
+    ('income_100m', '💎', 'Đại gia', 'Tổng thu nhập 100M+', 'total_income', 100000000),
+    ('balance_5m', '🏦', 'Tiết kiệm giỏi', 'Số dư 5M+', 'balance', 5000000),
+    ('balance_50m', '👑', 'Vua tiết kiệm', 'Số dư 50M+', 'balance', 50000000),
+    ('active_days_7', '🔥', 'Streak 7 ngày', 'Hoạt động 7 ngày', 'active_days', 7),
+    ('active_days_30', '⭐', 'Người bền bỉ', 'Hoạt động 30 ngày', 'active_days', 30),
+)
+BY_CODE = {achievement[0]: achievement for achievement in ACHIEVEMENTS}
+STAT_COLUMNS = ('tx_count', 'total_income', 'active_days', 'current_streak', 'best_streak', 'last_day')
+
+ONE_DAY = timedelta(days=1)
+
+# ==== GHI: CẬP NHẬT BỘ ĐẾM KHI CÓ GIAO DỊCH ====
+# Bộ đếm trong user_stats được cộng dồn trong cùng transaction với giao dịch
+# (ledger.post), nên /achievements chỉ cần đọc một dòng thay vì COUNT/SUM và
+# COUNT(DISTINCT DATE(date)) trên toàn bộ lịch sử.
+
+def record(conn, user_id, tx_type, amount, date, balance):
+    """Cộng một giao dịch vào bộ đếm và mở khóa thành tích vừa đạt ngưỡng"""
+    income = amount if tx_type == 'income' else 0
+    tx_count, total_income, active_days, current_streak, best_streak, last_day = conn.execute('''
+        INSERT INTO user_stats (user_id, tx_count, total_income) VALUES (?, 1, ?)
+        ON CONFLICT (user_id) DO UPDATE SET
+            tx_count = tx_count + 1,
+            total_income = total_income + excluded.total_income
+        RETURNING tx_count, total_income, active_days, current_streak, best_streak, last_day
+    ''', (user_id, income)).fetchone()
+
+    day = date[:10]
+    new_day = conn.execute('INSERT OR IGNORE INTO user_active_days (user_id, day) VALUES (?, ?)',
+                           (user_id, day)).rowcount
+    if new_day:
+        active_days += 1
+        if last_day is None or day > last_day:
+            gap = Date.fromisoformat(day) - Date.fromisoformat(last_day) if last_day else None
+            current_streak = current_streak + 1 if gap == ONE_DAY else 1
+            conn.execute('''
+                UPDATE user_stats
+                SET active_days = ?, current_streak = ?, best_streak = MAX(best_streak, ?), last_day = ?
+                WHERE user_id = ?
+            ''', (active_days, current_streak, current_streak, day, user_id))
+        else:
+            # Giao dịch ghi lùi ngày (hiếm): có thể nối hai chuỗi ngày, tính lại
+            conn.execute('UPDATE user_stats SET active_days = ? WHERE user_id = ?', (active_days, user_id))
+            refresh_streaks(conn, user_id)
+
+    # Chỉ xét các ngưỡng mà giao dịch này vừa vượt qua
+    after = {'tx_count': tx_count, 'total_income': total_income, 'active_days': active_days, 'balance': balance}
+    delta = {'tx_count': 1, 'total_income': income, 'active_days': new_day,
+             'balance': amount if tx_type == 'income' else -amount}
+    reached = [code for code, _, _, _, stat, threshold in ACHIEVEMENTS
+               if after[stat] >= threshold > after[stat] - delta[stat]]
+    if reached:
+        unlock(conn, user_id, reached, date)
+
+def record_many(conn, user_id, count, income, days, date):
+    """Cộng một lô giao dịch (vd. /import); gọi sau khi đã cập nhật số dư"""
+    conn.execute('''
+        INSERT INTO user_stats (user_id, tx_count, total_income) VALUES (?, ?, ?)
+        ON CONFLICT (user_id) DO UPDATE SET
+            tx_count = tx_count + excluded.tx_count,
+            total_income = total_income + excluded.total_income
+    ''', (user_id, count, income))
+    conn.executemany('INSERT OR IGNORE INTO user_active_days (user_id, day) VALUES (?, ?)',
+                     [(user_id, day) for day in days])
+    conn.execute('''
+        UPDATE user_stats SET active_days = (SELECT COUNT(*) FROM user_active_days WHERE user_id = ?)
+        WHERE user_id = ?
+    ''', (user_id, user_id))
+    refresh_streaks(conn, user_id)
+    unlock_reached(conn, date, user_id)
+
+def refresh_streaks(conn, user_id=None):
+    """Tính lại chuỗi ngày liên tiếp từ user_active_days (gaps and islands)"""
+    where, params = ('WHERE user_id = ?', (user_id,)) if user_id is not None else ('', ())
+    islands = conn.execute(f'''
+        SELECT user_id, MAX(day), COUNT(*)
+        FROM (
+            SELECT user_id, day,
+                   julianday(day) - ROW_NUMBER() OVER (PARTITION BY user_id ORDER BY day) AS island
+            FROM user_active_days
+            {where}
+        )
+        GROUP BY user_id, island
+        ORDER BY user_id, MAX(day)
+    ''', params)
+    streaks = {}
+    for island_user, island_last_day, length in islands:
+        # Đảo cuối cùng (theo ngày) của mỗi user là chuỗi hiện tại
+        _, best, _ = streaks.get(island_user, (0, 0, None))
+        streaks[island_user] = (length, max(best, length), island_last_day)
+    conn.executemany('''
+        UPDATE user_stats SET current_streak = ?, best_streak = ?, last_day = ? WHERE user_id = ?
+    ''', [(current, best, last_day, island_user) for island_user, (current, best, last_day) in streaks.items()])
+
+# ==== MỞ KHÓA ====
+def unlock(conn, user_id, codes, date, announced=False):
+    conn.executemany('''
+        INSERT OR IGNORE INTO user_achievements (user_id, code, unlocked_date, announced)
+        VALUES (?, ?, ?, ?)
+    ''', [(user_id, code, date, int(announced)) for code in codes])
+
+def unlock_reached(conn, date, user_id=None, announced=False):
+    """Mở khóa mọi thành tích đã đạt ngưỡng (dùng khi dựng lại hoặc nhập theo lô)"""
+    where, params = ('AND u.user_id = ?', (user_id,)) if user_id is not None else ('', ())
+    for code, _, _, _, stat, threshold in ACHIEVEMENTS:
+        column = 'u.balance' if stat == 'balance' else f's.{stat}'
+        conn.execute(f'''
+            INSERT OR IGNORE INTO user_achievements (user_id, code, unlocked_date, announced)
+            SELECT u.user_id, ?, ?, ?
+            FROM users u LEFT JOIN user_stats s ON s.user_id = u.user_id
+            WHERE COALESCE({column}, 0) >= ? {where}
+        ''', (code, date, int(announced), threshold, *params))
+
+def take_unlocked(conn, user_id):
+    """Các thành tích mới mở khóa chưa được thông báo (đánh dấu đã thông báo)"""
+    codes = {row[0] for row in conn.execute('''
+        UPDATE user_achievements SET announced = 1
+        WHERE user_id = ? AND announced = 0
+        RETURNING code
+    ''', (user_id,))}
+    return [achievement for achievement in ACHIEVEMENTS if achievement[0] in codes]
+
+# ==== ĐỌC ====
+def load(conn, user_id):
+    """(bộ đếm dạng dict, [thành tích đã mở khóa]) của một user"""
+    row = conn.execute(f'SELECT {", ".join(STAT_COLUMNS)} FROM user_stats WHERE user_id = ?',
+                       (user_id,)).fetchone()
+    stats = dict(zip(STAT_COLUMNS, row or (0, 0, 0, 0, 0, None)))
+    codes = {row[0] for row in conn.execute('SELECT code FROM user_achievements WHERE user_id = ?', (user_id,))}
+    return stats, [achievement for achievement in ACHIEVEMENTS if achievement[0] in codes]
+
+def current_streak(stats, today):
+    """Chuỗi hiện tại chỉ còn tính nếu ngày hoạt động cuối là hôm nay hoặc hôm qua"""
+    last_day = stats['last_day']
+    if last_day and Date.fromisoformat(last_day) >= today - ONE_DAY:
+        return stats['current_streak']
+    return 0
+
+# ==== DỰNG LẠI ====
+def rebuild(conn, date, user_id=None):
+    """Tính lại bộ đếm từ transactions (toàn bộ hoặc một user); thành tích
+    đã mở khóa được giữ nguyên, thành tích đạt thêm không được thông báo"""
+    where, params = ('WHERE user_id = ?', (user_id,)) if user_id is not None else ('', ())
+    conn.execute(f'DELETE FROM user_active_days {where}', params)
+    conn.execute(f'DELETE FROM user_stats {where}', params)
+    conn.execute(f'''
+        INSERT OR IGNORE INTO user_active_days (user_id, day)
+        SELECT DISTINCT user_id, substr(date, 1, 10)
+        FROM transactions
+        {where or 'WHERE 1'} AND date IS NOT NULL
+    ''', params)
+    cursor = conn.execute(f'''
+        INSERT INTO user_stats (user_id, tx_count, total_income, active_days)
+        SELECT user_id, COUNT(*), SUM(CASE WHEN type = 'income' THEN amount ELSE 0 END),
+               (SELECT COUNT(*) FROM user_active_days d WHERE d.user_id = t.user_id)
+        FROM transactions t
+        {where}
+        GROUP BY user_id
+    ''', params)
+    refresh_streaks(conn, user_id)
+    unlock_reached(conn, date, user_id, announced=True)
+    return cursor.rowcount
@@ -0,0 +1,85 @@
+import gzip
+import os
+import shutil
+import sqlite3
+import time
+from datetime import datetime
+
+BACKUP_PAGES_PER_STEP = 1024
+BACKUP_STEP_SLEEP = 0.01  # giây nghỉ giữa các bước để nhường I/O cho lệnh đang chạy
+SNAPSHOT_PREFIX = 'finance_bot-'
+
+class BackupError(Exception):
+    """Snapshot tạo ra không qua được integrity_check"""
+
+# ==== TẠO SNAPSHOT ====
+def snapshot(source_path, backup_dir, pages=BACKUP_PAGES_PER_STEP, sleep=BACKUP_STEP_SLEEP):
+    """Sao lưu online bằng sqlite3 backup API, trả về thông tin snapshot.
+
+    Chạy trên luồng riêng (asyncio.to_thread). Kết nối nguồn giữ một read
+    transaction suốt quá trình: với WAL người ghi không bị chặn, và backup
+    đọc đúng một snapshot nên không bị khởi động lại khi có lệnh ghi mới.
+    """
+    os.makedirs(backup_dir, exist_ok=True)
+    name = f"{SNAPSHOT_PREFIX}{datetime.now().strftime('%Y%m%d-%H%M%S')}.db"
+    path = os.path.join(backup_dir, name)
+    temp_path = path + '.tmp'
+
+    started = time.perf_counter()
+    source = sqlite3.connect(source_path, isolation_level=None)
+    target = sqlite3.connect(temp_path, isolation_level=None)
+    try:
+        source.execute('BEGIN')
+        source.execute('SELECT COUNT(*) FROM sqlite_master').fetchone()
+        source.backup(target, pages=pages, sleep=sleep)
+        source.execute('COMMIT')
+        page_count = target.execute('PRAGMA page_count').fetchone()[0]
+        result = target.execute('PRAGMA integrity_check').fetchone()[0]
+    finally:
+        target.close()
+        source.close()
+
+    if result != 'ok':
+        os.remove(temp_path)
+        raise BackupError(f'integrity_check: {result}')
+    os.replace(temp_path, path)
+    return {
+        'path': path,
+        'bytes': os.path.getsize(path),
+        'pages': page_count,
+        'seconds': time.perf_counter() - started,
+    }
+
+# ==== XOAY VÒNG ====
+def list_snapshots(backup_dir):
+    """Các snapshot (.db và .db.gz), mới nhất trước"""
+    if not os.path.isdir(backup_dir):
+        return []
+    names = [name for name in os.listdir(backup_dir)
+             if name.startswith(SNAPSHOT_PREFIX) and name.endswith(('.db', '.db.gz'))]
+    return [os.path.join(backup_dir, name) for name in sorted(names, reverse=True)]
+
+def compress(path):
+    """Nén snapshot thành .gz rồi xóa file gốc"""
+    with open(path, 'rb') as source, gzip.open(path + '.gz', 'wb') as target:
+        shutil.copyfileobj(source, target, 1024 * 1024)
+    os.remove(path)
+    return path + '.gz'
+
+def rotate(backup_dir, keep):
+    """Giữ `keep` snapshot mới nhất; snapshot mới nhất để nguyên, các bản cũ hơn được nén"""
+    removed = compressed = 0
+    for index, path in enumerate(list_snapshots(backup_dir)):
+        if index >= keep:
+            os.remove(path)
+            removed += 1
+        elif index > 0 and path.endswith('.db'):
+            compress(path)
+            compressed += 1
+    return removed, compressed
+
+def backup(source_path, backup_dir, keep=24, pages=BACKUP_PAGES_PER_STEP, sleep=BACKUP_STEP_SLEEP):
+    """Tạo snapshot mới rồi xoay vòng các bản cũ"""
+    info = snapshot(source_path, backup_dir, pages=pages, sleep=sleep)
+    info['removed'], info['compressed'] = rotate(backup_dir, keep)
+    return info
@@ -0,0 +1,294 @@
+"""Benchmark các lệnh của bot.py không cần kết nối Discord.
+
+Chạy đúng coroutine của từng lệnh (qua hook before/after_invoke như khi
+bot nhận lệnh thật) với ctx/author/send giả, trên một database tổng hợp.
+In p50/p95/p99 và thông lượng theo lệnh, kèm phần thời gian db/vẽ/gửi và
+số câu SQL (từ metrics), rồi lưu kết quả JSON để so sánh giữa các commit.
+
+    python bench/bench_commands.py --users 1000 --transactions 200 --iterations 200
+    python bench/bench_commands.py --db big.db --output new.json --baseline old.json
+
+Database tạo bằng bench/generate_data.py (cùng --seed và --now cho cùng dữ
+liệu); đồng hồ của bot được đặt về --now để các lệnh theo tháng/tuần đọc
+đúng phần dữ liệu đó dù chạy vào ngày nào.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import random
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from generate_data import DEFAULT_NOW, PROFILES, generate, parse_now  # noqa: E402
+
+COMMANDS = ('add', 'spend', 'balance', 'stats', 'report', 'chart', 'history', 'search', 'export', 'transfer')
+EXPENSES = [(category, PROFILES[category][3])
+            for category in ('Ăn uống', 'Giao thông', 'Nhà cửa', 'Y tế', 'Giải trí', 'Quần áo', 'Giáo dục')]
+SEARCH_WORDS = ('cà phê', 'tra sua', 'xăng', 'điện', 'banh mi', 'phở', 'grab')
+
+# ==== DISCORD GIẢ ====
+class FakeMember:
+    def __init__(self, user_id):
+        self.id = user_id
+        self.name = self.display_name = f'user{user_id}'
+        self.mention = f'<@{user_id}>'
+        self.avatar = None
+        self.bot = False
+
+    async def send(self, *args, **kwargs):
+        pass
+
+class FakeGuild:
+    def __init__(self, guild_id):
+        self.id = guild_id
+        self.name = f'guild{guild_id}'
+        self.filesize_limit = 25 * 1024 * 1024
+
+class FakeMessage:
+    attachments = ()
+
+    async def edit(self, **kwargs):
+        pass
+
+class FakeContext:
+    """Đủ thuộc tính để các lệnh và hook của bot chạy; send chỉ giả lập độ trễ mạng"""
+
+    def __init__(self, bot_module, command, author, guild, send_latency):
+        self.command = bot_module.bot.get_command(command)
+        self.author = author
+        self.guild = guild
+        self.message = FakeMessage()
+        self.command_failed = False
+        self.created = time.perf_counter()
+        self.timer = None
+        self.send_latency = send_latency
+        self._metrics = bot_module.metrics
+
+    async def send(self, *args, **kwargs):
+        with self._metrics.timed('send'):
+            if self.send_latency:
+                await asyncio.sleep(self.send_latency)
+            # File đính kèm (export, chart) được discord.py đóng sau khi gửi
+            for attachment in kwargs.get('files') or ([kwargs['file']] if kwargs.get('file') else []):
+                attachment.close()
+            return FakeMessage()
+
+def command_args(name, rng, user_count):
+    """(args, kwargs) cho một lần gọi lệnh"""
+    if name == 'add':
+        return (rng.randrange(100_000, 5_000_000, 1_000), 'Lương'), {'description': 'bench thu'}
+    if name == 'spend':
+        category, descriptions = rng.choice(EXPENSES)
+        return (rng.randrange(10_000, 200_000, 1_000), category), {'description': rng.choice(descriptions)}
+    if name in ('stats', 'report'):
+        return ('month',), {}
+    if name == 'chart':
+        return (rng.choice(('pie', 'bar')), 'month'), {}
+    if name == 'history':
+        return (30,), {}
+    if name == 'search':
+        return (), {'keyword': rng.choice(SEARCH_WORDS)}
+    if name == 'export':
+        return ('csv',), {}
+    if name == 'transfer':
+        return (rng.randrange(1_000, 50_000, 1_000), FakeMember(rng.randrange(1, user_count + 1))), \
+               {'description': 'bench chuyển'}
+    return (), {}
+
+def freeze_clock(now):
+    """datetime.now() trong các module của bot bắt đầu từ `now` rồi chạy tiếp theo giờ thật"""
+    offset = now - datetime.now()
+
+    class BenchDatetime(datetime):
+        @classmethod
+        def now(cls, tz=None):
+            return datetime.now(tz) + offset
+
+    for module in list(sys.modules.values()):
+        if getattr(module, 'datetime', None) is datetime and \
+                os.path.dirname(getattr(module, '__file__', None) or '') == ROOT:
+            module.datetime = BenchDatetime
+
+# ==== ĐO ====
+async def invoke(bot_module, name, user_id, guild, rng, args):
+    """Chạy một lệnh như bot.invoke: before_invoke, callback, after_invoke"""
+    ctx = FakeContext(bot_module, name, FakeMember(user_id), guild, args.send_latency)
+    call_args, call_kwargs = command_args(name, rng, args.users)
+    started = time.perf_counter()
+    failed = False
+    await bot_module.remember_member(ctx)
+    try:
+        await ctx.command.callback(ctx, *call_args, **call_kwargs)
+    except Exception as e:
+        ctx.command_failed = failed = True
+        logging.getLogger('bench').warning(f'{name} lỗi: {e!r}')
+    finally:
+        await bot_module.finish_command(ctx)
+    return time.perf_counter() - started, ctx.timer, failed
+
+async def bench_command(bot_module, name, args, rng):
+    guild = FakeGuild(1) if args.guild else None
+    for _ in range(args.warmup):
+        await invoke(bot_module, name, rng.randrange(1, args.users + 1), guild, rng, args)
+
+    samples = []
+    remaining = [args.iterations]
+
+    async def worker():
+        while remaining[0] > 0:
+            remaining[0] -= 1
+            samples.append(await invoke(bot_module, name, rng.randrange(1, args.users + 1), guild, rng, args))
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+    return summarize(samples, time.perf_counter() - started)
+
+def summarize(samples, wall):
+    latencies = sorted(sample[0] for sample in samples)
+    cuts = statistics.quantiles(latencies, n=100, method='inclusive') if len(latencies) > 1 else latencies * 99
+    mean_phase = lambda phase: statistics.fmean(timer.phases[phase] for _, timer, _ in samples) * 1000
+    return {
+        'count': len(samples),
+        'errors': sum(failed for _, _, failed in samples),
+        'p50_ms': cuts[49] * 1000,
+        'p95_ms': cuts[94] * 1000,
+        'p99_ms': cuts[98] * 1000,
+        'mean_ms': statistics.fmean(latencies) * 1000,
+        'max_ms': latencies[-1] * 1000,
+        'throughput': len(samples) / wall,
+        'db_ms': mean_phase('db'),
+        'render_ms': mean_phase('render'),
+        'send_ms': mean_phase('send'),
+        'queries': statistics.fmean(timer.queries for _, timer, _ in samples),
+    }
+
+# ==== KẾT QUẢ ====
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def print_table(results, baseline=None):
+    print(f"{'lệnh':<10} {'n':>5} {'p50':>9} {'p95':>9} {'p99':>9} {'lệnh/s':>8} "
+          f"{'db':>8} {'vẽ':>8} {'gửi':>8} {'SQL':>6}  {'p95 so với baseline' if baseline else ''}")
+    for name, row in results.items():
+        line = (f"{name:<10} {row['count']:>5} {row['p50_ms']:>7.1f}ms {row['p95_ms']:>7.1f}ms "
+                f"{row['p99_ms']:>7.1f}ms {row['throughput']:>8.1f} {row['db_ms']:>6.1f}ms "
+                f"{row['render_ms']:>6.1f}ms {row['send_ms']:>6.1f}ms {row['queries']:>6.1f}")
+        if row['errors']:
+            line += f"  ({row['errors']} lỗi)"
+        old = (baseline or {}).get(name)
+        if old:
+            line += f"  {regression(old, row):+.0%}"
+        print(line)
+
+def regression(old, new):
+    return new['p95_ms'] / old['p95_ms'] - 1 if old['p95_ms'] else 0.0
+
+async def run(args):
+    import bot as bot_module  # sau khi đặt biến môi trường: bot đọc cấu hình lúc import
+    freeze_clock(args.now)
+    logging.getLogger().setLevel(logging.WARNING)
+    logging.getLogger('finance.diagnostics').setLevel(logging.ERROR)
+    rng = random.Random(args.seed)
+    results = {}
+    try:
+        for name in args.commands:
+            results[name] = await bench_command(bot_module, name, args, rng)
+            print(f"  {name}: {results[name]['count']} lần, p95 {results[name]['p95_ms']:.1f} ms", flush=True)
+    finally:
+        bot_module.chart_renderer.close()
+        bot_module.router.close()
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--db', help='file database; tạo mới nếu chưa có (mặc định: file tạm)')
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--transactions', type=int, default=200, help='số giao dịch mỗi user khi tạo database')
+    parser.add_argument('--commands', nargs='+', default=list(COMMANDS), choices=COMMANDS)
+    parser.add_argument('--iterations', type=int, default=200, help='số lần đo mỗi lệnh')
+    parser.add_argument('--warmup', type=int, default=5)
+    parser.add_argument('--concurrency', type=int, default=1, help='số lệnh chạy song song')
+    parser.add_argument('--send-latency', type=float, default=0.0, help='giây giả lập cho mỗi lần gửi tin nhắn')
+    parser.add_argument('--no-guild', dest='guild', action='store_false', help='chạy lệnh như trong DM')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--now', type=parse_now, default=DEFAULT_NOW,
+                        help='thời điểm cuối của dữ liệu và đồng hồ của bot khi đo (như generate_data.py --now)')
+    parser.add_argument('--output', help='file JSON kết quả (mặc định: bench/results/commands-<commit>.json)')
+    parser.add_argument('--baseline', help='file JSON của lần chạy trước để so sánh p95')
+    parser.add_argument('--max-regression', type=float,
+                        help='thoát với mã 1 nếu p95 của lệnh nào tăng quá tỷ lệ này (vd. 0.2)')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='bench-commands-')
+    path = args.db or os.path.join(workdir, 'bench.db')
+    if os.path.exists(path):
+        print(f'Dùng database có sẵn {path}')
+    else:
+        started = time.perf_counter()
+        generate(path, args.users, args.transactions, seed=args.seed, now=args.now, log=lambda message: None)
+        print(f'Tạo {path}: {args.users:,} user × {args.transactions:,} giao dịch trong '
+              f'{time.perf_counter() - started:.1f}s')
+    with sqlite3.connect(path) as conn:
+        args.users = conn.execute('SELECT MAX(user_id) FROM users').fetchone()[0] or args.users
+    os.environ.update({
+        'FINANCE_BOT_DB': path,
+        'FINANCE_BOT_SHARDS': os.path.join(workdir, 'shards.json'),
+        'FINANCE_BOT_BACKUP_DIR': os.path.join(workdir, 'backups'),
+        'FINANCE_BOT_METRICS_PORT': '0',
+    })
+
+    results = asyncio.run(run(args))
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)['commands']
+    print_table(results, baseline)
+
+    commit = git_commit()
+    output = args.output or os.path.join(ROOT, 'bench', 'results', f"commands-{commit or 'local'}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump({
+            'meta': {
+                'commit': commit,
+                'time': datetime.now().isoformat(timespec='seconds'),
+                'python': platform.python_version(),
+                'sqlite': sqlite3.sqlite_version,
+                'db': args.db,
+                'users': args.users,
+                'transactions_per_user': args.transactions,
+                'iterations': args.iterations,
+                'concurrency': args.concurrency,
+                'send_latency': args.send_latency,
+                'guild': args.guild,
+                'seed': args.seed,
+                'now': args.now.strftime('%Y-%m-%d %H:%M:%S'),
+            },
+            'commands': results,
+        }, f, ensure_ascii=False, indent=2)
+    print(f'Đã lưu {output}')
+
+    if baseline and args.max_regression is not None:
+        worse = [name for name, row in results.items()
+                 if name in baseline and regression(baseline[name], row) > args.max_regression]
+        if worse:
+            print(f"❌ p95 tăng quá {args.max_regression:.0%}: {', '.join(worse)}")
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,394 @@
+"""Sinh database tài chính tổng hợp, phân bố gần với dữ liệu thật.
+
+  - Mức hoạt động theo phân phối Zipf: số ít user ghi rất nhiều, đa số ghi ít.
+  - Chi tiêu theo các danh mục mặc định (migration 001), số tiền và giờ
+    trong ngày theo từng loại; lương hàng tháng vào ngày cố định; tiền nhà
+    là giao dịch định kỳ 30 ngày (dòng đầu là quy tắc recurring, có next_due).
+  - Danh mục riêng, ngân sách, mục tiêu tiết kiệm, thông báo tóm tắt ngày,
+    thành viên guild; rollup, chỉ mục tìm kiếm và thành tích được dựng lại.
+
+Cùng seed, cùng --now (và cùng tham số) luôn cho cùng database, không phụ
+thuộc số process hay ngày chạy: mỗi cửa sổ thời gian có bộ sinh ngẫu nhiên
+riêng, dữ liệu kết thúc ở --now (mặc định DEFAULT_NOW). Giao dịch được ghi
+theo thứ tự thời gian như khi bot chạy thật.
+
+    python bench/generate_data.py big.db --users 100000 --transactions 1000 --guilds 200
+    python bench/generate_data.py today.db --now now
+"""
+import argparse
+import math
+import multiprocessing
+import os
+import random
+import sqlite3
+import sys
+import time
+from datetime import datetime, timedelta
+from itertools import accumulate
+from operator import itemgetter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import achievements  # noqa: E402
+import notifier  # noqa: E402
+import rollup  # noqa: E402
+import shards  # noqa: E402
+from database import DATE_FORMAT, from_ts, to_ts  # noqa: E402
+
+DAY = 86400
+DEFAULT_NOW = '2026-06-15 12:00:00'  # giữa tháng: lệnh theo tháng/tuần đều có dữ liệu
+WINDOW_ROWS = 500_000  # số giao dịch tự do mỗi cửa sổ (mỗi lần executemany/commit)
+RENT_INTERVAL = 30  # ngày, như /recurring add ... 30
+
+# (trọng số, số tiền nhỏ nhất, lớn nhất, [mô tả]) theo tên danh mục mặc định
+PROFILES = {
+    'Ăn uống': (40, 20_000, 300_000, ('Cơm trưa', 'Cà phê', 'Trà sữa', 'Bún bò', 'Phở', 'Bánh mì', 'Ăn tối')),
+    'Giao thông': (15, 10_000, 500_000, ('Xăng xe', 'Grab', 'Gửi xe', 'Vé xe buýt', 'Sửa xe')),
+    'Nhà cửa': (8, 100_000, 2_000_000, ('Tiền điện', 'Tiền nước', 'Internet', 'Gas', 'Đồ gia dụng')),
+    'Y tế': (5, 50_000, 2_000_000, ('Thuốc', 'Khám bệnh', 'Nha khoa')),
+    'Giải trí': (10, 50_000, 1_000_000, ('Xem phim', 'Karaoke', 'Netflix', 'Game', 'Du lịch')),
+    'Quần áo': (8, 100_000, 2_000_000, ('Áo thun', 'Giày', 'Shopee', 'Quần jean')),
+    'Giáo dục': (4, 200_000, 5_000_000, ('Sách', 'Khóa học', 'Học phí')),
+    'Kinh doanh': (3, 500_000, 20_000_000, ('Bán hàng online', 'Freelance', 'Hoa hồng')),
+    'Quà tặng': (1, 100_000, 5_000_000, ('Lì xì', 'Quà sinh nhật', 'Thưởng')),
+}
+FALLBACK_PROFILE = (2, 50_000, 1_000_000, ('Khác',))
+CUSTOM_CATEGORIES = ('Thú cưng', 'Con cái', 'Đầu tư', 'Cà phê', 'Cafe làm việc', 'Từ thiện')
+GOAL_NAMES = ('Mua xe', 'Du lịch', 'Quỹ khẩn cấp', 'Mua nhà', 'Laptop mới', 'Đám cưới')
+# Trọng số theo giờ trong ngày (0h..23h): cao điểm trưa và tối
+HOUR_WEIGHTS = (1, 0, 0, 0, 0, 1, 2, 5, 6, 5, 4, 6, 9, 7, 4, 4, 5, 7, 9, 8, 6, 4, 3, 2)
+
+TRANSACTION_COLUMNS = ('user_id', 'amount', 'type', 'category', 'description', 'date', 'ts', 'guild_id',
+                       'recurring', 'recurring_interval', 'next_due')
+
+def parse_now(text):
+    """'YYYY-MM-DD[ HH:MM:SS]' hoặc 'now' (giờ hiện tại, dữ liệu khác nhau giữa các lần chạy)"""
+    if text == 'now':
+        return datetime.now().replace(microsecond=0)
+    try:
+        return datetime.strptime(text, DATE_FORMAT)
+    except ValueError:
+        return datetime.strptime(text, '%Y-%m-%d').replace(hour=12)
+
+# ==== KẾ HOẠCH: THUỘC TÍNH CỐ ĐỊNH CỦA TỪNG USER ====
+class Plan:
+    """Mọi thứ các cửa sổ cần để sinh giao dịch; dựng một lần từ seed"""
+
+    def __init__(self, users, transactions, months, guilds, zipf, seed, categories, now):
+        self.users = users
+        self.seed = seed
+        self.end_day = to_ts(now) // DAY + 1  # cửa sổ cuối kết thúc hết hôm nay
+        self.start_day = self.end_day - round(months * 30.44)
+        self.now_ts = to_ts(now)
+        span = self.end_day - self.start_day
+        self.discretionary = users * transactions
+        self.window_days = max(1, min(31, span * WINDOW_ROWS // max(self.discretionary, 1)))
+
+        rng = random.Random(f'{seed}:plan')
+        # Hạng Zipf xáo trộn để user nhiều giao dịch không luôn là id nhỏ
+        ranks = list(range(1, users + 1))
+        rng.shuffle(ranks)
+        self.user_cum = list(accumulate(rank ** -zipf for rank in ranks))
+        # Phần lớn user có từ đầu, số còn lại tham gia rải rác
+        self.join_day = [self.start_day + int(span * 0.8 * rng.random() ** 3) for _ in range(users)]
+        self.guild = ([None] * users if not guilds else
+                      rng.choices(range(1, guilds + 1),
+                                  cum_weights=list(accumulate(g ** -zipf for g in range(1, guilds + 1))), k=users))
+
+        self.salary_by_dom = {}
+        self.salary = [0] * users
+        self.rent_by_phase = {}
+        self.rent = [0] * users
+        self.rent_first = [None] * users
+        for user in range(users):
+            self.salary[user] = min(max(round(rng.lognormvariate(math.log(12_000_000), 0.5), -5), 4_000_000),
+                                    80_000_000)
+            self.salary_by_dom.setdefault(rng.randint(1, 10), []).append(user)
+            if rng.random() < 0.6:
+                first = self.join_day[user] + rng.randrange(RENT_INTERVAL)
+                self.rent[user] = round(self.salary[user] * rng.uniform(0.15, 0.35), -5)
+                self.rent_first[user] = first
+                self.rent_by_phase.setdefault(first % RENT_INTERVAL, []).append(user)
+
+        names = [name for name, _ in categories]
+        profiles = [PROFILES.get(name, FALLBACK_PROFILE) for name in names]
+        self.categories = [(name, cat_type, low, math.log(high / low), descriptions)
+                           for (name, cat_type), (_, low, high, descriptions) in zip(categories, profiles)]
+        self.category_cum = list(accumulate(weight for weight, *_ in profiles))
+
+    def windows(self):
+        return [(day, min(day + self.window_days, self.end_day))
+                for day in range(self.start_day, self.end_day, self.window_days)]
+
+    def next_rent_ts(self, user):
+        """next_due của quy tắc tiền nhà: lần đến hạn đầu tiên sau hiện tại"""
+        first = self.rent_first[user] * DAY + 8 * 3600
+        due = first + RENT_INTERVAL * DAY
+        if due <= self.now_ts:
+            due += (self.now_ts - due) // (RENT_INTERVAL * DAY) * RENT_INTERVAL * DAY + RENT_INTERVAL * DAY
+        return due
+
+# ==== SINH GIAO DỊCH THEO CỬA SỔ ====
+_plan = None
+_times = None
+
+def init_worker(plan):
+    global _plan, _times
+    _plan = plan
+    _times = [f' {second // 3600:02d}:{second // 60 % 60:02d}:{second % 60:02d}' for second in range(DAY)]
+
+def generate_window(window):
+    """Giao dịch của các ngày [start, end), xếp theo thời gian; kèm (thu - chi, ts cuối) theo user"""
+    plan, times = _plan, _times
+    start, end = window
+    rng = random.Random(f'{plan.seed}:{start}')
+    days = {day: from_ts(day * DAY).strftime('%Y-%m-%d') for day in range(start, end)}
+    rows = []
+    append = rows.append
+    now_ts = plan.now_ts  # cửa sổ cuối chứa hôm nay: không sinh giao dịch trong tương lai
+
+    for day in range(start, end):
+        # Lương: ngày cố định trong tháng, khoảng 9h sáng
+        for user in plan.salary_by_dom.get(from_ts(day * DAY).day, ()):
+            ts = day * DAY + 9 * 3600 + rng.randrange(3600)
+            if day >= plan.join_day[user] and ts <= now_ts:
+                append((user + 1, plan.salary[user], 'income', 'Lương', 'Lương tháng',
+                        days[day] + times[ts % DAY], ts, plan.guild[user], 0, 0, None))
+        # Tiền nhà: mỗi 30 ngày; lần đầu là quy tắc định kỳ
+        for user in plan.rent_by_phase.get(day % RENT_INTERVAL, ()):
+            first = plan.rent_first[user]
+            ts = day * DAY + 8 * 3600
+            if first is not None and first <= day and ts <= now_ts:
+                rule = day == first
+                append((user + 1, plan.rent[user], 'expense', 'Nhà cửa', 'Tiền nhà',
+                        days[day] + times[ts % DAY], ts, plan.guild[user], int(rule),
+                        RENT_INTERVAL if rule else 0, plan.next_rent_ts(user) if rule else None))
+
+    count = round(plan.discretionary * (end - start) / (plan.end_day - plan.start_day))
+    if count:
+        users = rng.choices(range(plan.users), cum_weights=plan.user_cum, k=count)
+        categories = rng.choices(plan.categories, cum_weights=plan.category_cum, k=count)
+        hours = rng.choices(range(24), weights=HOUR_WEIGHTS, k=count)
+        rand, span, join_day, guild = rng.random, end - start, plan.join_day, plan.guild
+        for user, (name, cat_type, low, log_range, descriptions), hour in zip(users, categories, hours):
+            day = start + int(rand() * span)
+            ts = day * DAY + hour * 3600 + int(rand() * 3600)
+            if day < join_day[user] or ts > now_ts:
+                continue
+            amount = int(low * math.exp(rand() * log_range)) // 1000 * 1000
+            append((user + 1, amount, cat_type, name, descriptions[int(rand() * len(descriptions))],
+                    days[day] + times[ts % DAY], ts, guild[user], 0, 0, None))
+
+    rows.sort(key=itemgetter(6))
+    net = {}
+    last = {}
+    for row in rows:
+        user_id = row[0]
+        net[user_id] = net.get(user_id, 0) + (row[1] if row[2] == 'income' else -row[1])
+        last[user_id] = row[6]
+    return rows, net, last
+
+# ==== GHI DATABASE ====
+def extra_rows(plan, now):
+    """Danh mục riêng, ngân sách, mục tiêu tiết kiệm và cài đặt của user"""
+    rng = random.Random(f'{plan.seed}:extra')
+    expense_names = [name for name, cat_type, *_ in plan.categories if cat_type == 'expense']
+    month_start = now.replace(day=1)
+    month_end = (month_start + timedelta(days=32)).replace(day=1) - timedelta(days=1)
+    categories, budgets, goals, settings = [], [], [], []
+    for user in range(plan.users):
+        user_id = user + 1
+        if rng.random() < 0.05:
+            for name in rng.sample(CUSTOM_CATEGORIES, rng.randint(1, 3)):
+                categories.append((user_id, name, 'expense', '#%06X' % rng.randrange(0x1000000), '📌'))
+        monthly_budget = 0
+        if rng.random() < 0.3:
+            for name in rng.sample(expense_names, rng.randint(1, 3)):
+                budgets.append((user_id, name, round(plan.salary[user] * rng.uniform(0.05, 0.3), -5), 'monthly',
+                                month_start.strftime('%Y-%m-%d'), month_end.strftime('%Y-%m-%d')))
+            monthly_budget = round(plan.salary[user] * rng.uniform(0.5, 0.9), -5)
+        if rng.random() < 0.2:
+            for name in rng.sample(GOAL_NAMES, rng.randint(1, 2)):
+                target = round(plan.salary[user] * rng.uniform(2, 30), -5)
+                deadline = now + timedelta(days=rng.randint(30, 1000))
+                goals.append((user_id, name, target, round(target * rng.random(), -3), deadline.strftime('%Y-%m-%d'),
+                              from_ts(plan.join_day[user] * DAY).strftime(DATE_FORMAT)))
+        goal = round(plan.salary[user] * rng.uniform(3, 50), -5) if rng.random() < 0.25 else 0
+        settings.append((goal, monthly_budget, int(rng.random() < 0.85)))
+    return categories, budgets, goals, settings
+
+def generate(path, users=1000, transactions=200, months=12, guilds=0, zipf=1.0, seed=42, workers=None,
+             search_index=True, now=None, log=print):
+    """Tạo database mới tại path, dữ liệu kết thúc ở now (mặc định DEFAULT_NOW); trả về {bước: giây} và số dòng"""
+    if os.path.exists(path):
+        raise FileExistsError(path)
+    now = (now or parse_now(DEFAULT_NOW)).replace(microsecond=0)
+    timings = {}
+    started = time.perf_counter()
+
+    def step(name):
+        nonlocal started
+        timings[name] = time.perf_counter() - started
+        log(f'  {name}: {timings[name]:.1f}s')
+        started = time.perf_counter()
+
+    shards.migrate(path)
+    conn = sqlite3.connect(path, isolation_level=None)
+    # Chỉ an toàn khi nạp file mới: mất điện giữa chừng thì tạo lại
+    conn.execute('PRAGMA journal_mode = OFF')
+    conn.execute('PRAGMA synchronous = OFF')
+    conn.execute('PRAGMA locking_mode = EXCLUSIVE')
+    conn.execute('PRAGMA cache_size = -262144')
+    categories = conn.execute("SELECT name, type FROM categories WHERE user_id = 0 ORDER BY id").fetchall()
+    plan = Plan(users, transactions, months, guilds, zipf, seed, categories, now)
+
+    # Index phụ được dựng lại sau cùng: sắp xếp một lần nhanh hơn chèn từng dòng, và
+    # rollup/thành tích quét thẳng bảng nhanh hơn đi theo index (user_id, ts)
+    indexes = conn.execute('''
+        SELECT name, sql FROM sqlite_master
+        WHERE type = 'index' AND tbl_name = 'transactions' AND sql IS NOT NULL
+    ''').fetchall()
+    for name, _ in indexes:
+        conn.execute(f'DROP INDEX {name}')
+    step('chuẩn bị')
+
+    insert = f'''
+        INSERT INTO transactions ({', '.join(TRANSACTION_COLUMNS)})
+        VALUES ({', '.join('?' * len(TRANSACTION_COLUMNS))})
+    '''
+    balance = [0] * (users + 1)
+    last_ts = [None] * (users + 1)
+    total = 0
+    windows = plan.windows()
+    workers = os.cpu_count() if workers is None else workers
+    if workers > 1:
+        pool = multiprocessing.get_context('spawn').Pool(min(workers, len(windows)), init_worker, (plan,))
+        results = pool.imap(generate_window, windows)  # giữ thứ tự cửa sổ
+    else:
+        pool = None
+        init_worker(plan)
+        results = map(generate_window, windows)
+    try:
+        for rows, net, last in results:
+            conn.execute('BEGIN')
+            conn.executemany(insert, rows)
+            conn.execute('COMMIT')
+            total += len(rows)
+            for user_id, amount in net.items():
+                balance[user_id] += amount
+            for user_id, ts in last.items():
+                last_ts[user_id] = ts
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    # User chi nhiều hơn thu: thêm số dư ban đầu lúc tham gia để không ai âm tiền
+    # (ghi sau cùng nên id lớn, nhưng ts/date vẫn là ngày tham gia)
+    opening = []
+    for user in range(users):
+        if balance[user + 1] < 0:
+            ts = plan.join_day[user] * DAY + 7 * 3600
+            opening.append((user + 1, -balance[user + 1], 'income', 'Khác', 'Số dư ban đầu',
+                            from_ts(ts).strftime(DATE_FORMAT), ts, plan.guild[user], 0, 0, None))
+            balance[user + 1] = 0
+    conn.executemany(insert, opening)
+    total += len(opening)
+    step('giao dịch')
+    log(f'  → {total:,} dòng, {total / timings["giao dịch"]:,.0f} dòng/s')
+
+    custom_categories, budgets, goals, settings = extra_rows(plan, now)
+    conn.execute('BEGIN')
+    conn.executemany('''
+        INSERT INTO users (user_id, username, balance, goal, monthly_budget, notifications, created_date, last_active)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ''', [(user + 1, f'user{user + 1}', balance[user + 1], goal, monthly_budget, notifications,
+           from_ts(plan.join_day[user] * DAY).strftime(DATE_FORMAT),
+           from_ts(last_ts[user + 1]).strftime(DATE_FORMAT) if last_ts[user + 1] else None)
+          for user, (goal, monthly_budget, notifications) in enumerate(settings)])
+    conn.executemany('INSERT INTO categories (user_id, name, type, color, icon) VALUES (?, ?, ?, ?, ?)',
+                     custom_categories)
+    conn.executemany('''
+        INSERT INTO budgets (user_id, category, amount, period, start_date, end_date) VALUES (?, ?, ?, ?, ?, ?)
+    ''', budgets)
+    conn.executemany('''
+        INSERT INTO savings_goals (user_id, name, target_amount, current_amount, deadline, created_date)
+        VALUES (?, ?, ?, ?, ?, ?)
+    ''', goals)
+    if guilds:
+        conn.executemany('INSERT INTO guild_members (guild_id, user_id, joined_date) VALUES (?, ?, ?)',
+                         [(plan.guild[user], user + 1, from_ts(plan.join_day[user] * DAY).strftime(DATE_FORMAT))
+                          for user in range(users)])
+    conn.execute('COMMIT')
+    step('users, danh mục, ngân sách, mục tiêu')
+
+    conn.execute('BEGIN')
+    rollup.rebuild(conn)
+    achievements.rebuild(conn, now.strftime(DATE_FORMAT))
+    # Tóm tắt ngày của 14 ngày gần nhất, như notifier đã gửi cho user bật thông báo
+    summary_start = (now.replace(hour=0, minute=0, second=0) - timedelta(days=14))
+    conn.execute('''
+        INSERT INTO notifications (user_id, message, type, status, ref, created_date)
+        SELECT t.user_id,
+               printf('Thu %d ₫ • Chi %d ₫ • %d giao dịch',
+                      SUM(CASE WHEN t.type = 'income' THEN t.amount ELSE 0 END),
+                      SUM(CASE WHEN t.type = 'expense' THEN t.amount ELSE 0 END), COUNT(*)),
+               ?, 'sent', substr(t.date, 1, 10), substr(t.date, 1, 10) || ' 08:00:00'
+        FROM transactions t JOIN users u ON u.user_id = t.user_id
+        WHERE t.ts >= ? AND t.ts < ? AND u.notifications = 1
+        GROUP BY t.user_id, substr(t.date, 1, 10)
+    ''', (notifier.DAILY_SUMMARY, to_ts(summary_start), to_ts(now.replace(hour=0, minute=0, second=0))))
+    conn.execute('COMMIT')
+    step('rollup, thành tích, thông báo')
+
+    if search_index:
+        # Như fulltext.index_rows nhưng chạy hoàn toàn trong SQLite
+        conn.execute('''
+            INSERT INTO transactions_fts (rowid, description, category, user_id)
+            SELECT id, replace(replace(description, 'đ', 'd'), 'Đ', 'D'),
+                   replace(replace(category, 'đ', 'd'), 'Đ', 'D'), user_id
+            FROM transactions
+        ''')
+        step('chỉ mục tìm kiếm')
+
+    for _, sql in indexes:
+        conn.execute(sql)
+    step(f'index ({len(indexes)})')
+
+    conn.execute('PRAGMA locking_mode = NORMAL')
+    conn.execute('PRAGMA journal_mode = WAL')
+    conn.close()
+    return {'transactions': total, 'users': users, 'timings': timings}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('path', help='file database mới')
+    parser.add_argument('--users', type=int, default=10000)
+    parser.add_argument('--transactions', type=int, default=100,
+                        help='số giao dịch chi tiêu trung bình mỗi user (chưa tính lương, tiền nhà)')
+    parser.add_argument('--months', type=int, default=12, help='khoảng thời gian tính đến --now')
+    parser.add_argument('--now', type=parse_now, default=DEFAULT_NOW,
+                        help=f"thời điểm cuối của dữ liệu, 'YYYY-MM-DD[ HH:MM:SS]' hoặc 'now' (mặc định {DEFAULT_NOW})")
+    parser.add_argument('--guilds', type=int, default=0, help='số guild (0: mọi giao dịch như trong DM)')
+    parser.add_argument('--zipf', type=float, default=1.0, help='số mũ Zipf của mức hoạt động theo user/guild')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--workers', type=int, default=None, help='số process sinh dữ liệu (mặc định: số CPU)')
+    parser.add_argument('--no-search-index', dest='search_index', action='store_false',
+                        help='bỏ qua chỉ mục FTS (nạp nhanh hơn, /search không có kết quả)')
+    parser.add_argument('--force', action='store_true', help='xóa file cũ nếu đã có')
+    args = parser.parse_args()
+
+    if args.force:
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(args.path + suffix):
+                os.remove(args.path + suffix)
+    started = time.perf_counter()
+    result = generate(args.path, args.users, args.transactions, args.months, args.guilds, args.zipf,
+                      args.seed, args.workers, args.search_index, args.now)
+    elapsed = time.perf_counter() - started
+    print(f"✅ {args.path}: {result['users']:,} user, {result['transactions']:,} giao dịch đến {args.now} trong "
+          f"{elapsed:.1f}s ({result['transactions'] / elapsed:,.0f} dòng/s tính cả rollup, index, FTS), "
+          f"{os.path.getsize(args.path) / 1e6:,.0f} MB")
+
+if __name__ == '__main__':
+    main()
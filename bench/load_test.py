@@ -0,0 +1,360 @@
+"""Load test: lưu lượng hỗn hợp từ nhiều guild, tăng dần tới khi bot bão hòa.
+
+Lệnh đến theo quá trình Poisson (vòng hở: không chờ lệnh trước xong) với
+tốc độ tăng theo từng giai đoạn; mỗi lệnh của một user ngẫu nhiên trong
+guild của user đó, chạy đúng coroutine của bot với ctx giả và send có độ
+trễ mạng giả lập. Mỗi giai đoạn đo độ trễ đầu-cuối (tính từ lúc lệnh
+"đến", gồm cả thời gian chờ event loop), thông lượng thực, độ trễ event
+loop, số lần loop bị chặn, lỗi khóa database và số lần transaction phải
+chạy lại vì database bận.
+
+Giai đoạn bão hòa đầu tiên là khi hàng đợi dồn lại (cuối giai đoạn còn
+nhiều hơn tốc độ × SLO lệnh chưa xong), p95 vượt --slo-ms, hoặc số lệnh
+đang chờ vượt --max-inflight.
+Tốc độ bền vững (giai đoạn trước đó) chia cho --guild-rate cho ra số guild
+ước tính một process phục vụ được.
+
+    python bench/load_test.py --users 5000 --guilds 100 --start-rate 20 --max-rate 1000
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bench_commands import (COMMANDS, ROOT, FakeContext, FakeGuild, FakeMember, command_args,  # noqa: E402
+                            freeze_clock, git_commit)
+from generate_data import DEFAULT_NOW, generate, parse_now  # noqa: E402
+
+sys.path.insert(0, ROOT)
+
+from database import is_busy  # noqa: E402
+
+# Tỷ lệ lệnh giống giờ cao điểm: chủ yếu ghi chép và xem số dư
+DEFAULT_MIX = 'spend=40,add=15,balance=25,history=6,stats=4,report=4,chart=3,export=2,search=1'
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(','):
+        name, _, weight = part.partition('=')
+        mix[name.strip()] = float(weight or 1)
+    return mix
+
+def stage_rates(start, maximum, growth):
+    rates = []
+    rate = start
+    while rate <= maximum:
+        rates.append(round(rate, 1))
+        rate *= growth
+    return rates
+
+def percentiles(values):
+    if not values:
+        return {'p50_ms': None, 'p95_ms': None, 'p99_ms': None, 'max_ms': None}
+    values = sorted(values)
+    cuts = statistics.quantiles(values, n=100, method='inclusive') if len(values) > 1 else values * 99
+    return {'p50_ms': cuts[49] * 1000, 'p95_ms': cuts[94] * 1000, 'p99_ms': cuts[98] * 1000,
+            'max_ms': values[-1] * 1000}
+
+# ==== TẢI ====
+class LoadTest:
+    def __init__(self, bot_module, members, args):
+        self.bot = bot_module
+        self.members = members  # [(user_id, guild_id hoặc None)]
+        self.guilds = {}
+        self.args = args
+        self.rng = random.Random(args.seed)
+        mix = parse_mix(args.mix)
+        self.commands = list(mix)
+        self.weights = list(mix.values())
+        self.samples = []  # (giai đoạn, lệnh, lúc đến, độ trễ, lỗi)
+        self.arrivals = 0
+        self.inflight = 0
+        self.dropped = 0
+        self.lock_errors = 0
+        self.tasks = set()
+        self.log = logging.getLogger('bench')
+
+    def guild(self, guild_id):
+        if guild_id is None:
+            return None
+        if guild_id not in self.guilds:
+            self.guilds[guild_id] = FakeGuild(guild_id)
+        return self.guilds[guild_id]
+
+    async def command(self, stage, name, user_id, guild_id, arrived):
+        """Một lệnh như bot.invoke; độ trễ tính từ lúc đến theo lịch"""
+        ctx = FakeContext(self.bot, name, FakeMember(user_id), self.guild(guild_id), self.args.send_latency)
+        call_args, call_kwargs = command_args(name, self.rng, len(self.members))
+        error = None
+        try:
+            await self.bot.remember_member(ctx)
+            try:
+                await ctx.command.callback(ctx, *call_args, **call_kwargs)
+            except Exception:
+                ctx.command_failed = True
+                raise
+            finally:
+                await self.bot.finish_command(ctx)
+        except Exception as e:
+            error = 'locked' if isinstance(e, sqlite3.OperationalError) and is_busy(e) else type(e).__name__
+            if error == 'locked':
+                self.lock_errors += 1
+            else:
+                self.log.warning(f'{name} lỗi: {e!r}')
+        finally:
+            self.inflight -= 1
+        self.samples.append((stage, name, arrived, time.perf_counter() - arrived, error))
+
+    async def run_stage(self, stage, rate, duration):
+        """Sinh lệnh với tốc độ `rate`/s trong `duration` giây"""
+        loop_started = time.perf_counter()
+        arrival = loop_started
+        end = loop_started + duration
+        while True:
+            arrival += self.rng.expovariate(rate)
+            if arrival >= end:
+                break
+            delay = arrival - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            # Loop trễ thì các lệnh đã đến hạn được phát liền nhau: tải không giảm theo bot
+            self.arrivals += 1
+            if self.inflight >= self.args.max_inflight:
+                self.dropped += 1
+                continue
+            name = self.rng.choices(self.commands, self.weights)[0]
+            user_id, guild_id = self.rng.choice(self.members)
+            self.inflight += 1
+            task = asyncio.create_task(self.command(stage, name, user_id, guild_id, arrival))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+        delay = end - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def busy_retries(self):
+        return sum(current.db.busy_retried for current in self.bot.router.shards())
+
+    async def run(self, rates):
+        metrics = self.bot.metrics
+        lag = metrics.LoopLagMonitor(self.args.lag_interval)
+        lag.start()
+        self.bot.watchdog.start(asyncio.get_running_loop())
+        stages = []
+        try:
+            for stage, rate in enumerate(rates):
+                before = {
+                    'arrivals': self.arrivals,
+                    'samples': len(self.samples),
+                    'dropped': self.dropped,
+                    'lock_errors': self.lock_errors,
+                    'busy_retries': self.busy_retries(),
+                    'blocked': self.bot.watchdog.total,
+                    'lag_count': metrics.LOOP_LAG.count(),
+                    'lag_sum': metrics.LOOP_LAG.mean() * metrics.LOOP_LAG.count(),
+                }
+                lag.worst = 0.0
+                started = time.perf_counter()
+                await self.run_stage(stage, rate, self.args.stage_seconds)
+                wall = time.perf_counter() - started
+                lag_count = metrics.LOOP_LAG.count() - before['lag_count']
+                lag_sum = metrics.LOOP_LAG.mean() * metrics.LOOP_LAG.count() - before['lag_sum']
+                finished = self.samples[before['samples']:]
+                own = [sample for sample in finished if sample[0] == stage]
+                result = {
+                    'rate': rate,
+                    'arrivals': self.arrivals - before['arrivals'],
+                    'completed': len(finished),
+                    'throughput': len(finished) / wall,
+                    'backlog': self.inflight,
+                    'dropped': self.dropped - before['dropped'],
+                    'errors': sum(1 for sample in finished if sample[4] and sample[4] != 'locked'),
+                    'lock_errors': self.lock_errors - before['lock_errors'],
+                    'busy_retries': self.busy_retries() - before['busy_retries'],
+                    'loop_lag_mean_ms': lag_sum / lag_count * 1000 if lag_count else 0.0,
+                    'loop_lag_max_ms': lag.worst * 1000,
+                    'loop_blocked': self.bot.watchdog.total - before['blocked'],
+                    **percentiles([sample[3] for sample in own]),
+                }
+                result['saturated'] = self.saturated(result)
+                stages.append(result)
+                print_stage(result)
+                if result['saturated'] and not self.args.keep_going:
+                    break
+        finally:
+            lag.stop()
+            self.bot.watchdog.stop()
+            await self.drain()
+        # Độ trễ đủ (kể cả lệnh xong sau khi giai đoạn kết thúc) và phân theo lệnh
+        for stage, result in enumerate(stages):
+            own = [sample for sample in self.samples if sample[0] == stage]
+            result.update(percentiles([sample[3] for sample in own]))
+            result['commands'] = {
+                name: {'count': len(latencies), **percentiles(latencies)}
+                for name in self.commands
+                for latencies in [[sample[3] for sample in own if sample[1] == name]]
+                if latencies
+            }
+        return stages
+
+    def saturated(self, result):
+        """Lý do giai đoạn bị coi là bão hòa (None nếu bot vẫn theo kịp)"""
+        if result['dropped']:
+            return f"vượt {self.args.max_inflight} lệnh đang chờ"
+        # Little: theo kịp thì số lệnh đang chạy ≈ tốc độ × độ trễ; hơn rate × SLO là hàng đợi đang dồn
+        if result['backlog'] > max(result['rate'] * self.args.slo_ms / 1000, 10):
+            return f"{result['backlog']} lệnh còn chờ cuối giai đoạn"
+        if result['p95_ms'] is not None and result['p95_ms'] > self.args.slo_ms:
+            return f"p95 {result['p95_ms']:.0f} ms > {self.args.slo_ms:.0f} ms"
+        return None
+
+    async def drain(self):
+        if self.tasks:
+            await asyncio.wait(set(self.tasks), timeout=self.args.drain_timeout)
+        for task in list(self.tasks):
+            task.cancel()
+
+# ==== KẾT QUẢ ====
+def print_stage(result):
+    fmt = lambda value: '-' if value is None else f'{value:.0f}'
+    print(f"  {result['rate']:>7.1f}/s  xong {result['throughput']:>7.1f}/s  "
+          f"p50 {fmt(result['p50_ms']):>5} p95 {fmt(result['p95_ms']):>5} p99 {fmt(result['p99_ms']):>5} ms  "
+          f"lag {result['loop_lag_max_ms']:>5.0f} ms  chờ {result['backlog']:>4}  "
+          f"khóa {result['lock_errors']}/{result['busy_retries']}  lỗi {result['errors']}"
+          + (f"  ⚠️ {result['saturated']}" if result['saturated'] else ''), flush=True)
+
+def summarize(stages, guild_rate):
+    sustainable = None
+    saturation = None
+    for result in stages:
+        if result['saturated']:
+            saturation = result
+            break
+        sustainable = result
+    rate = sustainable['throughput'] if sustainable else 0.0
+    return {
+        'sustainable_rate': rate,
+        'saturation_rate': saturation['rate'] if saturation else None,
+        'saturation_reason': saturation['saturated'] if saturation else None,
+        'guild_rate': guild_rate,
+        'estimated_guilds': int(rate / guild_rate) if guild_rate else None,
+    }
+
+def load_members(path):
+    with sqlite3.connect(path) as conn:
+        members = conn.execute('''
+            SELECT u.user_id, MIN(g.guild_id) FROM users u
+            LEFT JOIN guild_members g ON g.user_id = u.user_id
+            GROUP BY u.user_id ORDER BY u.user_id
+        ''').fetchall()
+    return members
+
+async def run(args, members, rates):
+    import bot as bot_module  # sau khi đặt biến môi trường: bot đọc cấu hình lúc import
+    freeze_clock(args.now)
+    logging.getLogger().setLevel(logging.WARNING)
+    logging.getLogger('finance.diagnostics').setLevel(logging.ERROR)
+    try:
+        return await LoadTest(bot_module, members, args).run(rates)
+    finally:
+        bot_module.chart_renderer.close()
+        bot_module.router.close()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--db', help='file database; tạo mới nếu chưa có (mặc định: file tạm)')
+    parser.add_argument('--users', type=int, default=5000)
+    parser.add_argument('--transactions', type=int, default=100, help='số giao dịch mỗi user khi tạo database')
+    parser.add_argument('--guilds', type=int, default=100, help='số guild khi tạo database')
+    parser.add_argument('--mix', default=DEFAULT_MIX, help='tỷ lệ lệnh, dạng lệnh=trọng số,...')
+    parser.add_argument('--start-rate', type=float, default=20, help='lệnh/s của giai đoạn đầu')
+    parser.add_argument('--max-rate', type=float, default=2000)
+    parser.add_argument('--growth', type=float, default=1.5, help='hệ số tăng tốc độ mỗi giai đoạn')
+    parser.add_argument('--stage-seconds', type=float, default=10)
+    parser.add_argument('--send-latency', type=float, default=0.08, help='giây giả lập cho mỗi lần gửi tin nhắn')
+    parser.add_argument('--slo-ms', type=float, default=500, help='p95 tối đa còn chấp nhận được')
+    parser.add_argument('--max-inflight', type=int, default=5000, help='số lệnh đang chờ tối đa trước khi bỏ')
+    parser.add_argument('--lag-interval', type=float, default=0.05, help='chu kỳ đo độ trễ event loop (giây)')
+    parser.add_argument('--drain-timeout', type=float, default=30)
+    parser.add_argument('--guild-rate', type=float, default=0.05,
+                        help='lệnh/s của một guild lúc cao điểm, để ước tính số guild (mặc định 3 lệnh/phút)')
+    parser.add_argument('--keep-going', action='store_true', help='chạy hết các giai đoạn kể cả khi đã bão hòa')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--now', type=parse_now, default=DEFAULT_NOW,
+                        help='thời điểm cuối của dữ liệu và đồng hồ của bot khi đo (như generate_data.py --now)')
+    parser.add_argument('--output', help='file JSON kết quả (mặc định: bench/results/load-<commit>.json)')
+    args = parser.parse_args()
+
+    mix = parse_mix(args.mix)
+    unknown = set(mix) - set(COMMANDS)
+    if unknown:
+        parser.error(f"lệnh không hỗ trợ trong --mix: {', '.join(sorted(unknown))}")
+    rates = stage_rates(args.start_rate, args.max_rate, args.growth)
+    if not rates:
+        parser.error('--start-rate phải nhỏ hơn hoặc bằng --max-rate')
+
+    workdir = tempfile.mkdtemp(prefix='bench-load-')
+    path = args.db or os.path.join(workdir, 'load.db')
+    if os.path.exists(path):
+        print(f'Dùng database có sẵn {path}')
+    else:
+        started = time.perf_counter()
+        generate(path, args.users, args.transactions, guilds=args.guilds, seed=args.seed, now=args.now,
+                 log=lambda message: None)
+        print(f'Tạo {path}: {args.users:,} user, {args.guilds} guild trong {time.perf_counter() - started:.1f}s')
+    members = load_members(path)
+    os.environ.update({
+        'FINANCE_BOT_DB': path,
+        'FINANCE_BOT_SHARDS': os.path.join(workdir, 'shards.json'),
+        'FINANCE_BOT_BACKUP_DIR': os.path.join(workdir, 'backups'),
+        'FINANCE_BOT_METRICS_PORT': '0',
+    })
+
+    print(f"{len(members):,} user, {len({guild for _, guild in members if guild}):,} guild; "
+          f"{len(rates)} giai đoạn × {args.stage_seconds:g}s")
+    stages = asyncio.run(run(args, members, rates))
+    summary = summarize(stages, args.guild_rate)
+    if summary['saturation_rate']:
+        print(f"Bão hòa ở {summary['saturation_rate']:g} lệnh/s ({summary['saturation_reason']})")
+    print(f"Bền vững: {summary['sustainable_rate']:.1f} lệnh/s ≈ {summary['estimated_guilds']:,} guild "
+          f"ở {args.guild_rate:g} lệnh/s mỗi guild")
+
+    commit = git_commit()
+    output = args.output or os.path.join(ROOT, 'bench', 'results', f"load-{commit or 'local'}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump({
+            'meta': {
+                'commit': commit,
+                'time': datetime.now().isoformat(timespec='seconds'),
+                'python': platform.python_version(),
+                'sqlite': sqlite3.sqlite_version,
+                'cpus': os.cpu_count(),
+                'db': args.db,
+                'users': len(members),
+                'guilds': args.guilds,
+                'mix': parse_mix(args.mix),
+                'stage_seconds': args.stage_seconds,
+                'send_latency': args.send_latency,
+                'slo_ms': args.slo_ms,
+                'seed': args.seed,
+                'now': args.now.strftime('%Y-%m-%d %H:%M:%S'),
+            },
+            'summary': summary,
+            'stages': stages,
+        }, f, ensure_ascii=False, indent=2)
+    print(f'Đã lưu {output}')
+
+if __name__ == '__main__':
+    main()
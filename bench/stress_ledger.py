@@ -0,0 +1,168 @@
+"""Stress test sổ cái: nhiều process chuyển tiền song song vào cùng một file DB.
+
+Sau khi chạy xong, kiểm tra:
+  - không user nào có số dư âm,
+  - tổng tiền không đổi,
+  - số dư của từng user = tổng income - tổng expense trong transactions,
+  - bảng monthly_rollup khớp với dữ liệu dựng lại từ transactions,
+  - có lệnh bị từ chối vì không đủ số dư (mặc định ít user, số dư nhỏ để
+    nhiều lệnh cùng tranh số dư cuối của một ví),
+  - /import một file chỉ có expense vượt số dư bị hoàn tác cả lô.
+
+    python bench/stress_ledger.py --processes 4 --transfers 2000
+"""
+import argparse
+import asyncio
+import io
+import multiprocessing
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import importer  # noqa: E402
+import ledger  # noqa: E402
+import rollup  # noqa: E402
+import users  # noqa: E402
+from database import DATE_FORMAT, Database  # noqa: E402
+from migrations import run_migrations  # noqa: E402
+
+def setup(path, user_count, initial_balance):
+    conn = sqlite3.connect(path, isolation_level=None)
+    run_migrations(conn)
+    conn.close()
+    db = Database(path)
+    now = datetime.now().strftime(DATE_FORMAT)
+    def seed(conn):
+        for user_id in range(1, user_count + 1):
+            users.create_user(conn, user_id, f'user{user_id}')
+            ledger.credit(conn, user_id, initial_balance, 'Lương', 'Số dư ban đầu', now)
+    db.run_sync(seed, immediate=True)
+    db.close()
+
+async def worker_main(path, worker, user_count, transfers, concurrency, max_amount):
+    db = Database(path, pool_size=concurrency)
+    rng = random.Random(worker)
+    stats = {'ok': 0, 'rejected': 0}
+    queue = list(range(transfers))
+
+    async def run_one():
+        while queue:
+            queue.pop()
+            sender, recipient = rng.sample(range(1, user_count + 1), 2)
+            amount = rng.randint(1, max_amount)
+            now = datetime.now().strftime(DATE_FORMAT)
+            if rng.random() < 0.1:
+                ok, _ = await db.run(ledger.debit, sender, amount, 'Ăn uống', 'stress', now, immediate=True)
+            else:
+                ok, _ = await db.run(ledger.transfer, sender, recipient, amount, 'stress gửi', 'stress nhận',
+                                     now, immediate=True)
+            stats['ok' if ok else 'rejected'] += 1
+
+    await asyncio.gather(*(run_one() for _ in range(concurrency)))
+    stats['busy_retried'] = db.busy_retried
+    db.close()
+    return stats
+
+def worker(args):
+    return asyncio.run(worker_main(*args))
+
+def verify(path, user_count, initial_balance):
+    conn = sqlite3.connect(path, isolation_level=None)
+    errors = []
+    negative = conn.execute('SELECT COUNT(*) FROM users WHERE balance < 0').fetchone()[0]
+    if negative:
+        errors.append(f'{negative} user có số dư âm')
+
+    mismatched = conn.execute('''
+        SELECT u.user_id, u.balance, COALESCE(t.net, 0)
+        FROM users u
+        LEFT JOIN (
+            SELECT user_id, SUM(CASE WHEN type = 'income' THEN amount ELSE -amount END) AS net
+            FROM transactions GROUP BY user_id
+        ) t ON t.user_id = u.user_id
+        WHERE u.balance != COALESCE(t.net, 0)
+    ''').fetchall()
+    if mismatched:
+        errors.append(f'{len(mismatched)} user lệch số dư, ví dụ {mismatched[:3]}')
+
+    total, spent = conn.execute('''
+        SELECT (SELECT SUM(balance) FROM users),
+               (SELECT COALESCE(SUM(amount), 0) FROM transactions WHERE category = 'Ăn uống')
+    ''').fetchone()
+    if total + spent != user_count * initial_balance:
+        errors.append(f'tổng tiền lệch: {total} + {spent} != {user_count * initial_balance}')
+
+    before = conn.execute('SELECT * FROM monthly_rollup ORDER BY 1, 2, 3, 4').fetchall()
+    conn.execute('BEGIN')
+    rollup.rebuild(conn)
+    after = conn.execute('SELECT * FROM monthly_rollup ORDER BY 1, 2, 3, 4').fetchall()
+    conn.execute('ROLLBACK')
+    if before != after:
+        errors.append('monthly_rollup không khớp với transactions')
+    conn.close()
+    return errors
+
+def check_import(path, initial_balance):
+    """Nhập file chỉ có expense (tổng lớn hơn số dư) vào database riêng: cả lô phải bị từ chối"""
+    setup(path, 1, initial_balance)
+    rows, amount = 3, initial_balance // 2 + 1
+    now = datetime.now().strftime(DATE_FORMAT)
+    csv_file = io.BytesIO(('date,amount,type,category,description\n' + ''.join(
+        f'{now},{amount},expense,Ăn uống,import {i}\n' for i in range(rows))).encode('utf-8'))
+    conn = sqlite3.connect(path, isolation_level=None)
+    result = importer.import_transactions(conn, 1, csv_file, 'csv')
+    conn.close()
+    errors = []
+    if result.imported or result.rejected != [(1, initial_balance, -amount * rows, rows)]:
+        errors.append(f'import expense vượt số dư không bị từ chối: {result.imported} dòng, {result.rejected}')
+    # Số dư giữ nguyên, không có giao dịch nào của file được ghi
+    errors.extend(f'import: {error}' for error in verify(path, 1, initial_balance))
+    return errors
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--db', help='file database (mặc định: file tạm)')
+    parser.add_argument('--users', type=int, default=5)
+    parser.add_argument('--processes', type=int, default=4)
+    parser.add_argument('--transfers', type=int, default=1000, help='số lệnh mỗi process')
+    parser.add_argument('--concurrency', type=int, default=4, help='số lệnh song song trong mỗi process')
+    parser.add_argument('--initial-balance', type=int, default=300000)
+    parser.add_argument('--max-amount', type=int, default=20000)
+    args = parser.parse_args()
+
+    path = args.db or os.path.join(tempfile.mkdtemp(prefix='ledger-stress-'), 'stress.db')
+    setup(path, args.users, args.initial_balance)
+
+    started = time.perf_counter()
+    ctx = multiprocessing.get_context('spawn')
+    with ctx.Pool(args.processes) as pool:
+        results = pool.map(worker, [(path, i, args.users, args.transfers, args.concurrency, args.max_amount)
+                                    for i in range(args.processes)])
+    elapsed = time.perf_counter() - started
+
+    ok = sum(r['ok'] for r in results)
+    rejected = sum(r['rejected'] for r in results)
+    retried = sum(r['busy_retried'] for r in results)
+    print(f'{ok + rejected} lệnh trong {elapsed:.2f}s ({(ok + rejected) / elapsed:.0f} lệnh/s): '
+          f'{ok} thành công, {rejected} bị từ chối vì không đủ số dư, {retried} lần thử lại do DB bận')
+
+    errors = verify(path, args.users, args.initial_balance)
+    if not rejected:
+        errors.append('không lệnh nào bị từ chối: chưa kiểm tra được trường hợp hết tiền '
+                      '(giảm --initial-balance/--users hoặc tăng --max-amount)')
+    errors += check_import(os.path.join(os.path.dirname(path), 'import-check.db'), args.initial_balance)
+    for error in errors:
+        print(f'❌ {error}')
+    if errors:
+        sys.exit(1)
+    print('✅ Số dư khớp với transactions, không có số dư âm, tổng tiền được bảo toàn, '
+          'lệnh thiếu tiền và import làm âm số dư bị từ chối')
+
+if __name__ == '__main__':
+    main()
@@ -1,20 +1,60 @@
+import time
+_import_started = time.perf_counter()
+
 import discord
 from discord.ext import commands, tasks
-import sqlite3
 import asyncio
-import json
-import matplotlib.pyplot as plt
+import os
 import io
-import base64
-from datetime import datetime, timedelta
+import tempfile
+from datetime import datetime, timedelta, time as dt_time
 from typing import Optional, Dict, List
 import logging
 
+from charts import ChartCache, ChartQueueFull, ChartRenderer
+from database import day_start, from_ts, month_range, to_ts, year_range
+import achievements
+import backup
+import diagnostics
+import fulltext
+import leaderboard
+import ledger
+import metrics
+import notifier
+import recurring
+import rollup
+import shards
+import users
+
+# Thời gian từng bước khởi động (giây), in ra khi bot sẵn sàng
+STARTUP_TIMINGS = {'import': time.perf_counter() - _import_started}
+
 # ==== CẤU HÌNH BOT ====
+class TimedContext(commands.Context):
+    """Context ghi lại lúc nhận lệnh và đo thời gian gửi tin nhắn lên Discord"""
+
+    def __init__(self, **attrs):
+        super().__init__(**attrs)
+        self.created = time.perf_counter()
+        self.timer = None
+
+    async def send(self, *args, **kwargs):
+        with metrics.timed('send'):
+            return await super().send(*args, **kwargs)
+
+class FinanceBot(commands.Bot):
+    async def get_context(self, origin, /, *, cls=TimedContext):
+        return await super().get_context(origin, cls=cls)
+
+    async def close(self):
+        watchdog.stop()
+        await stop_metrics()
+        await super().close()
+
 intents = discord.Intents.default()
 intents.message_content = True
 intents.guilds = True
-bot = commands.Bot(command_prefix=['/', '!'], intents=intents, help_command=None)
+bot = FinanceBot(command_prefix=['/', '!'], intents=intents, help_command=None)
 
 # ==== LOGGING ====
 logging.basicConfig(level=logging.INFO)
@@ -24,127 +64,136 @@ logger = logging.getLogger(__name__)
 CONFIG = {
     'CURRENCY': 'VND',
     'BACKUP_INTERVAL': 3600,  # 1 giờ
-    'MAX_TRANSACTIONS_DISPLAY': 15,
+    'BACKUP_DIR': os.getenv('FINANCE_BOT_BACKUP_DIR', 'backups'),
+    'BACKUP_KEEP': 24,  # số snapshot giữ lại
+    'DAILY_SUMMARY_HOUR': 8,  # giờ gửi tóm tắt ngày hôm trước (giờ máy chủ)
+    'DM_RATE_PER_SECOND': 20,  # mỗi DM tốn ~2 request (mở kênh + gửi), giới hạn toàn cục là 50 req/s
+    'DM_CONCURRENCY': 8,
+    'HISTORY_PAGE_SIZE': 8,
+    'HISTORY_TIMEOUT': 180,  # giây giữ nút chuyển trang
+    'LEADERBOARD_PAGE_SIZE': 10,
+    'LEADERBOARD_GUILDS': 256,  # số guild giữ bảng xếp hạng trong RAM
+    'EXPORT_PART_BYTES': 10 * 1024 * 1024,  # Giới hạn file đính kèm mặc định của Discord
+    'IMPORT_MAX_BYTES': 25 * 1024 * 1024,
+    'IMPORT_MAX_ROWS': 200000,
+    'RECURRING_INTERVAL': 60,  # giây giữa các lần sinh giao dịch định kỳ đến hạn
+    'ACTIVITY_FLUSH_INTERVAL': 30,  # giây giữa các lần ghi dồn last_active
+    'USER_CACHE_ENTRIES': 2048,
+    'USER_CACHE_TTL': 300,  # giây
     'CHART_WIDTH': 12,
-    'CHART_HEIGHT': 8
+    'CHART_HEIGHT': 8,
+    'CHART_WORKERS': 2,
+    'CHART_MAX_PENDING': 8,
+    'CHART_CACHE_ENTRIES': 128,
+    'CHART_CACHE_BYTES': 32 * 1024 * 1024,
+    'CHART_CACHE_DIR': os.getenv('FINANCE_BOT_CHART_CACHE'),  # None: chỉ cache trong RAM
+    'DB_PATH': os.getenv('FINANCE_BOT_DB', 'finance_bot.db'),
+    'DB_POOL_SIZE': 4,
+    'SHARD_MAP': os.getenv('FINANCE_BOT_SHARDS', 'shards.json'),  # {guild_id: file} của các guild có file riêng
+    'SHARD_DIR': 'shards',
+    'METRICS_HOST': '127.0.0.1',  # /metrics chỉ mở cho Prometheus trên cùng máy
+    'METRICS_PORT': int(os.getenv('FINANCE_BOT_METRICS_PORT', '9108')),  # 0: tắt HTTP, vẫn có /admin_metrics
+    'METRICS_TOP_COMMANDS': 10,  # số lệnh hiển thị trong /admin_metrics
+    'LOOP_LAG_INTERVAL': 0.5,  # giây giữa các lần đo độ trễ event loop
+    'WATCHDOG_THRESHOLD': 0.25,  # giây event loop bị chặn thì chụp stack
+    'SLOW_QUERY_SECONDS': 0.1,
+    'DIAGNOSTICS_LOG': os.getenv('FINANCE_BOT_DIAGNOSTICS_LOG', 'diagnostics.log'),
+    'DIAGNOSTICS_LOG_BYTES': 5 * 1024 * 1024,
+    'DIAGNOSTICS_LOG_BACKUPS': 3,
 }
 
+# ==== DATABASE ====
+# Mỗi lệnh được định tuyến tới shard giữ ví của người gọi (xem remember_member);
+# `db` và shard() luôn trỏ tới shard của lệnh đang chạy
+slow_queries = diagnostics.SlowQueryLog(CONFIG['SLOW_QUERY_SECONDS'])
+watchdog = diagnostics.BlockingWatchdog(CONFIG['WATCHDOG_THRESHOLD'])
+router = shards.ShardRouter(CONFIG['DB_PATH'], CONFIG['SHARD_MAP'], CONFIG['SHARD_DIR'],
+                            pool_size=CONFIG['DB_POOL_SIZE'], cache_entries=CONFIG['USER_CACHE_ENTRIES'],
+                            cache_ttl=CONFIG['USER_CACHE_TTL'], max_boards=CONFIG['LEADERBOARD_GUILDS'],
+                            slow_query_log=slow_queries)
+db = shards.RoutedDatabase(router)
+shard = router.current
+chart_cache = ChartCache(max_entries=CONFIG['CHART_CACHE_ENTRIES'], max_bytes=CONFIG['CHART_CACHE_BYTES'],
+                         spill_dir=CONFIG['CHART_CACHE_DIR'])
+chart_renderer = ChartRenderer(workers=CONFIG['CHART_WORKERS'], max_pending=CONFIG['CHART_MAX_PENDING'],
+                               cache=chart_cache)
+leaderboard_lock = asyncio.Lock()
+
+# ==== METRICS ====
+# Thời gian từng lệnh (chia db/render/send) và số câu SQL được đo qua
+# metrics.current_command; các giá trị dưới đây được đọc lúc /metrics được hỏi
+CHART_QUEUE = metrics.REGISTRY.gauge('finance_chart_queue_depth', 'Số biểu đồ đang vẽ hoặc chờ vẽ')
+CACHE_REQUESTS = metrics.REGISTRY.counter('finance_cache_requests_total', 'Số lần đọc cache theo kết quả',
+                                          ('cache', 'shard', 'result'))
+CACHE_ENTRIES = metrics.REGISTRY.gauge('finance_cache_entries', 'Số mục đang có trong cache', ('cache', 'shard'))
+DB_BUSY_RETRIES = metrics.REGISTRY.counter('finance_db_busy_retries_total',
+                                           'Số lần chạy lại transaction vì database bận', ('shard',))
+SLOW_QUERIES = metrics.REGISTRY.counter('finance_slow_queries_total', 'Số câu SQL chạy lâu hơn ngưỡng')
+LOOP_BLOCKED = metrics.REGISTRY.counter('finance_event_loop_blocked_total', 'Số lần event loop bị chặn quá ngưỡng')
+loop_lag = metrics.LoopLagMonitor(CONFIG['LOOP_LAG_INTERVAL'])
+metrics_server = None
+
+def collect_metrics():
+    CHART_QUEUE.set(chart_renderer.pending)
+    cache = chart_cache.stats()
+    CACHE_REQUESTS.set(cache['hits'], 'chart', '', 'hit')
+    CACHE_REQUESTS.set(cache['disk_hits'], 'chart', '', 'disk_hit')
+    CACHE_REQUESTS.set(cache['misses'], 'chart', '', 'miss')
+    CACHE_ENTRIES.set(cache['entries'], 'chart', '')
+    for current in router.shards():
+        for name, user_cache in (('profile', current.profile_cache), ('category', current.category_cache)):
+            counters = user_cache.stats()
+            CACHE_REQUESTS.set(counters['hits'], name, current.name, 'hit')
+            CACHE_REQUESTS.set(counters['misses'], name, current.name, 'miss')
+            CACHE_ENTRIES.set(counters['entries'], name, current.name)
+        DB_BUSY_RETRIES.set(current.db.busy_retried, current.name)
+    SLOW_QUERIES.set(slow_queries.total)
+    LOOP_BLOCKED.set(watchdog.total)
+
+metrics.REGISTRY.collectors.append(collect_metrics)
+
+async def start_metrics():
+    """Đo độ trễ event loop và mở /metrics (một lần, on_ready chạy lại khi kết nối lại)"""
+    global metrics_server
+    loop_lag.start()
+    if metrics_server is not None or not CONFIG['METRICS_PORT']:
+        return
+    try:
+        metrics_server = await metrics.start_http_server(CONFIG['METRICS_HOST'], CONFIG['METRICS_PORT'])
+    except OSError as e:
+        logger.error(f"Không mở được /metrics trên cổng {CONFIG['METRICS_PORT']}: {e}")
+        return
+    logger.info(f"Metrics: http://{CONFIG['METRICS_HOST']}:{CONFIG['METRICS_PORT']}/metrics")
+
+async def stop_metrics():
+    global metrics_server
+    loop_lag.stop()
+    if metrics_server is not None:
+        await metrics_server.cleanup()
+        metrics_server = None
+
 # ==== TẠO DATABASE NÂNG CẤP ====
 def init_database():
-    conn = sqlite3.connect('finance_bot.db')
-    cursor = conn.cursor()
-    
-    # Bảng users nâng cấp
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS users (
-            user_id INTEGER PRIMARY KEY,
-            username TEXT,
-            balance INTEGER DEFAULT 0,
-            goal INTEGER DEFAULT 0,
-            monthly_budget INTEGER DEFAULT 0,
-            savings_goal INTEGER DEFAULT 0,
-            currency TEXT DEFAULT 'VND',
-            timezone TEXT DEFAULT 'Asia/Ho_Chi_Minh',
-            notifications BOOLEAN DEFAULT 1,
-            created_date TEXT,
-            last_active TEXT
-        )
-    ''')
-    
-    # Bảng transactions nâng cấp
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS transactions (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER,
-            amount INTEGER,
-            type TEXT,
-            category TEXT,
-            description TEXT,
-            date TEXT,
-            recurring BOOLEAN DEFAULT 0,
-            recurring_interval INTEGER DEFAULT 0,
-            tags TEXT,
-            FOREIGN KEY (user_id) REFERENCES users (user_id)
-        )
-    ''')
-    
-    # Bảng categories
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS categories (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER,
-            name TEXT,
-            type TEXT,
-            color TEXT,
-            icon TEXT,
-            budget_limit INTEGER DEFAULT 0,
-            FOREIGN KEY (user_id) REFERENCES users (user_id)
-        )
-    ''')
-    
-    # Bảng budgets
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS budgets (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER,
-            category TEXT,
-            amount INTEGER,
-            period TEXT,
-            start_date TEXT,
-            end_date TEXT,
-            FOREIGN KEY (user_id) REFERENCES users (user_id)
-        )
-    ''')
-    
-    # Bảng savings_goals
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS savings_goals (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER,
-            name TEXT,
-            target_amount INTEGER,
-            current_amount INTEGER DEFAULT 0,
-            deadline TEXT,
-            description TEXT,
-            created_date TEXT,
-            FOREIGN KEY (user_id) REFERENCES users (user_id)
-        )
-    ''')
-    
-    # Bảng notifications
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS notifications (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER,
-            message TEXT,
-            type TEXT,
-            read BOOLEAN DEFAULT 0,
-            created_date TEXT,
-            FOREIGN KEY (user_id) REFERENCES users (user_id)
-        )
-    ''')
-    
-    # Thêm categories mặc định
-    cursor.execute('SELECT COUNT(*) FROM categories')
-    if cursor.fetchone()[0] == 0:
-        default_categories = [
-            ('🍔', 'Ăn uống', 'expense', '#FF6B6B'),
-            ('🚗', 'Giao thông', 'expense', '#4ECDC4'),
-            ('🏠', 'Nhà cửa', 'expense', '#45B7D1'),
-            ('💊', 'Y tế', 'expense', '#96CEB4'),
-            ('🎮', 'Giải trí', 'expense', '#FFEAA7'),
-            ('👕', 'Quần áo', 'expense', '#DDA0DD'),
-            ('📚', 'Giáo dục', 'expense', '#98D8C8'),
-            ('💰', 'Lương', 'income', '#00B894'),
-            ('💼', 'Kinh doanh', 'income', '#FDCB6E'),
-            ('🎁', 'Quà tặng', 'income', '#E17055')
-        ]
-        for icon, name, cat_type, color in default_categories:
-            cursor.execute('INSERT INTO categories (user_id, name, type, color, icon) VALUES (0, ?, ?, ?, ?)',
-                         (name, cat_type, color, icon))
-    
-    conn.commit()
-    conn.close()
+    """Chạy các migration còn thiếu trên mọi shard và báo cáo thời gian từng bước"""
+    applied = []
+
+    def migrate(path):
+        for version, name, elapsed in shards.migrate(path):
+            label = '' if path == CONFIG['DB_PATH'] else f" [{path}]"
+            print(f"🛠️ Migration {version:03d}_{name}{label}: {elapsed * 1000:.1f} ms")
+            applied.append((version, name, elapsed))
+
+    # File mặc định trước: có user_homes rồi mới biết hết các file đang giữ ví
+    migrate(router.default.path)
+    router.user_paths = router.load_homes()
+    for path in router.paths()[1:]:
+        migrate(path)
+    return applied
+
+def log_startup_timings():
+    labels = {'import': 'import', 'database': 'database', 'sync': 'đồng bộ slash'}
+    parts = [f"{labels.get(step, step)} {seconds:.2f}s" for step, seconds in STARTUP_TIMINGS.items()]
+    print(f"⏱️ Khởi động: {' • '.join(parts)}")
 
 # ==== HÀM PHỤ NÂNG CÂP ====
 def format_money(amount, currency='VND'):
@@ -152,77 +201,74 @@ def format_money(amount, currency='VND'):
         return f"{amount:,} ₫".replace(",", ".")
     return f"{amount:,} {currency}"
 
-def get_or_create_user(user_id, username=None):
-    conn = sqlite3.connect('finance_bot.db')
-    cursor = conn.cursor()
-    cursor.execute('SELECT * FROM users WHERE user_id = ?', (user_id,))
-    user = cursor.fetchone()
-    if not user:
-        now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        cursor.execute('''INSERT INTO users 
-                         (user_id, username, balance, goal, created_date, last_active) 
-                         VALUES (?, ?, 0, 0, ?, ?)''',
-                       (user_id, username, now, now))
-        conn.commit()
-    else:
-        # Cập nhật last_active
-        cursor.execute('UPDATE users SET last_active = ? WHERE user_id = ?',
-                       (datetime.now().strftime('%Y-%m-%d %H:%M:%S'), user_id))
-        conn.commit()
-    conn.close()
-
-def get_categories(user_id, cat_type=None):
-    conn = sqlite3.connect('finance_bot.db')
-    cursor = conn.cursor()
+def guild_id_of(ctx):
+    """guild_id của lệnh, None nếu lệnh được gửi qua DM"""
+    return ctx.guild.id if ctx.guild else None
+
+async def get_or_create_user(user_id, username=None):
+    """Đảm bảo user có trong DB; last_active chỉ được ghi dồn định kỳ"""
+    activity = shard().activity
+    if user_id not in activity.known:
+        await db.run(users.create_user, user_id, username)
+        activity.known.add(user_id)
+    activity.touch(user_id)
+
+async def get_user_profile(user_id):
+    """Dòng users (dict theo tên cột), đọc qua cache"""
+    profile_cache = shard().profile_cache
+    profile = profile_cache.get(user_id)
+    if profile is None:
+        version = profile_cache.version
+        profile = await db.run(users.load_profile, user_id, transaction=False)
+        if profile is not None:
+            profile_cache.put(user_id, profile, version)
+    return profile
+
+def invalidate_users(*user_ids):
+    """Gọi sau mỗi lần ghi vào users của các user này"""
+    shard().profile_cache.invalidate(*user_ids)
+    shard().leaderboards.mark_dirty(*user_ids)
+
+async def write_with_achievements(user_id, func, *args):
+    """db.run(func, immediate=True), lấy luôn thành tích user vừa mở khóa trong cùng transaction"""
+    def write(conn):
+        return func(conn, *args), achievements.take_unlocked(conn, user_id)
+    return await db.run(write, immediate=True)
+
+async def announce_achievements(ctx, unlocked):
+    if not unlocked:
+        return
+    embed = discord.Embed(title="🎉 Mở Khóa Thành Tích Mới!", color=0xf39c12)
+    for _, icon, name, desc, _, _ in unlocked:
+        embed.add_field(name=f"{icon} **{name}**", value=desc, inline=True)
+    await ctx.send(embed=embed)
+
+async def get_categories(user_id, cat_type=None):
+    current = shard()
+    if current.default_categories is None:
+        current.default_categories = await db.run(users.load_categories, 0, transaction=False)
+
+    category_cache = current.category_cache
+    custom = category_cache.get(user_id)
+    if custom is None:
+        version = category_cache.version
+        custom = await db.run(users.load_categories, user_id, transaction=False)
+        category_cache.put(user_id, custom, version)
+
+    categories = current.default_categories + custom
     if cat_type:
-        cursor.execute('SELECT * FROM categories WHERE (user_id = ? OR user_id = 0) AND type = ?', (user_id, cat_type))
-    else:
-        cursor.execute('SELECT * FROM categories WHERE user_id = ? OR user_id = 0', (user_id,))
-    categories = cursor.fetchall()
-    conn.close()
+        return [cat for cat in categories if cat[3] == cat_type]
     return categories
 
-async def create_chart(data, chart_type='bar', title='Biểu đồ'):
-    """Tạo biểu đồ thống kê"""
+async def create_chart(data, chart_type='bar', title='Biểu đồ', period=None):
+    """Tạo biểu đồ thống kê (vẽ trong process pool, dùng lại ảnh đã cache)"""
     try:
-        plt.style.use('dark_background')
-        fig, ax = plt.subplots(figsize=(CONFIG['CHART_WIDTH'], CONFIG['CHART_HEIGHT']))
-        
-        if chart_type == 'pie' and data:
-            labels = [item[0] for item in data]
-            sizes = [item[1] for item in data]
-            colors = plt.cm.Set3(range(len(labels)))
-            
-            wedges, texts, autotexts = ax.pie(sizes, labels=labels, autopct='%1.1f%%', colors=colors)
-            for autotext in autotexts:
-                autotext.set_color('white')
-                autotext.set_fontweight('bold')
-        
-        elif chart_type == 'bar' and data:
-            labels = [item[0] for item in data]
-            values = [item[1] for item in data]
-            colors = plt.cm.viridis(range(len(labels)))
-            
-            bars = ax.bar(labels, values, color=colors)
-            ax.set_ylabel('Số tiền (₫)')
-            plt.xticks(rotation=45, ha='right')
-            
-            # Thêm giá trị trên cột
-            for bar, value in zip(bars, values):
-                height = bar.get_height()
-                ax.text(bar.get_x() + bar.get_width()/2., height,
-                       f'{value:,.0f}₫', ha='center', va='bottom')
-        
-        ax.set_title(title, fontsize=16, fontweight='bold', color='white')
-        plt.tight_layout()
-        
-        # Lưu vào buffer
-        buffer = io.BytesIO()
-        plt.savefig(buffer, format='png', dpi=100, bbox_inches='tight', facecolor='#2C2F33')
-        buffer.seek(0)
-        plt.close()
-        
-        return discord.File(buffer, filename='chart.png')
+        with metrics.timed('render'):
+            png = await chart_renderer.render(data, chart_type, title,
+                                              CONFIG['CHART_WIDTH'], CONFIG['CHART_HEIGHT'], period=period)
+        return discord.File(io.BytesIO(png), filename='chart.png')
+    except ChartQueueFull:
+        raise
     except Exception as e:
         logger.error(f"Error creating chart: {e}")
         return None
@@ -242,26 +288,160 @@ def create_progress_bar(current, target, length=20):
 @bot.event
 async def on_ready():
     print(f'🚀 {bot.user} đã online với {len(bot.guilds)} servers!')
-    init_database()
-    daily_summary.start()
-    backup_database.start()
+    await asyncio.to_thread(init_database)
+    watchdog.start(asyncio.get_running_loop())
+    await start_metrics()
+    if not daily_summary.is_running():
+        daily_summary.start()
+    if not backup_database.is_running():
+        backup_database.start()
+    if not flush_activity.is_running():
+        flush_activity.start()
+    if not run_recurring.is_running():
+        run_recurring.start()
 
 @bot.event 
 async def on_guild_join(guild):
     logger.info(f"Bot joined guild: {guild.name} ({guild.id})")
 
+@bot.event
+async def on_guild_remove(guild):
+    # Thành viên của guild có thể nằm ở nhiều shard
+    for current in router.shards():
+        with router.using(current):
+            await db.run(leaderboard.remove_guild, guild.id)
+            current.leaderboards.drop(guild.id)
+
+class GuildMoving(commands.CheckFailure):
+    """Ví của user đang được chuyển sang file database riêng của server"""
+
+@bot.before_invoke
+async def remember_member(ctx):
+    """Định tuyến lệnh tới shard giữ ví của người gọi và ghi nhận user dùng bot trong guild nào"""
+    guild_id = guild_id_of(ctx)
+    if ctx.author.id in router.moving and ctx.command.name != 'admin_move_guild':
+        raise GuildMoving()
+    ctx.timer = metrics.start_command(ctx.command.qualified_name, getattr(ctx, 'created', None))
+    watchdog.command_started(f"/{ctx.command.qualified_name} (user {ctx.author.id}, guild {guild_id})")
+    current = router.use(ctx.author.id)
+    router.enter(ctx.author.id)
+    if guild_id is None:
+        return
+    key = (guild_id, ctx.author.id)
+    try:
+        if key not in current.leaderboards.known:
+            await get_or_create_user(ctx.author.id, ctx.author.display_name)
+            await db.run(leaderboard.add_member, *key)
+            current.leaderboards.member_joined(*key)
+    except BaseException:
+        # before_invoke lỗi thì after_invoke không chạy: tự trả lại lượt đếm và ghi lệnh lỗi
+        router.leave(ctx.author.id)
+        watchdog.command_finished()
+        metrics.finish_command(ctx.timer, failed=True)
+        ctx.timer = None
+        raise
+
+@bot.after_invoke
+async def finish_command(ctx):
+    router.leave(ctx.author.id)
+    watchdog.command_finished()
+    if getattr(ctx, 'timer', None) is not None:
+        metrics.finish_command(ctx.timer, ctx.command_failed)
+
 # ==== TASKS ĐỊNH KỲ ====
-@tasks.loop(hours=24)
+def build_daily_summary(day, income, expense, count, balance_amount):
+    embed = discord.Embed(
+        title=f"📅 Tóm Tắt Ngày {day.strftime('%d/%m/%Y')}",
+        color=0x00ff41 if income >= expense else 0xff4757
+    )
+    embed.add_field(name="💵 Thu", value=f"+{format_money(income)}", inline=True)
+    embed.add_field(name="💸 Chi", value=f"-{format_money(expense)}", inline=True)
+    embed.add_field(name="📊 Ròng", value=format_money(income - expense), inline=True)
+    embed.add_field(name="💳 Giao dịch", value=count, inline=True)
+    embed.add_field(name="💰 Số dư hiện tại", value=format_money(balance_amount), inline=True)
+    embed.set_footer(text="Tắt thông báo: /settings notifications off")
+    return embed
+
+async def send_daily_summary(day, row):
+    user_id, income, expense, count, balance_amount = row
+    try:
+        # create_dm nhận thẳng id, không tốn thêm một request fetch_user
+        channel = await bot.create_dm(discord.Object(id=user_id))
+        await channel.send(embed=build_daily_summary(day, income, expense, count, balance_amount))
+    except discord.Forbidden:
+        return 'forbidden'  # User chặn DM
+    except discord.NotFound:
+        return 'not_found'
+    except discord.HTTPException:
+        return 'failed'
+    return 'sent'
+
+@tasks.loop(time=dt_time(hour=CONFIG['DAILY_SUMMARY_HOUR'], tzinfo=datetime.now().astimezone().tzinfo))
 async def daily_summary():
-    """Gửi tóm tắt hàng ngày"""
+    """Gửi tóm tắt ngày hôm trước cho các user bật thông báo (lần lượt từng shard)"""
     await bot.wait_until_ready()
-    # Implement daily summary logic here
+    day = datetime.now() - timedelta(days=1)
+    for current in router.shards():
+        with router.using(current):
+            await send_daily_summaries(day)
+
+async def send_daily_summaries(day):
+    started = time.perf_counter()
+
+    # Một truy vấn GROUP BY cho tất cả user, không truy vấn từng người
+    summaries = await db.run(notifier.load_daily_summaries, day, transaction=False)
+    recorder = notifier.OutcomeRecorder(db, notifier.DAILY_SUMMARY, day.strftime('%Y-%m-%d'))
+
+    async def on_result(row, status):
+        user_id, income, expense, count, _ = row
+        await recorder.add(user_id, f"Thu {format_money(income)} • Chi {format_money(expense)} • "
+                                    f"{count} giao dịch", status, datetime.now())
+
+    counts = await notifier.fan_out(summaries, lambda row: send_daily_summary(day, row),
+                                    CONFIG['DM_RATE_PER_SECOND'], CONFIG['DM_CONCURRENCY'], on_result)
+    await recorder.flush()
+    logger.info(f"Daily summary {day:%Y-%m-%d} [{shard().name}]: {len(summaries)} users, {counts}, "
+                f"{time.perf_counter() - started:.1f}s")
 
 @tasks.loop(seconds=CONFIG['BACKUP_INTERVAL'])
 async def backup_database():
-    """Backup database định kỳ"""
+    """Backup database định kỳ (backup API chạy trên luồng riêng, không chặn lệnh)"""
     await bot.wait_until_ready()
-    # Implement backup logic here
+    for current in router.shards():
+        # Shard riêng của guild được backup vào thư mục con cùng tên
+        backup_dir = CONFIG['BACKUP_DIR'] if current is router.default else os.path.join(CONFIG['BACKUP_DIR'], current.name)
+        try:
+            info = await asyncio.to_thread(backup.backup, current.path, backup_dir, CONFIG['BACKUP_KEEP'])
+        except Exception as e:
+            logger.error(f"Backup {current.path} failed: {e}")
+            continue
+        logger.info(f"Backup {info['path']}: {info['bytes']:,} bytes, {info['pages']} pages, "
+                    f"{info['seconds']:.2f}s (nén {info['compressed']}, xóa {info['removed']} bản cũ)")
+
+@tasks.loop(seconds=CONFIG['ACTIVITY_FLUSH_INTERVAL'])
+async def flush_activity():
+    """Ghi dồn last_active của các user vừa dùng bot"""
+    for current in router.shards():
+        await current.db.run(current.activity.flush)
+
+@tasks.loop(seconds=CONFIG['RECURRING_INTERVAL'])
+async def run_recurring():
+    """Sinh các giao dịch định kỳ đến hạn, bù cả các lần lỡ khi bot tắt"""
+    now_ts = to_ts(datetime.now())
+    for current in router.shards():
+        created = skipped = 0
+        with router.using(current):
+            # Mỗi lô là một transaction ngắn; lặp đến khi hết quy tắc đến hạn
+            while True:
+                result = await db.run(recurring.materialize_due, now_ts, immediate=True)
+                invalidate_users(*result.users)
+                created += result.created
+                skipped += len(result.skipped)
+                if result.rules < recurring.DUE_BATCH_SIZE:
+                    break
+        if created or skipped:
+            logger.info(f"Recurring [{current.name}]: {created} giao dịch được tạo, "
+                        f"{skipped} bỏ qua (không đủ số dư)")
 
 # ==== LỆNH HELP NÂNG CÂP ====
 @bot.command(name='help')
@@ -279,7 +459,8 @@ async def help_command(ctx):
         value="`/balance` - Xem số dư và tổng quan\n"
               "`/add [số tiền] [danh mục] [mô tả]` - Thêm thu nhập\n"
               "`/spend [số tiền] [danh mục] [mô tả]` - Ghi nhận chi tiêu\n"
-              "`/transfer [số tiền] [@user]` - Chuyển tiền",
+              "`/transfer [số tiền] [@user]` - Chuyển tiền\n"
+              "`/recurring` - Giao dịch định kỳ (lương, tiền nhà...)",
         inline=False
     )
     embed1.add_field(
@@ -371,32 +552,25 @@ async def help2_command(ctx):
 @bot.command(name='balance', aliases=['bal', 'b'])
 async def balance(ctx):
     user_id = ctx.author.id
-    get_or_create_user(user_id, ctx.author.display_name)
-    
-    conn = sqlite3.connect('finance_bot.db')
-    cursor = conn.cursor()
-    
-    # Lấy thông tin user
-    cursor.execute('SELECT balance, goal, monthly_budget FROM users WHERE user_id = ?', (user_id,))
-    user_data = cursor.fetchone()
+    await get_or_create_user(user_id, ctx.author.display_name)
     
-    # Thống kê tháng hiện tại
-    current_month = datetime.now().strftime('%Y-%m')
-    cursor.execute('''
-        SELECT type, SUM(amount) 
-        FROM transactions 
-        WHERE user_id = ? AND date LIKE ? 
-        GROUP BY type
-    ''', (user_id, f'{current_month}%'))
-    month_stats = dict(cursor.fetchall())
-    
-    # Lấy savings goals
-    cursor.execute('SELECT name, target_amount, current_amount FROM savings_goals WHERE user_id = ?', (user_id,))
-    savings_goals = cursor.fetchall()
-    
-    conn.close()
+    def load(conn):
+        cursor = conn.cursor()
+
+        # Thống kê tháng hiện tại
+        month_totals = rollup.type_totals(conn, user_id, *rollup.month_bounds(datetime.now()))
+        month_stats = {tx_type: total for tx_type, total, _ in month_totals}
 
-    balance_amount, goal_amount, monthly_budget = user_data
+        # Lấy savings goals
+        cursor.execute('SELECT name, target_amount, current_amount FROM savings_goals WHERE user_id = ?', (user_id,))
+        savings_goals = cursor.fetchall()
+        return month_stats, savings_goals
+
+    # Thông tin user đọc qua cache
+    profile = await get_user_profile(user_id)
+    month_stats, savings_goals = await db.run(load)
+
+    balance_amount, goal_amount, monthly_budget = profile['balance'], profile['goal'], profile['monthly_budget']
     monthly_income = month_stats.get('income', 0)
     monthly_expense = month_stats.get('expense', 0)
     monthly_net = monthly_income - monthly_expense
@@ -472,35 +646,20 @@ async def add(ctx, amount: int, category: str = "Khác", *, description: str = "
         return
 
     user_id = ctx.author.id
-    get_or_create_user(user_id, ctx.author.display_name)
+    await get_or_create_user(user_id, ctx.author.display_name)
     
     # Kiểm tra category có tồn tại không
-    categories = get_categories(user_id, 'income')
+    categories = await get_categories(user_id, 'income')
     category_names = [cat[2] for cat in categories]  # cat[2] là tên category
     
     if category not in category_names and category != "Khác":
         category = "Khác"  # Fallback to default
     
     now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-    
-    conn = sqlite3.connect('finance_bot.db')
-    cursor = conn.cursor()
-    
-    # Cập nhật số dư
-    cursor.execute('UPDATE users SET balance = balance + ? WHERE user_id = ?', (amount, user_id))
-    
-    # Thêm transaction
-    cursor.execute('''
-        INSERT INTO transactions (user_id, amount, type, category, description, date) 
-        VALUES (?, ?, "income", ?, ?, ?)
-    ''', (user_id, amount, category, description, now))
-    
-    # Lấy số dư mới
-    cursor.execute('SELECT balance FROM users WHERE user_id = ?', (user_id,))
-    new_balance = cursor.fetchone()[0]
-    
-    conn.commit()
-    conn.close()
+
+    new_balance, unlocked = await write_with_achievements(user_id, ledger.credit, user_id, amount,
+                                                          category, description, now, guild_id_of(ctx))
+    invalidate_users(user_id)
 
     # Tạo embed đẹp
     embed = discord.Embed(
@@ -518,6 +677,7 @@ async def add(ctx, amount: int, category: str = "Khác", *, description: str = "
     embed.set_thumbnail(url="https://cdn-icons-png.flaticon.com/512/1828/1828884.png")
     
     await ctx.send(embed=embed)
+    await announce_achievements(ctx, unlocked)
 
 # ==== LỆNH SPEND NÂNG CÂP ====
 @bot.command(name='spend', aliases=['expense', 'pay', '-'])
@@ -527,16 +687,31 @@ async def spend(ctx, amount: int, category: str = "Khác", *, description: str =
         return
 
     user_id = ctx.author.id
-    get_or_create_user(user_id, ctx.author.display_name)
+    await get_or_create_user(user_id, ctx.author.display_name)
 
-    conn = sqlite3.connect('finance_bot.db')
-    cursor = conn.cursor()
-    
-    # Kiểm tra số dư
-    cursor.execute('SELECT balance FROM users WHERE user_id = ?', (user_id,))
-    current_balance = cursor.fetchone()[0]
+    # Kiểm tra category và budget warning
+    categories = await get_categories(user_id, 'expense')
+    category_names = [cat[2] for cat in categories]
+
+    if category not in category_names and category != "Khác":
+        category = "Khác"
+
+    now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
 
-    if current_balance < amount:
+    def write(conn):
+        # Trừ tiền có điều kiện (không đủ số dư thì không ghi gì)
+        ok, balance_after = ledger.debit(conn, user_id, amount, category, description, now, guild_id_of(ctx))
+        if not ok:
+            return balance_after, None, 0
+
+        # Kiểm tra ngân sách category
+        category_spent = rollup.category_spent(conn, user_id, category, now[:7])
+        return balance_after + amount, balance_after, category_spent
+
+    (current_balance, new_balance, category_spent), unlocked = await write_with_achievements(user_id, write)
+    invalidate_users(user_id)
+
+    if new_balance is None:
         embed = discord.Embed(
             title="❌ Không Đủ Số Dư",
             description=f"Bạn cần thêm {format_money(amount - current_balance)}",
@@ -547,39 +722,6 @@ async def spend(ctx, amount: int, category: str = "Khác", *, description: str =
         await ctx.send(embed=embed)
         return
 
-    # Kiểm tra category và budget warning
-    categories = get_categories(user_id, 'expense')
-    category_names = [cat[2] for cat in categories]
-    
-    if category not in category_names and category != "Khác":
-        category = "Khác"
-    
-    now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-    
-    # Cập nhật số dư
-    cursor.execute('UPDATE users SET balance = balance - ? WHERE user_id = ?', (amount, user_id))
-    
-    # Thêm transaction
-    cursor.execute('''
-        INSERT INTO transactions (user_id, amount, type, category, description, date) 
-        VALUES (?, ?, "expense", ?, ?, ?)
-    ''', (user_id, amount, category, description, now))
-    
-    # Lấy số dư mới
-    cursor.execute('SELECT balance FROM users WHERE user_id = ?', (user_id,))
-    new_balance = cursor.fetchone()[0]
-    
-    # Kiểm tra ngân sách category
-    current_month = datetime.now().strftime('%Y-%m')
-    cursor.execute('''
-        SELECT SUM(amount) FROM transactions 
-        WHERE user_id = ? AND category = ? AND type = "expense" AND date LIKE ?
-    ''', (user_id, category, f'{current_month}%'))
-    category_spent = cursor.fetchone()[0] or 0
-    
-    conn.commit()
-    conn.close()
-
     # Tạo embed
     embed = discord.Embed(
         title="💸 Chi Tiêu Đã Được Ghi Nhận",
@@ -604,56 +746,50 @@ async def spend(ctx, amount: int, category: str = "Khác", *, description: str =
     embed.set_thumbnail(url="https://cdn-icons-png.flaticon.com/512/1611/1611179.png")
     
     await ctx.send(embed=embed)
+    await announce_achievements(ctx, unlocked)
 
 # ==== LỆNH CHART ====
 @bot.command(name='chart', aliases=['graph'])
 async def chart(ctx, chart_type: str = 'pie', period: str = 'month'):
     user_id = ctx.author.id
-    get_or_create_user(user_id, ctx.author.display_name)
-    
-    conn = sqlite3.connect('finance_bot.db')
-    cursor = conn.cursor()
+    await get_or_create_user(user_id, ctx.author.display_name)
     
     # Lấy dữ liệu theo period
     if period == 'month':
         current_period = datetime.now().strftime('%Y-%m')
-        period_filter = f'{current_period}%'
+        months = rollup.month_bounds(datetime.now())
         title = f"Chi Tiêu Theo Danh Mục - Tháng {current_period}"
     elif period == 'week':
-        week_start = (datetime.now() - timedelta(days=7)).strftime('%Y-%m-%d')
-        period_filter = None
+        start_ts = to_ts(day_start(datetime.now() - timedelta(days=7)))
         title = "Chi Tiêu Theo Danh Mục - 7 Ngày Qua"
     else:
         current_year = datetime.now().year
-        period_filter = f'{current_year}%'
+        months = rollup.year_bounds(datetime.now())
         title = f"Chi Tiêu Theo Danh Mục - Năm {current_year}"
-    
+
     if period == 'week':
-        cursor.execute('''
-            SELECT category, SUM(amount) 
-            FROM transactions 
-            WHERE user_id = ? AND type = "expense" AND date >= ?
-            GROUP BY category 
+        data = await db.fetchall('''
+            SELECT category, SUM(amount)
+            FROM transactions
+            WHERE user_id = ? AND type = "expense" AND ts >= ?
+            GROUP BY category
             ORDER BY SUM(amount) DESC
-        ''', (user_id, week_start))
+        ''', (user_id, start_ts))
     else:
-        cursor.execute('''
-            SELECT category, SUM(amount) 
-            FROM transactions 
-            WHERE user_id = ? AND type = "expense" AND date LIKE ?
-            GROUP BY category 
-            ORDER BY SUM(amount) DESC
-        ''', (user_id, period_filter))
-    
-    data = cursor.fetchall()
-    conn.close()
-    
+        # Tháng/năm: đọc từ rollup thay vì quét transactions
+        totals = await db.run(rollup.category_totals, user_id, 'expense', *months)
+        data = [(cat, total) for cat, total, _ in totals]
+
     if not data:
         await ctx.send("📭 Không có dữ liệu để tạo biểu đồ.")
         return
     
     # Tạo biểu đồ
-    chart_file = await create_chart(data, chart_type, title)
+    try:
+        chart_file = await create_chart(data, chart_type, title, period)
+    except ChartQueueFull:
+        await ctx.send("⏳ Đang có nhiều biểu đồ chờ vẽ. Vui lòng thử lại sau ít giây.")
+        return
     
     if chart_file:
         embed = discord.Embed(
@@ -670,69 +806,88 @@ async def chart(ctx, chart_type: str = 'pie', period: str = 'month'):
 @bot.command(name='stats', aliases=['statistics'])
 async def stats(ctx, period: str = 'month'):
     user_id = ctx.author.id
-    get_or_create_user(user_id, ctx.author.display_name)
-    
-    conn = sqlite3.connect('finance_bot.db')
-    cursor = conn.cursor()
+    await get_or_create_user(user_id, ctx.author.display_name)
     
     # Xác định khoảng thời gian
     if period == 'week':
-        start_date = (datetime.now() - timedelta(days=7)).strftime('%Y-%m-%d')
+        start_ts = to_ts(day_start(datetime.now() - timedelta(days=7)))
         title = "📊 Thống Kê 7 Ngày Qua"
-        date_filter = "date >= ?"
-        params = (user_id, start_date)
+        date_filter = "ts >= ?"
+        params = (user_id, start_ts)
+        months = None
     elif period == 'year':
         current_year = datetime.now().year
         title = f"📊 Thống Kê Năm {current_year}"
-        date_filter = "date LIKE ?"
-        params = (user_id, f'{current_year}%')
+        date_filter = "ts >= ? AND ts < ?"
+        params = (user_id, *year_range(datetime.now()))
+        months = rollup.year_bounds(datetime.now())
     else:  # month
         current_month = datetime.now().strftime('%Y-%m')
         title = f"📊 Thống Kê Tháng {current_month}"
-        date_filter = "date LIKE ?"
-        params = (user_id, f'{current_month}%')
-    
-    # Lấy tổng thu chi
-    cursor.execute(f'''
-        SELECT type, SUM(amount), COUNT(*) 
-        FROM transactions 
-        WHERE user_id = ? AND {date_filter}
-        GROUP BY type
-    ''', params)
-    summary = cursor.fetchall()
-    
-    # Lấy top categories
-    cursor.execute(f'''
-        SELECT category, SUM(amount), COUNT(*) 
-        FROM transactions 
-        WHERE user_id = ? AND type = "expense" AND {date_filter}
-        GROUP BY category 
-        ORDER BY SUM(amount) DESC 
-        LIMIT 5
-    ''', params)
-    top_expenses = cursor.fetchall()
-    
-    cursor.execute(f'''
-        SELECT category, SUM(amount), COUNT(*) 
-        FROM transactions 
-        WHERE user_id = ? AND type = "income" AND {date_filter}
-        GROUP BY category 
-        ORDER BY SUM(amount) DESC 
-        LIMIT 5
-    ''', params)
-    top_income = cursor.fetchall()
-    
-    # Lấy giao dịch lớn nhất
-    cursor.execute(f'''
-        SELECT amount, category, description, date 
-        FROM transactions 
-        WHERE user_id = ? AND {date_filter}
-        ORDER BY amount DESC 
-        LIMIT 3
-    ''', params)
-    biggest_transactions = cursor.fetchall()
-    
-    conn.close()
+        date_filter = "ts >= ? AND ts < ?"
+        params = (user_id, *month_range(datetime.now()))
+        months = rollup.month_bounds(datetime.now())
+
+    def load_from_rollup(conn):
+        summary = rollup.type_totals(conn, user_id, *months)
+        top_expenses = rollup.category_totals(conn, user_id, 'expense', *months, limit=5)
+        top_income = rollup.category_totals(conn, user_id, 'income', *months, limit=5)
+        return summary, top_expenses, top_income
+
+    def load_from_transactions(conn):
+        cursor = conn.cursor()
+
+        # Lấy tổng thu chi
+        cursor.execute(f'''
+            SELECT type, SUM(amount), COUNT(*)
+            FROM transactions
+            WHERE user_id = ? AND {date_filter}
+            GROUP BY type
+        ''', params)
+        summary = cursor.fetchall()
+
+        # Lấy top categories
+        cursor.execute(f'''
+            SELECT category, SUM(amount), COUNT(*)
+            FROM transactions
+            WHERE user_id = ? AND type = "expense" AND {date_filter}
+            GROUP BY category
+            ORDER BY SUM(amount) DESC
+            LIMIT 5
+        ''', params)
+        top_expenses = cursor.fetchall()
+
+        cursor.execute(f'''
+            SELECT category, SUM(amount), COUNT(*)
+            FROM transactions
+            WHERE user_id = ? AND type = "income" AND {date_filter}
+            GROUP BY category
+            ORDER BY SUM(amount) DESC
+            LIMIT 5
+        ''', params)
+        top_income = cursor.fetchall()
+        return summary, top_expenses, top_income
+
+    def load(conn):
+        # Tháng/năm: tổng hợp từ rollup, tuần: quét khoảng ts
+        if months:
+            summary, top_expenses, top_income = load_from_rollup(conn)
+        else:
+            summary, top_expenses, top_income = load_from_transactions(conn)
+
+        # Lấy giao dịch lớn nhất
+        cursor = conn.cursor()
+        cursor.execute(f'''
+            SELECT amount, category, description, date
+            FROM transactions
+            WHERE user_id = ? AND {date_filter}
+            ORDER BY amount DESC
+            LIMIT 3
+        ''', params)
+        biggest_transactions = cursor.fetchall()
+        return summary, top_expenses, top_income, biggest_transactions
+
+    summary, top_expenses, top_income, biggest_transactions = await db.run(load)
     
     # Tạo embed
     embed = discord.Embed(title=title, color=0x6c5ce7)
@@ -797,25 +952,19 @@ async def stats(ctx, period: str = 'month'):
 @bot.command(name='budget')
 async def budget(ctx, category: str = None, amount: int = None):
     user_id = ctx.author.id
-    get_or_create_user(user_id, ctx.author.display_name)
-    
-    conn = sqlite3.connect('finance_bot.db')
-    cursor = conn.cursor()
-    
+    await get_or_create_user(user_id, ctx.author.display_name)
+
     if category is None:
         # Hiển thị tất cả budgets
-        current_month = datetime.now().strftime('%Y-%m')
-        cursor.execute('''
-            SELECT b.category, b.amount, COALESCE(SUM(t.amount), 0) as spent
+        budgets = await db.fetchall('''
+            SELECT b.category, b.amount, COALESCE(r.total, 0) as spent
             FROM budgets b
-            LEFT JOIN transactions t ON b.category = t.category 
-                AND t.user_id = b.user_id 
-                AND t.type = "expense" 
-                AND t.date LIKE ?
+            LEFT JOIN monthly_rollup r ON r.user_id = b.user_id
+                AND r.month = ?
+                AND r.type = "expense"
+                AND r.category = b.category
             WHERE b.user_id = ? AND b.period = "monthly"
-            GROUP BY b.category, b.amount
-        ''', (f'{current_month}%', user_id))
-        budgets = cursor.fetchall()
+        ''', (rollup.month_key(datetime.now()), user_id))
         
         if not budgets:
             await ctx.send("📭 Bạn chưa đặt ngân sách nào. Dùng `/budget [danh mục] [số tiền]`")
@@ -856,41 +1005,38 @@ async def budget(ctx, category: str = None, amount: int = None):
             await ctx.send("❌ Ngân sách phải lớn hơn 0!")
             return
         
-        # Kiểm tra xem đã có budget cho category này chưa
-        cursor.execute('SELECT amount FROM budgets WHERE user_id = ? AND category = ? AND period = "monthly"', 
-                      (user_id, category))
-        existing = cursor.fetchone()
-        
-        if existing:
-            cursor.execute('UPDATE budgets SET amount = ? WHERE user_id = ? AND category = ? AND period = "monthly"', 
-                          (amount, user_id, category))
-            action = "cập nhật"
-        else:
-            start_date = datetime.now().replace(day=1).strftime('%Y-%m-%d')
-            end_date = (datetime.now().replace(day=28) + timedelta(days=4)).replace(day=1) - timedelta(days=1)
-            cursor.execute('''
-                INSERT INTO budgets (user_id, category, amount, period, start_date, end_date) 
-                VALUES (?, ?, ?, "monthly", ?, ?)
-            ''', (user_id, category, amount, start_date, end_date.strftime('%Y-%m-%d')))
-            action = "đặt"
-        
-        conn.commit()
-        
+        def write(conn):
+            cursor = conn.cursor()
+
+            # Kiểm tra xem đã có budget cho category này chưa
+            cursor.execute('SELECT amount FROM budgets WHERE user_id = ? AND category = ? AND period = "monthly"',
+                          (user_id, category))
+            existing = cursor.fetchone()
+
+            if existing:
+                cursor.execute('UPDATE budgets SET amount = ? WHERE user_id = ? AND category = ? AND period = "monthly"',
+                              (amount, user_id, category))
+                action = "cập nhật"
+            else:
+                start_date = datetime.now().replace(day=1).strftime('%Y-%m-%d')
+                end_date = (datetime.now().replace(day=28) + timedelta(days=4)).replace(day=1) - timedelta(days=1)
+                cursor.execute('''
+                    INSERT INTO budgets (user_id, category, amount, period, start_date, end_date)
+                    VALUES (?, ?, ?, "monthly", ?, ?)
+                ''', (user_id, category, amount, start_date, end_date.strftime('%Y-%m-%d')))
+                action = "đặt"
+
+            # Kiểm tra chi tiêu hiện tại
+            return action, rollup.category_spent(conn, user_id, category, rollup.month_key(datetime.now()))
+
+        action, current_spent = await db.run(write)
+
         embed = discord.Embed(
             title=f"💳 Đã {action} ngân sách",
             description=f"**{category}**: {format_money(amount)}/tháng",
             color=0x00ff41
         )
         
-        # Kiểm tra chi tiêu hiện tại
-        current_month = datetime.now().strftime('%Y-%m')
-        cursor.execute('''
-            SELECT COALESCE(SUM(amount), 0) 
-            FROM transactions 
-            WHERE user_id = ? AND category = ? AND type = "expense" AND date LIKE ?
-        ''', (user_id, category, f'{current_month}%'))
-        current_spent = cursor.fetchone()[0]
-        
         if current_spent > 0:
             percentage = (current_spent / amount) * 100
             embed.add_field(
@@ -899,23 +1045,18 @@ async def budget(ctx, category: str = None, amount: int = None):
                       f"Còn lại: {format_money(amount - current_spent)}",
                 inline=False
             )
-    
-    conn.close()
+
     await ctx.send(embed=embed)
 
 # ==== LỆNH SAVINGS GOALS ====
 @bot.command(name='savings', aliases=['save', 'goal_save'])
 async def savings(ctx, action: str = "list", name: str = None, target: int = None, *, deadline: str = None):
     user_id = ctx.author.id
-    get_or_create_user(user_id, ctx.author.display_name)
-    
-    conn = sqlite3.connect('finance_bot.db')
-    cursor = conn.cursor()
-    
+    await get_or_create_user(user_id, ctx.author.display_name)
+
     if action == "list" or action is None:
         # Hiển thị tất cả savings goals
-        cursor.execute('SELECT * FROM savings_goals WHERE user_id = ? ORDER BY deadline ASC', (user_id,))
-        goals = cursor.fetchall()
+        goals = await db.fetchall('SELECT * FROM savings_goals WHERE user_id = ? ORDER BY deadline ASC', (user_id,))
         
         if not goals:
             await ctx.send("📭 Bạn chưa có mục tiêu tiết kiệm nào. Dùng `/savings add [tên] [số tiền] [deadline]`")
@@ -976,13 +1117,11 @@ async def savings(ctx, action: str = "list", name: str = None, target: int = Non
             return
         
         now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        cursor.execute('''
-            INSERT INTO savings_goals (user_id, name, target_amount, current_amount, deadline, created_date) 
+        await db.execute('''
+            INSERT INTO savings_goals (user_id, name, target_amount, current_amount, deadline, created_date)
             VALUES (?, ?, ?, 0, ?, ?)
         ''', (user_id, name, target, deadline, now))
         
-        conn.commit()
-        
         embed = discord.Embed(
             title="🎯 Mục Tiêu Tiết Kiệm Mới",
             description=f"Đã tạo mục tiêu **{name}**",
@@ -1004,40 +1143,33 @@ async def savings(ctx, action: str = "list", name: str = None, target: int = Non
             await ctx.send("❌ Số tiền phải lớn hơn 0!")
             return
         
-        # Kiểm tra goal có tồn tại không
-        cursor.execute('SELECT * FROM savings_goals WHERE user_id = ? AND name = ?', (user_id, name))
-        goal = cursor.fetchone()
-        
+        def write(conn):
+            cursor = conn.cursor()
+
+            # Kiểm tra goal có tồn tại không
+            cursor.execute('SELECT * FROM savings_goals WHERE user_id = ? AND name = ?', (user_id, name))
+            goal = cursor.fetchone()
+            if not goal:
+                return None, None, None
+
+            # Trừ số dư và cộng vào mục tiêu trong cùng transaction
+            now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+            _, balance, saved = ledger.deposit_to_goal(conn, user_id, goal[0], amount,
+                                                       f"Gửi tiết kiệm: {name}", now, guild_id_of(ctx))
+            return goal, balance, saved
+
+        (goal, balance, new_amount), unlocked = await write_with_achievements(user_id, write)
+        invalidate_users(user_id)
+
         if not goal:
             await ctx.send(f"❌ Không tìm thấy mục tiêu tiết kiệm '{name}'")
             return
-        
-        goal_id, _, goal_name, target_amt, current_amt, deadline, desc, created = goal
-        
-        # Kiểm tra số dư
-        cursor.execute('SELECT balance FROM users WHERE user_id = ?', (user_id,))
-        balance = cursor.fetchone()[0]
-        
-        if balance < amount:
+
+        if new_amount is None:
             await ctx.send(f"❌ Không đủ số dư! Số dư hiện tại: {format_money(balance)}")
             return
-        
-        # Cập nhật số dư và savings goal
-        cursor.execute('UPDATE users SET balance = balance - ? WHERE user_id = ?', (amount, user_id))
-        cursor.execute('UPDATE savings_goals SET current_amount = current_amount + ? WHERE id = ?', (amount, goal_id))
-        
-        # Thêm transaction
-        now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        cursor.execute('''
-            INSERT INTO transactions (user_id, amount, type, category, description, date) 
-            VALUES (?, ?, "expense", "Tiết kiệm", ?, ?)
-        ''', (user_id, amount, f"Gửi tiết kiệm: {name}", now))
-        
-        conn.commit()
-        
-        # Lấy thông tin mới
-        cursor.execute('SELECT current_amount FROM savings_goals WHERE id = ?', (goal_id,))
-        new_amount = cursor.fetchone()[0]
+
+        target_amt = goal[3]
         progress = (new_amount / target_amt) * 100
         
         embed = discord.Embed(
@@ -1055,88 +1187,151 @@ async def savings(ctx, action: str = "list", name: str = None, target: int = Non
                 value=f"Bạn đã hoàn thành mục tiêu **{name}**!",
                 inline=False
             )
-    
-    conn.close()
+
     await ctx.send(embed=embed)
+    if action == "deposit":
+        await announce_achievements(ctx, unlocked)
 
 # ==== LỆNH HISTORY NÂNG CÂP ====
-@bot.command(name='history', aliases=['hist', 'h'])
-async def history(ctx, days: int = 7, category: str = None):
-    user_id = ctx.author.id
-    get_or_create_user(user_id, ctx.author.display_name)
-    
-    conn = sqlite3.connect('finance_bot.db')
-    cursor = conn.cursor()
-    
-    limit_date = (datetime.now() - timedelta(days=days)).strftime('%Y-%m-%d')
-    
+def load_history_page(conn, user_id, since_ts, category, before, limit):
+    """Một trang lịch sử theo keyset (ts, id) < before, mới nhất trước.
+
+    Trả về limit + 1 dòng để biết còn trang sau; không dùng OFFSET nên
+    trang thứ 1000 cũng chỉ đọc đúng số dòng trên index.
+    """
+    conditions = ['user_id = ?', 'ts >= ?']
+    params = [user_id, since_ts]
     if category:
-        cursor.execute('''
-            SELECT amount, type, category, description, date 
-            FROM transactions 
-            WHERE user_id = ? AND date >= ? AND category = ?
-            ORDER BY date DESC 
-            LIMIT ?
-        ''', (user_id, limit_date, category, CONFIG['MAX_TRANSACTIONS_DISPLAY']))
-        title = f"📋 Lịch sử {category} ({days} ngày)"
-    else:
-        cursor.execute('''
-            SELECT amount, type, category, description, date 
-            FROM transactions 
-            WHERE user_id = ? AND date >= ? 
-            ORDER BY date DESC 
-            LIMIT ?
-        ''', (user_id, limit_date, CONFIG['MAX_TRANSACTIONS_DISPLAY']))
-        title = f"📋 Lịch sử giao dịch ({days} ngày)"
-    
-    records = cursor.fetchall()
-    conn.close()
-    
-    if not records:
-        await ctx.send(f"📭 Không có giao dịch nào trong {days} ngày qua.")
-        return
-    
-    # Tạo embed với pagination
-    embeds = []
-    items_per_page = 8
-    
-    for i in range(0, len(records), items_per_page):
-        embed = discord.Embed(title=title, color=0x3498db)
-        page_records = records[i:i+items_per_page]
-        
-        for amt, ttype, cat, desc, date in page_records:
+        conditions.append('category = ?')
+        params.append(category)
+    if before:
+        conditions.append('(ts, id) < (?, ?)')
+        params.extend(before)
+    return conn.execute(f'''
+        SELECT amount, type, category, description, date, ts, id
+        FROM transactions
+        WHERE {' AND '.join(conditions)}
+        ORDER BY ts DESC, id DESC
+        LIMIT ?
+    ''', (*params, limit + 1)).fetchall()
+
+def count_history(conn, user_id, since_ts, category):
+    if category:
+        return conn.execute('SELECT COUNT(*) FROM transactions WHERE user_id = ? AND category = ? AND ts >= ?',
+                            (user_id, category, since_ts)).fetchone()[0]
+    return conn.execute('SELECT COUNT(*) FROM transactions WHERE user_id = ? AND ts >= ?',
+                        (user_id, since_ts)).fetchone()[0]
+
+class HistoryView(discord.ui.View):
+    """Nút chuyển trang cho /history; mỗi lần bấm chỉ đọc một trang từ DB"""
+
+    def __init__(self, user_id, title, since_ts, category, total):
+        super().__init__(timeout=CONFIG['HISTORY_TIMEOUT'])
+        self.title = title
+        self.user_id = user_id
+        self.since_ts = since_ts
+        self.category = category
+        self.total = total
+        self.page_size = CONFIG['HISTORY_PAGE_SIZE']
+        self.cursors = [None]  # con trỏ bắt đầu của từng trang đã xem
+        self.records = []
+        self.has_next = False
+        self.message = None
+        self.shard = shard()  # nút bấm chạy ngoài context của lệnh nên giữ shard lại
+
+    @property
+    def page(self):
+        return len(self.cursors)
+
+    async def load(self):
+        rows = await self.shard.db.run(load_history_page, self.user_id, self.since_ts, self.category,
+                                       self.cursors[-1], self.page_size, transaction=False)
+        self.has_next = len(rows) > self.page_size
+        self.records = rows[:self.page_size]
+        self.previous_page.disabled = self.page == 1
+        self.next_page.disabled = not self.has_next
+
+    def build_embed(self):
+        embed = discord.Embed(title=self.title, color=0x3498db)
+
+        for amt, ttype, cat, desc, date, _, _ in self.records:
             # Icon theo type
             icon = "💵" if ttype == "income" else "💸"
             symbol = "+" if ttype == "income" else "-"
-            
+
             # Format date
             try:
                 date_obj = datetime.strptime(date, '%Y-%m-%d %H:%M:%S')
                 date_str = date_obj.strftime('%d/%m %H:%M')
             except:
                 date_str = date
-            
+
             # Truncate description
             if len(desc) > 30:
                 desc = desc[:27] + "..."
-            
+
             value = f"{symbol}{format_money(amt)}\n📂 {cat}\n📝 {desc}\n🕐 {date_str}"
             embed.add_field(name=f"{icon} Giao dịch", value=value, inline=True)
-        
+
         # Footer
-        page_num = (i // items_per_page) + 1
-        total_pages = (len(records) - 1) // items_per_page + 1
-        embed.set_footer(text=f"Trang {page_num}/{total_pages} • Tổng {len(records)} giao dịch")
-        
-        embeds.append(embed)
-    
-    # Gửi embed đầu tiên
-    await ctx.send(embed=embeds[0])
+        total_pages = max(1, (self.total - 1) // self.page_size + 1)
+        embed.set_footer(text=f"Trang {self.page}/{total_pages} • Tổng {self.total} giao dịch")
+        return embed
+
+    async def interaction_check(self, interaction):
+        if interaction.user.id != self.user_id:
+            await interaction.response.send_message("❌ Chỉ người gọi lệnh mới chuyển trang được.", ephemeral=True)
+            return False
+        return True
+
+    @discord.ui.button(label="◀️ Trước", style=discord.ButtonStyle.secondary)
+    async def previous_page(self, interaction, button):
+        if len(self.cursors) > 1:
+            self.cursors.pop()
+        await self.load()
+        await interaction.response.edit_message(embed=self.build_embed(), view=self)
+
+    @discord.ui.button(label="Sau ▶️", style=discord.ButtonStyle.secondary)
+    async def next_page(self, interaction, button):
+        if self.has_next and self.records:
+            last = self.records[-1]
+            self.cursors.append((last[5], last[6]))
+        await self.load()
+        await interaction.response.edit_message(embed=self.build_embed(), view=self)
+
+    async def on_timeout(self):
+        for item in self.children:
+            item.disabled = True
+        if self.message:
+            try:
+                await self.message.edit(view=self)
+            except discord.HTTPException:
+                pass
+
+@bot.command(name='history', aliases=['hist', 'h'])
+async def history(ctx, days: int = 7, category: str = None):
+    user_id = ctx.author.id
+    await get_or_create_user(user_id, ctx.author.display_name)
     
-    # Nếu có nhiều trang, thêm reactions để navigate
-    if len(embeds) > 1:
-        # Implement pagination logic here if needed
-        pass
+    since_ts = to_ts(day_start(datetime.now() - timedelta(days=days)))
+    if category:
+        title = f"📋 Lịch sử {category} ({days} ngày)"
+    else:
+        title = f"📋 Lịch sử giao dịch ({days} ngày)"
+
+    total = await db.run(count_history, user_id, since_ts, category, transaction=False)
+    if not total:
+        await ctx.send(f"📭 Không có giao dịch nào trong {days} ngày qua.")
+        return
+
+    view = HistoryView(user_id, title, since_ts, category, total)
+    await view.load()
+
+    if not view.has_next:
+        # Chỉ một trang thì không cần nút
+        await ctx.send(embed=view.build_embed())
+        return
+    view.message = await ctx.send(embed=view.build_embed(), view=view)
 
 # ==== LỆNH TRANSFER ====
 @bot.command(name='transfer', aliases=['send', 'tf'])
@@ -1151,18 +1346,25 @@ async def transfer(ctx, amount: int, recipient: discord.Member, *, description:
     
     user_id = ctx.author.id
     recipient_id = recipient.id
+    if recipient_id in router.moving:
+        raise GuildMoving()
+    if router.shard_for(recipient_id) is not shard():
+        # Hai ví ở hai file khác nhau thì không trừ/cộng trong cùng một transaction được
+        await ctx.send("❌ Người nhận đang dùng database khác (server riêng), chưa thể chuyển tiền trực tiếp.")
+        return
+
+    await get_or_create_user(user_id, ctx.author.display_name)
+    await get_or_create_user(recipient_id, recipient.display_name)
     
-    get_or_create_user(user_id, ctx.author.display_name)
-    get_or_create_user(recipient_id, recipient.display_name)
-    
-    conn = sqlite3.connect('finance_bot.db')
-    cursor = conn.cursor()
-    
-    # Kiểm tra số dư
-    cursor.execute('SELECT balance FROM users WHERE user_id = ?', (user_id,))
-    sender_balance = cursor.fetchone()[0]
-    
-    if sender_balance < amount:
+    now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+    (transferred, sender_balance), unlocked = await write_with_achievements(
+        user_id, ledger.transfer, user_id, recipient_id, amount,
+        f"Chuyển cho {recipient.display_name}: {description}",
+        f"Nhận từ {ctx.author.display_name}: {description}", now, guild_id_of(ctx))
+    invalidate_users(user_id, recipient_id)
+
+    if not transferred:
         embed = discord.Embed(
             title="❌ Không Đủ Số Dư",
             description=f"Bạn cần thêm {format_money(amount - sender_balance)}",
@@ -1172,26 +1374,6 @@ async def transfer(ctx, amount: int, recipient: discord.Member, *, description:
         await ctx.send(embed=embed)
         return
     
-    # Thực hiện chuyển tiền
-    now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-    
-    cursor.execute('UPDATE users SET balance = balance - ? WHERE user_id = ?', (amount, user_id))
-    cursor.execute('UPDATE users SET balance = balance + ? WHERE user_id = ?', (amount, recipient_id))
-    
-    # Ghi lại transactions
-    cursor.execute('''
-        INSERT INTO transactions (user_id, amount, type, category, description, date) 
-        VALUES (?, ?, "expense", "Chuyển tiền", ?, ?)
-    ''', (user_id, amount, f"Chuyển cho {recipient.display_name}: {description}", now))
-    
-    cursor.execute('''
-        INSERT INTO transactions (user_id, amount, type, category, description, date) 
-        VALUES (?, ?, "income", "Chuyển tiền", ?, ?)
-    ''', (recipient_id, amount, f"Nhận từ {ctx.author.display_name}: {description}", now))
-    
-    conn.commit()
-    conn.close()
-    
     # Tạo embed thông báo
     embed = discord.Embed(
         title="💸 Chuyển Tiền Thành Công",
@@ -1202,6 +1384,7 @@ async def transfer(ctx, amount: int, recipient: discord.Member, *, description:
     embed.add_field(name="⏰ Thời gian", value=now, inline=True)
     
     await ctx.send(embed=embed)
+    await announce_achievements(ctx, unlocked)
     
     # Gửi thông báo cho người nhận
     try:
@@ -1219,10 +1402,10 @@ async def transfer(ctx, amount: int, recipient: discord.Member, *, description:
 @bot.command(name='category', aliases=['cat'])
 async def category(ctx, action: str = "list", *, name: str = None):
     user_id = ctx.author.id
-    get_or_create_user(user_id, ctx.author.display_name)
+    await get_or_create_user(user_id, ctx.author.display_name)
     
     if action == "list":
-        categories = get_categories(user_id)
+        categories = await get_categories(user_id)
         
         income_cats = [cat for cat in categories if cat[3] == 'income']
         expense_cats = [cat for cat in categories if cat[3] == 'expense']
@@ -1247,87 +1430,288 @@ async def category(ctx, action: str = "list", *, name: str = None):
     
     # Implement add/remove category logic here if needed
 
+# ==== LỆNH RECURRING ====
+@bot.command(name='recurring', aliases=['repeat'])
+async def recurring_command(ctx, action: str = "list", *args):
+    """/recurring list | add <income|expense> <số tiền> <số ngày> [danh mục] [mô tả] | stop <id>"""
+    user_id = ctx.author.id
+    await get_or_create_user(user_id, ctx.author.display_name)
+    action = action.lower()
+
+    if action == "add":
+        try:
+            tx_type, amount, interval_days = args[0].lower(), int(args[1]), int(args[2])
+        except (IndexError, ValueError):
+            await ctx.send("❌ Cú pháp: `/recurring add <income|expense> <số tiền> <số ngày> [danh mục] [mô tả]`")
+            return
+        if tx_type not in ('income', 'expense') or amount <= 0 or interval_days <= 0:
+            await ctx.send("❌ Loại phải là income/expense, số tiền và số ngày phải lớn hơn 0!")
+            return
+        category = args[3] if len(args) > 3 else "Khác"
+        description = ' '.join(args[4:]) or "Giao dịch định kỳ"
+        now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+        # Lần đầu được ghi ngay, các lần sau do run_recurring sinh ra
+        (ok, balance_after, rule_id), unlocked = await write_with_achievements(
+            user_id, recurring.create_rule, user_id, tx_type, amount, category, description, now, interval_days,
+            guild_id_of(ctx))
+        invalidate_users(user_id)
+        if not ok:
+            await ctx.send(f"❌ Không đủ số dư cho lần đầu! Số dư hiện tại: {format_money(balance_after)}")
+            return
+
+        embed = discord.Embed(title="🔁 Đã Tạo Giao Dịch Định Kỳ", color=0x00ff41)
+        embed.add_field(name="💵 **Số Tiền**",
+                        value=f"{'+' if tx_type == 'income' else '-'}{format_money(amount)}", inline=True)
+        embed.add_field(name="📂 **Danh Mục**", value=category, inline=True)
+        embed.add_field(name="⏱️ **Chu Kỳ**", value=f"{interval_days} ngày", inline=True)
+        embed.add_field(name="💰 **Số Dư Mới**", value=format_money(balance_after), inline=False)
+        embed.set_footer(text=f"ID: {rule_id} • Dừng: /recurring stop {rule_id}")
+        await ctx.send(embed=embed)
+        await announce_achievements(ctx, unlocked)
+
+    elif action == "stop":
+        try:
+            rule_id = int(args[0])
+        except (IndexError, ValueError):
+            await ctx.send("❌ Cú pháp: `/recurring stop <id>`")
+            return
+        stopped = await db.run(recurring.stop_rule, user_id, rule_id)
+        if stopped:
+            await ctx.send(f"✅ Đã dừng giao dịch định kỳ #{rule_id}")
+        else:
+            await ctx.send(f"❌ Không tìm thấy giao dịch định kỳ #{rule_id}")
+
+    else:
+        rules = await db.run(recurring.list_rules, user_id, transaction=False)
+        embed = discord.Embed(title="🔁 Giao Dịch Định Kỳ", color=0x3498db)
+        if not rules:
+            embed.description = "Chưa có giao dịch định kỳ. Tạo mới: `/recurring add expense 3000000 30 Nhà Tiền nhà`"
+        for rule_id, tx_type, amount, category, description, interval_days, next_due in rules[:20]:
+            sign = '+' if tx_type == 'income' else '-'
+            next_date = from_ts(next_due).strftime('%d/%m/%Y') if next_due is not None else '—'
+            embed.add_field(name=f"#{rule_id} • {sign}{format_money(amount)} • mỗi {interval_days} ngày",
+                            value=f"{category} • {description}\nLần tới: {next_date}", inline=False)
+        if len(rules) > 20:
+            embed.set_footer(text=f"Hiển thị 20/{len(rules)} giao dịch định kỳ")
+        await ctx.send(embed=embed)
+
+# ==== LỆNH LEADERBOARD ====
+LEADERBOARD_ALIASES = {'balance': 'balance', 'bal': 'balance', 'savings': 'savings_rate',
+                       'savings_rate': 'savings_rate', 'rate': 'savings_rate', 'streak': 'streak'}
+
+async def load_leaderboard(current, guild_id):
+    """Bảng của guild trong một shard, đã áp dụng các thay đổi điểm từ lần đọc trước"""
+    leaderboards = current.leaderboards
+    board = leaderboards.get(guild_id)
+    if board is None:
+        leaderboards.loading += 1
+        try:
+            board = await db.run(leaderboard.Leaderboard.load, guild_id, transaction=False)
+        finally:
+            leaderboards.loading -= 1
+        leaderboards.put(guild_id, board)
+
+    user_ids, joined = leaderboards.take_pending()
+    if user_ids:
+        try:
+            rows = await db.run(leaderboard.load_users, user_ids, transaction=False)
+        except BaseException:
+            leaderboards.dirty |= user_ids
+            leaderboards.joined |= joined
+            raise
+        leaderboards.apply(rows, joined)
+    return board
+
+async def get_leaderboard(guild_id):
+    """Bảng xếp hạng của guild, ghép từ mọi shard có thành viên của guild"""
+    boards = []
+    async with leaderboard_lock:
+        for current in router.shards():
+            with router.using(current):
+                board = await load_leaderboard(current, guild_id)
+            if board.values:
+                boards.append(board)
+    if len(boards) == 1:
+        return boards[0]
+    return leaderboard.MergedLeaderboard(boards)
+
+def format_score(metric, score):
+    if metric == 'savings_rate':
+        return f"{score / 100:.1f}%"
+    if metric == 'streak':
+        return f"{score} ngày"
+    return format_money(score)
+
+@bot.command(name='leaderboard', aliases=['lb', 'top'])
+async def leaderboard_command(ctx, metric: str = "balance", page: int = 1):
+    if ctx.guild is None:
+        await ctx.send("❌ Bảng xếp hạng chỉ dùng được trong server!")
+        return
+    metric = LEADERBOARD_ALIASES.get(metric.lower())
+    if metric is None:
+        await ctx.send("❌ Chọn: `balance`, `savings` hoặc `streak`")
+        return
+
+    board = await get_leaderboard(ctx.guild.id)
+    page_size = CONFIG['LEADERBOARD_PAGE_SIZE']
+    total = board.size(metric)
+    pages = max(1, (total - 1) // page_size + 1)
+    page = min(max(page, 1), pages)
+
+    embed = discord.Embed(title=f"🏅 Bảng Xếp Hạng • {leaderboard.METRIC_NAMES[metric]}", color=0xf1c40f)
+    medals = {1: "🥇", 2: "🥈", 3: "🥉"}
+    lines = [f"{medals.get(rank, f'`#{rank}`')} **{name or user_id}** — {format_score(metric, score)}"
+             for rank, user_id, name, score in board.page(metric, (page - 1) * page_size, page_size)]
+    embed.description = "\n".join(lines) or "Chưa có ai trong bảng xếp hạng."
+
+    my_rank = board.rank(metric, ctx.author.id)
+    if my_rank is not None:
+        my_score = board.values[ctx.author.id][metric]
+        embed.add_field(name="📍 Hạng của bạn", value=f"#{my_rank}/{total} • {format_score(metric, my_score)}",
+                        inline=False)
+    embed.set_footer(text=f"Trang {page}/{pages} • /leaderboard [balance|savings|streak] [trang]")
+    await ctx.send(embed=embed)
+
 # ==== LỆNH EXPORT/IMPORT ====
 @bot.command(name='export')
-async def export_data(ctx, format_type: str = "json"):
+async def export_data(ctx, format_type: str = "json", compression: str = None):
+    import exporter  # chỉ cần khi xuất dữ liệu
+
     user_id = ctx.author.id
-    get_or_create_user(user_id, ctx.author.display_name)
-    
-    conn = sqlite3.connect('finance_bot.db')
-    cursor = conn.cursor()
-    
-    # Lấy tất cả dữ liệu
-    cursor.execute('SELECT * FROM transactions WHERE user_id = ? ORDER BY date DESC', (user_id,))
-    transactions = cursor.fetchall()
-    
-    cursor.execute('SELECT * FROM savings_goals WHERE user_id = ?', (user_id,))
-    goals = cursor.fetchall()
-    
-    conn.close()
-    
-    if format_type.lower() == "csv":
-        # CSV export
-        csv_content = "Date,Amount,Type,Category,Description\n"
-        for trans in transactions:
-            csv_content += f"{trans[6]},{trans[2]},{trans[3]},{trans[4]},{trans[5]}\n"
-        
-        with io.StringIO(csv_content) as buffer:
-            file = discord.File(buffer, filename=f"finance_data_{user_id}.csv")
-    else:
-        # JSON export
-        data = {
-            "user_id": user_id,
-            "export_date": datetime.now().isoformat(),
-            "transactions": [
-                {
-                    "date": trans[6],
-                    "amount": trans[2],
-                    "type": trans[3],
-                    "category": trans[4],
-                    "description": trans[5]
-                } for trans in transactions
-            ],
-            "savings_goals": [
-                {
-                    "name": goal[2],
-                    "target": goal[3],
-                    "current": goal[4],
-                    "deadline": goal[5]
-                } for goal in goals
-            ]
-        }
-        
-        json_content = json.dumps(data, ensure_ascii=False, indent=2)
-        buffer = io.StringIO(json_content)
-        file = discord.File(buffer, filename=f"finance_data_{user_id}.json")
-    
+    await get_or_create_user(user_id, ctx.author.display_name)
+
+    format_type = format_type.lower()
+    if format_type not in exporter.FORMATS:
+        await ctx.send(f"❌ Định dạng không hợp lệ! Dùng: {', '.join(exporter.FORMATS)} (thêm `gzip` để nén)")
+        return
+    compress = (compression or '').lower() in ('gz', 'gzip')
+
+    # Mỗi phần phải nhỏ hơn giới hạn file đính kèm của server
+    max_bytes = CONFIG['EXPORT_PART_BYTES']
+    if ctx.guild:
+        max_bytes = min(max_bytes, ctx.guild.filesize_limit)
+
+    # Đọc theo lô và ghi thẳng ra file tạm trên luồng DB (một snapshot đọc)
+    count, files = await db.run(exporter.export_user, user_id, format_type, max_bytes, compress)
+
+    extension = format_type + ('.gz' if compress else '')
+    try:
+        attachments = [
+            discord.File(f, filename=f"finance_data_{user_id}.{extension}" if len(files) == 1
+                         else f"finance_data_{user_id}_part{i}.{extension}")
+            for i, f in enumerate(files, 1)
+        ]
+
+        embed = discord.Embed(
+            title="📤 Xuất Dữ Liệu",
+            description=f"Dữ liệu tài chính của bạn ({count} giao dịch)",
+            color=0x27ae60
+        )
+        if len(files) > 1:
+            embed.set_footer(text=f"Chia thành {len(files)} phần do giới hạn dung lượng file")
+
+        # Discord cho tối đa 10 file mỗi tin nhắn
+        for i in range(0, len(attachments), 10):
+            await ctx.send(embed=embed if i == 0 else None, files=attachments[i:i+10])
+    finally:
+        for f in files:
+            f.close()
+
+@bot.command(name='import')
+async def import_data(ctx, format_type: str = None):
+    """Nhập giao dịch từ file CSV/JSON/NDJSON đính kèm (cùng dạng với /export)"""
+    import importer  # chỉ cần khi nhập dữ liệu
+
+    user_id = ctx.author.id
+    await get_or_create_user(user_id, ctx.author.display_name)
+
+    attachments = ctx.message.attachments if ctx.message else []
+    if not attachments:
+        await ctx.send("❌ Hãy đính kèm file CSV/JSON/NDJSON (có thể nén .gz) cùng lệnh `/import`.")
+        return
+    attachment = attachments[0]
+
+    detected, compressed = importer.detect_format(attachment.filename)
+    format_type = (format_type or detected or '').lower()
+    if format_type not in importer.FORMATS:
+        await ctx.send(f"❌ Không nhận ra định dạng file! Dùng: {', '.join(importer.FORMATS)}")
+        return
+    if attachment.size > CONFIG['IMPORT_MAX_BYTES']:
+        await ctx.send(f"❌ File quá lớn (tối đa {CONFIG['IMPORT_MAX_BYTES'] // (1024 * 1024)} MB).")
+        return
+
+    progress_message = await ctx.send(f"⏳ Đang nhập dữ liệu từ `{attachment.filename}`...")
+    loop = asyncio.get_running_loop()
+    latest = {'rows': 0, 'pending': False}
+
+    async def show_progress():
+        latest['pending'] = False
+        try:
+            await progress_message.edit(content=f"⏳ Đã đọc {latest['rows']:,} giao dịch...")
+        except discord.HTTPException:
+            pass
+
+    def on_progress(rows):
+        # Gọi từ luồng DB: chỉ đẩy việc sửa tin nhắn về event loop, không chờ
+        def schedule():
+            latest['rows'] = rows
+            if not latest['pending']:
+                latest['pending'] = True
+                asyncio.ensure_future(show_progress())
+        loop.call_soon_threadsafe(schedule)
+
+    started = time.perf_counter()
+    with tempfile.SpooledTemporaryFile(max_size=1024 * 1024) as spool:
+        await attachment.save(spool)
+        spool.seek(0)
+        try:
+            result = await db.run(importer.import_transactions, user_id, spool, format_type, compressed,
+                                  CONFIG['IMPORT_MAX_ROWS'], on_progress, guild_id_of(ctx), transaction=False)
+        except importer.ImportFormatError as e:
+            await ctx.send(f"❌ {e}")
+            return
+        finally:
+            invalidate_users(user_id)
+    elapsed = time.perf_counter() - started
+
     embed = discord.Embed(
-        title="📤 Xuất Dữ Liệu",
-        description=f"Dữ liệu tài chính của bạn ({len(transactions)} giao dịch)",
-        color=0x27ae60
+        title="📥 Nhập Dữ Liệu",
+        description=f"Đã nhập **{result.imported:,}** giao dịch trong {elapsed:.1f}s",
+        color=0x27ae60 if result.imported else 0xff4757
     )
-    
-    await ctx.send(embed=embed, file=file)
+    embed.add_field(name="💰 Thay đổi số dư", value=format_money(result.net), inline=True)
+    embed.add_field(name="⚠️ Bỏ qua", value=f"{result.skipped:,} dòng", inline=True)
+    for rejected_id, balance, net, rows in result.rejected:
+        embed.add_field(
+            name="⛔ Từ chối",
+            value=(f"<@{rejected_id}>: {rows:,} giao dịch thay đổi số dư {format_money(net)}, "
+                   f"số dư hiện tại {format_money(balance)} sẽ bị âm. Không dòng nào được nhập."),
+            inline=False
+        )
+    if result.errors:
+        embed.add_field(
+            name="🔎 Lỗi",
+            value="\n".join(f"Dòng {line}: {reason}" for line, reason in result.errors)[:1024],
+            inline=False
+        )
+    await ctx.send(embed=embed)
 
 # ==== LỆNH SETTINGS ====
 @bot.command(name='settings', aliases=['config'])
 async def settings(ctx, setting: str = None, *, value: str = None):
     user_id = ctx.author.id
-    get_or_create_user(user_id, ctx.author.display_name)
-    
-    conn = sqlite3.connect('finance_bot.db')
-    cursor = conn.cursor()
+    await get_or_create_user(user_id, ctx.author.display_name)
     
     if setting is None:
         # Hiển thị tất cả settings
-        cursor.execute('SELECT * FROM users WHERE user_id = ?', (user_id,))
-        user_data = cursor.fetchone()
+        user_data = await get_user_profile(user_id)
         
         embed = discord.Embed(title="⚙️ Cài Đặt Cá Nhân", color=0x9b59b6)
-        embed.add_field(name="💰 Tiền tệ", value=user_data[5] or "VND", inline=True)
-        embed.add_field(name="🌍 Múi giờ", value=user_data[6] or "Asia/Ho_Chi_Minh", inline=True)
-        embed.add_field(name="🔔 Thông báo", value="Bật" if user_data[7] else "Tắt", inline=True)
-        embed.add_field(name="💳 Ngân sách tháng", value=format_money(user_data[4]) if user_data[4] else "Chưa đặt", inline=True)
+        embed.add_field(name="💰 Tiền tệ", value=user_data['currency'] or "VND", inline=True)
+        embed.add_field(name="🌍 Múi giờ", value=user_data['timezone'] or "Asia/Ho_Chi_Minh", inline=True)
+        embed.add_field(name="🔔 Thông báo", value="Bật" if user_data['notifications'] else "Tắt", inline=True)
+        embed.add_field(name="💳 Ngân sách tháng", value=format_money(user_data['monthly_budget']) if user_data['monthly_budget'] else "Chưa đặt", inline=True)
         
         embed.add_field(
             name="📝 Cách sử dụng",
@@ -1339,8 +1723,8 @@ async def settings(ctx, setting: str = None, *, value: str = None):
         
     elif setting == "currency":
         if value and value.upper() in ['VND', 'USD', 'EUR']:
-            cursor.execute('UPDATE users SET currency = ? WHERE user_id = ?', (value.upper(), user_id))
-            conn.commit()
+            await db.execute('UPDATE users SET currency = ? WHERE user_id = ?', (value.upper(), user_id))
+            invalidate_users(user_id)
             embed = discord.Embed(title="✅ Đã cập nhật tiền tệ", color=0x00ff41)
             embed.add_field(name="Tiền tệ mới", value=value.upper())
         else:
@@ -1350,8 +1734,8 @@ async def settings(ctx, setting: str = None, *, value: str = None):
     elif setting == "notifications":
         if value and value.lower() in ['on', 'off', 'bật', 'tắt']:
             notify_on = value.lower() in ['on', 'bật']
-            cursor.execute('UPDATE users SET notifications = ? WHERE user_id = ?', (notify_on, user_id))
-            conn.commit()
+            await db.execute('UPDATE users SET notifications = ? WHERE user_id = ?', (notify_on, user_id))
+            invalidate_users(user_id)
             status = "bật" if notify_on else "tắt"
             embed = discord.Embed(title=f"✅ Đã {status} thông báo", color=0x00ff41)
         else:
@@ -1363,8 +1747,8 @@ async def settings(ctx, setting: str = None, *, value: str = None):
             budget_amount = int(value) if value else 0
             if budget_amount < 0:
                 raise ValueError
-            cursor.execute('UPDATE users SET monthly_budget = ? WHERE user_id = ?', (budget_amount, user_id))
-            conn.commit()
+            await db.execute('UPDATE users SET monthly_budget = ? WHERE user_id = ?', (budget_amount, user_id))
+            invalidate_users(user_id)
             embed = discord.Embed(title="✅ Đã cập nhật ngân sách tháng", color=0x00ff41)
             embed.add_field(name="Ngân sách mới", value=format_money(budget_amount) if budget_amount else "Không giới hạn")
         except ValueError:
@@ -1373,34 +1757,18 @@ async def settings(ctx, setting: str = None, *, value: str = None):
     else:
         embed = discord.Embed(title="❌ Cài đặt không tồn tại", color=0xff4757)
         embed.add_field(name="Có sẵn", value="currency, notifications, budget")
-    
-    conn.close()
+
     await ctx.send(embed=embed)
 
 # ==== LỆNH SEARCH ====
 @bot.command(name='search', aliases=['find'])
 async def search(ctx, *, keyword: str):
     user_id = ctx.author.id
-    get_or_create_user(user_id, ctx.author.display_name)
-    
-    conn = sqlite3.connect('finance_bot.db')
-    cursor = conn.cursor()
-    
-    # Tìm kiếm trong description và category
-    cursor.execute('''
-        SELECT amount, type, category, description, date 
-        FROM transactions 
-        WHERE user_id = ? AND (
-            LOWER(description) LIKE LOWER(?) OR 
-            LOWER(category) LIKE LOWER(?)
-        )
-        ORDER BY date DESC 
-        LIMIT 20
-    ''', (user_id, f'%{keyword}%', f'%{keyword}%'))
-    
-    results = cursor.fetchall()
-    conn.close()
+    await get_or_create_user(user_id, ctx.author.display_name)
     
+    # Tìm kiếm toàn văn (FTS5, không phân biệt dấu) trong description và category
+    results = await db.run(fulltext.search, user_id, keyword, transaction=False)
+
     if not results:
         await ctx.send(f"🔍 Không tìm thấy giao dịch nào với từ khóa '{keyword}'")
         return
@@ -1434,60 +1802,28 @@ async def search(ctx, *, keyword: str):
 
 # ==== LỆNH ACHIEVEMENTS ====
 @bot.command(name='achievements', aliases=['achieve'])
-async def achievements(ctx):
+async def achievements_command(ctx):
     user_id = ctx.author.id
-    get_or_create_user(user_id, ctx.author.display_name)
-    
-    conn = sqlite3.connect('finance_bot.db')
-    cursor = conn.cursor()
-    
-    # Lấy thống kê để tính achievements
-    cursor.execute('SELECT COUNT(*) FROM transactions WHERE user_id = ?', (user_id,))
-    total_transactions = cursor.fetchone()[0]
-    
-    cursor.execute('SELECT SUM(amount) FROM transactions WHERE user_id = ? AND type = "income"', (user_id,))
-    total_income = cursor.fetchone()[0] or 0
-    
-    cursor.execute('SELECT balance FROM users WHERE user_id = ?', (user_id,))
-    current_balance = cursor.fetchone()[0]
-    
-    cursor.execute('SELECT COUNT(DISTINCT DATE(date)) FROM transactions WHERE user_id = ?', (user_id,))
-    active_days = cursor.fetchone()[0]
-    
-    conn.close()
-    
-    # Tính achievements
-    achievements = []
-    
-    if total_transactions >= 1:
-        achievements.append(("🌱", "Bước đầu tiên", "Thực hiện giao dịch đầu tiên"))
-    if total_transactions >= 50:
-        achievements.append(("📊", "Chuyên gia ghi chép", "50 giao dịch đã ghi"))
-    if total_transactions >= 100:
-        achievements.append(("🏆", "Siêu sao tài chính", "100 giao dịch đã ghi"))
-    
-    if total_income >= 10000000:  # 10M
-        achievements.append(("💰", "Triệu phú nhỏ", "Tổng thu nhập 10M+"))
-    if total_income >= 100000000:  # 100M
-        achievements.append(("💎", "Đại gia", "Tổng thu nhập 100M+"))
-    
-    if current_balance >= 5000000:  # 5M
-        achievements.append(("🏦", "Tiết kiệm giỏi", "Số dư 5M+"))
-    if current_balance >= 50000000:  # 50M
-        achievements.append(("👑", "Vua tiết kiệm", "Số dư 50M+"))
-    
-    if active_days >= 7:
-        achievements.append(("🔥", "Streak 7 ngày", "Hoạt động 7 ngày"))
-    if active_days >= 30:
-        achievements.append(("⭐", "Người bền bỉ", "Hoạt động 30 ngày"))
-    
+    await get_or_create_user(user_id, ctx.author.display_name)
+
+    # Bộ đếm được cập nhật khi ghi giao dịch: chỉ đọc một dòng user_stats
+    stats, unlocked = await db.run(achievements.load, user_id, transaction=False)
+    current_balance = (await get_user_profile(user_id))['balance']
+    total_transactions = stats['tx_count']
+
     embed = discord.Embed(title="🏆 Thành Tích", color=0xf39c12)
     
-    if achievements:
-        for icon, name, desc in achievements:
+    if unlocked:
+        for _, icon, name, desc, _, _ in unlocked:
             embed.add_field(name=f"{icon} **{name}**", value=desc, inline=True)
     else:
         embed.add_field(name="🌱 Chưa có thành tích", value="Hãy bắt đầu sử dụng bot để mở khóa!", inline=False)
+
+    streak = achievements.current_streak(stats, datetime.now().date())
+    embed.add_field(name="🔥 Chuỗi ngày",
+                    value=f"Hiện tại: {streak} ngày • Dài nhất: {stats['best_streak']} ngày\n"
+                          f"Tổng số ngày hoạt động: {stats['active_days']}",
+                    inline=False)
     
     # Progress đến achievement tiếp theo
     next_achievements = []
@@ -1510,71 +1846,79 @@ async def achievements(ctx):
 @bot.command(name='report')
 async def report(ctx, period: str = "month"):
     user_id = ctx.author.id
-    get_or_create_user(user_id, ctx.author.display_name)
-    
-    conn = sqlite3.connect('finance_bot.db')
-    cursor = conn.cursor()
+    await get_or_create_user(user_id, ctx.author.display_name)
     
     # Xác định period
     if period == "week":
-        start_date = (datetime.now() - timedelta(days=7)).strftime('%Y-%m-%d')
+        start_ts = to_ts(day_start(datetime.now() - timedelta(days=7)))
         title = "📋 Báo Cáo Tuần"
-        date_filter = "date >= ?"
-        params = (user_id, start_date)
+        date_filter = "ts >= ?"
+        params = (user_id, start_ts)
+        months = None
     elif period == "year":
         current_year = datetime.now().year
         title = f"📋 Báo Cáo Năm {current_year}"
-        date_filter = "date LIKE ?"
-        params = (user_id, f'{current_year}%')
+        months = rollup.year_bounds(datetime.now())
     else:  # month
         current_month = datetime.now().strftime('%Y-%m')
         title = f"📋 Báo Cáo Tháng {current_month}"
-        date_filter = "date LIKE ?"
-        params = (user_id, f'{current_month}%')
-    
-    # Lấy dữ liệu tổng hợp
-    cursor.execute(f'''
-        SELECT 
-            SUM(CASE WHEN type = "income" THEN amount ELSE 0 END) as total_income,
-            SUM(CASE WHEN type = "expense" THEN amount ELSE 0 END) as total_expense,
-            COUNT(*) as total_transactions,
-            AVG(CASE WHEN type = "expense" THEN amount ELSE NULL END) as avg_expense
-        FROM transactions 
-        WHERE user_id = ? AND {date_filter}
-    ''', params)
-    
-    summary = cursor.fetchone()
+        months = rollup.month_bounds(datetime.now())
+
+    def rollup_summary(conn, start_month, end_month):
+        totals = {tx_type: (total, count)
+                  for tx_type, total, count in rollup.type_totals(conn, user_id, start_month, end_month)}
+        income = totals.get('income', (0, 0))[0]
+        expense, expense_count = totals.get('expense', (0, 0))
+        total_trans = sum(count for _, count in totals.values())
+        return income, expense, total_trans, (expense / expense_count if expense_count else None)
+
+    def load_from_rollup(conn):
+        summary = rollup_summary(conn, *months)
+        top_expenses = rollup.category_totals(conn, user_id, 'expense', *months, limit=5)
+
+        # Lấy trends (so sánh với period trước)
+        prev_data = None
+        if period == "month":
+            prev_month = datetime.now().replace(day=1) - timedelta(days=1)
+            prev_data = rollup_summary(conn, *rollup.month_bounds(prev_month))[:2]
+        return summary, top_expenses, prev_data
+
+    def load_from_transactions(conn):
+        cursor = conn.cursor()
+
+        # Lấy dữ liệu tổng hợp
+        cursor.execute(f'''
+            SELECT
+                SUM(CASE WHEN type = "income" THEN amount ELSE 0 END) as total_income,
+                SUM(CASE WHEN type = "expense" THEN amount ELSE 0 END) as total_expense,
+                COUNT(*) as total_transactions,
+                AVG(CASE WHEN type = "expense" THEN amount ELSE NULL END) as avg_expense
+            FROM transactions
+            WHERE user_id = ? AND {date_filter}
+        ''', params)
+        summary = cursor.fetchone()
+
+        # Top categories
+        cursor.execute(f'''
+            SELECT category, SUM(amount), COUNT(*)
+            FROM transactions
+            WHERE user_id = ? AND type = "expense" AND {date_filter}
+            GROUP BY category
+            ORDER BY SUM(amount) DESC
+            LIMIT 5
+        ''', params)
+        top_expenses = cursor.fetchall()
+        return summary, top_expenses, None
+
+    # Tháng/năm: tổng hợp từ rollup, tuần: quét khoảng ts
+    summary, top_expenses, prev_data = await db.run(load_from_rollup if months else load_from_transactions)
     total_income, total_expense, total_trans, avg_expense = summary
     total_income = total_income or 0
     total_expense = total_expense or 0
     avg_expense = avg_expense or 0
-    
-    # Top categories
-    cursor.execute(f'''
-        SELECT category, SUM(amount), COUNT(*) 
-        FROM transactions 
-        WHERE user_id = ? AND type = "expense" AND {date_filter}
-        GROUP BY category 
-        ORDER BY SUM(amount) DESC 
-        LIMIT 5
-    ''', params)
-    top_expenses = cursor.fetchall()
-    
-    # Lấy trends (so sánh với period trước)
-    if period == "month":
-        prev_month = (datetime.now().replace(day=1) - timedelta(days=1)).strftime('%Y-%m')
-        cursor.execute('''
-            SELECT 
-                SUM(CASE WHEN type = "income" THEN amount ELSE 0 END),
-                SUM(CASE WHEN type = "expense" THEN amount ELSE 0 END)
-            FROM transactions 
-            WHERE user_id = ? AND date LIKE ?
-        ''', (user_id, f'{prev_month}%'))
-        prev_data = cursor.fetchone()
+    if prev_data:
         prev_income, prev_expense = prev_data[0] or 0, prev_data[1] or 0
-    
-    conn.close()
-    
+
     # Tạo embed báo cáo
     embed = discord.Embed(title=title, color=0x2ecc71)
     
@@ -1646,16 +1990,13 @@ async def report(ctx, period: str = "month"):
 @bot.command(name='goal', aliases=['target'])
 async def goal(ctx, amount: int = None):
     user_id = ctx.author.id
-    get_or_create_user(user_id, ctx.author.display_name)
-
-    conn = sqlite3.connect('finance_bot.db')
-    cursor = conn.cursor()
+    await get_or_create_user(user_id, ctx.author.display_name)
 
     if amount is None:
         # Hiển thị mục tiêu hiện tại
-        cursor.execute('SELECT balance, goal FROM users WHERE user_id = ?', (user_id,))
-        balance, goal_amt = cursor.fetchone()
-        
+        profile = await get_user_profile(user_id)
+        balance, goal_amt = profile['balance'], profile['goal']
+
         if goal_amt == 0:
             embed = discord.Embed(
                 title="🎯 Mục Tiêu Của Bạn",
@@ -1672,17 +2013,15 @@ async def goal(ctx, amount: int = None):
             remain = max(goal_amt - balance, 0)
             
             # Tính thời gian dự kiến
-            current_month = datetime.now().strftime('%Y-%m')
-            cursor.execute('''
+            avg_monthly_saving = await db.fetchval('''
                 SELECT AVG(monthly_saving) FROM (
-                    SELECT SUM(CASE WHEN type="income" THEN amount ELSE -amount END) as monthly_saving
-                    FROM transactions 
-                    WHERE user_id = ? AND date LIKE ?
-                    GROUP BY substr(date, 1, 7)
+                    SELECT SUM(CASE WHEN type="income" THEN total ELSE -total END) as monthly_saving
+                    FROM monthly_rollup
+                    WHERE user_id = ? AND month >= ? AND month < ?
+                    GROUP BY month
                 ) WHERE monthly_saving > 0
-            ''', (user_id, f'{current_month[:4]}%'))
-            avg_monthly_saving = cursor.fetchone()[0] or 0
-            
+            ''', (user_id, *rollup.year_bounds(datetime.now())), default=0)
+
             embed = discord.Embed(title="🎯 Mục Tiêu Tiết Kiệm", color=0x4ecdc4)
             embed.add_field(name="🎯 Mục tiêu", value=format_money(goal_amt), inline=True)
             embed.add_field(name="💰 Hiện tại", value=format_money(balance), inline=True)
@@ -1713,12 +2052,10 @@ async def goal(ctx, amount: int = None):
             await ctx.send("❌ Mục tiêu phải lớn hơn 0!")
             return
         
-        cursor.execute('UPDATE users SET goal = ? WHERE user_id = ?', (amount, user_id))
-        conn.commit()
-        
-        cursor.execute('SELECT balance FROM users WHERE user_id = ?', (user_id,))
-        current_balance = cursor.fetchone()[0]
-        
+        await db.execute('UPDATE users SET goal = ? WHERE user_id = ?', (amount, user_id))
+        invalidate_users(user_id)
+        current_balance = (await get_user_profile(user_id))['balance']
+
         embed = discord.Embed(
             title="🎯 Đã Đặt Mục Tiêu Mới",
             description=f"Mục tiêu: **{format_money(amount)}**",
@@ -1734,7 +2071,6 @@ async def goal(ctx, amount: int = None):
         if remaining > 0:
             embed.add_field(name="🎯 Còn cần", value=format_money(remaining), inline=True)
 
-    conn.close()
     await ctx.send(embed=embed)
 
 # ==== XỬ LÝ LỖI NÂNG CẤP ====
@@ -1762,6 +2098,9 @@ async def on_command_error(ctx, error):
         # Không làm gì cho command không tồn tại
         pass
         
+    elif isinstance(error, GuildMoving):
+        await ctx.send("⏳ Dữ liệu của bạn đang được chuyển sang database riêng của server, vui lòng thử lại sau ít phút.")
+
     elif isinstance(error, commands.CommandOnCooldown):
         embed = discord.Embed(
             title="⏰ Vui Lòng Chờ",
@@ -1786,59 +2125,297 @@ async def on_command_error(ctx, error):
 @bot.command(name='admin_stats')
 @commands.has_permissions(administrator=True)
 async def admin_stats(ctx):
-    conn = sqlite3.connect('finance_bot.db')
-    cursor = conn.cursor()
-    
-    cursor.execute('SELECT COUNT(*) FROM users')
-    total_users = cursor.fetchone()[0]
-    
-    cursor.execute('SELECT COUNT(*) FROM transactions')
-    total_transactions = cursor.fetchone()[0]
-    
-    cursor.execute('SELECT SUM(balance) FROM users')
-    total_balance = cursor.fetchone()[0] or 0
-    
-    cursor.execute('SELECT COUNT(*) FROM users WHERE last_active >= ?', 
-                   ((datetime.now() - timedelta(days=7)).strftime('%Y-%m-%d'),))
-    active_users = cursor.fetchone()[0]
-    
-    conn.close()
-    
+    guild_id = guild_id_of(ctx)
+    week_ago = (datetime.now() - timedelta(days=7)).strftime('%Y-%m-%d')
+
+    def load(conn):
+        if guild_id is not None:
+            # Trong server: chỉ đọc thành viên và giao dịch của guild này (qua index)
+            total_users, total_balance, active_users = conn.execute('''
+                SELECT COUNT(*), COALESCE(SUM(u.balance), 0), COALESCE(SUM(u.last_active >= ?), 0)
+                FROM guild_members m
+                JOIN users u ON u.user_id = m.user_id
+                WHERE m.guild_id = ?
+            ''', (week_ago, guild_id)).fetchone()
+            total_transactions = conn.execute('SELECT COUNT(*) FROM transactions WHERE guild_id = ?',
+                                              (guild_id,)).fetchone()[0]
+            return total_users, total_transactions, total_balance, active_users
+
+        # DM: toàn bộ shard
+        cursor = conn.cursor()
+
+        cursor.execute('SELECT COUNT(*) FROM users')
+        total_users = cursor.fetchone()[0]
+
+        cursor.execute('SELECT COUNT(*) FROM transactions')
+        total_transactions = cursor.fetchone()[0]
+
+        cursor.execute('SELECT SUM(balance) FROM users')
+        total_balance = cursor.fetchone()[0] or 0
+
+        cursor.execute('SELECT COUNT(*) FROM users WHERE last_active >= ?', (week_ago,))
+        active_users = cursor.fetchone()[0]
+        return total_users, total_transactions, total_balance, active_users
+
+    # Mỗi user chỉ nằm ở một shard nên cộng kết quả các shard không bị trùng
+    totals = [0, 0, 0, 0]
+    shard_list = router.shards()
+    for current in shard_list:
+        with router.using(current):
+            for index, value in enumerate(await db.run(load)):
+                totals[index] += value
+    total_users, total_transactions, total_balance, active_users = totals
+
     embed = discord.Embed(title="📊 Thống Kê Bot", color=0xe74c3c)
+    names = ', '.join(f'`{current.name}`' for current in shard_list)
+    embed.description = (f"Server **{ctx.guild.name}** • database {names}" if ctx.guild
+                         else f"Toàn bộ database {names}")
     embed.add_field(name="👥 Tổng users", value=total_users, inline=True)
     embed.add_field(name="💳 Tổng giao dịch", value=total_transactions, inline=True)
     embed.add_field(name="💰 Tổng số dư", value=format_money(total_balance), inline=True)
     embed.add_field(name="🔥 Users hoạt động (7d)", value=active_users, inline=True)
+
+    cache = chart_cache.stats()
+    embed.add_field(name="🖼️ Cache biểu đồ",
+                    value=f"{cache['entries']} ảnh ({cache['bytes'] / 1024:.0f} KB)\n"
+                          f"Hit: {cache['hits']} (+{cache['disk_hits']} từ đĩa) • Miss: {cache['misses']}",
+                    inline=True)
+    for name, cache in (("👤 Cache user", shard().profile_cache), ("📂 Cache danh mục", shard().category_cache)):
+        counters = cache.stats()
+        embed.add_field(name=name,
+                        value=f"{counters['entries']} mục\nHit: {counters['hits']} • Miss: {counters['misses']} "
+                              f"• Evict: {counters['evictions']}",
+                        inline=True)
     
     await ctx.send(embed=embed)
 
+def format_ms(seconds):
+    return f"{seconds * 1000:.0f} ms" if seconds >= 0.01 else f"{seconds * 1000:.1f} ms"
+
+def hit_ratio(hits, misses):
+    total = hits + misses
+    return f"{hits / total:.0%}" if total else "–"
+
+@bot.command(name='admin_metrics')
+@commands.has_permissions(administrator=True)
+async def admin_metrics(ctx):
+    """Độ trễ theo lệnh (p50/p95, chia db/vẽ/gửi), số câu SQL, cache và event loop"""
+    latency = metrics.COMMAND_SECONDS
+    commands_seen = sorted({command for command, _ in latency.label_sets()},
+                           key=lambda command: -latency.count(command, 'total'))
+
+    embed = discord.Embed(title="📈 Hiệu Năng Bot", color=0xe74c3c)
+    embed.description = "Từ lúc khởi động • p50/p95 ước lượng từ histogram"
+    for command in commands_seen[:CONFIG['METRICS_TOP_COMMANDS']]:
+        value = (f"{latency.count(command, 'total')} lần • p50 {format_ms(latency.quantile(0.5, command, 'total'))} "
+                 f"• p95 {format_ms(latency.quantile(0.95, command, 'total'))}\n"
+                 f"TB: db {format_ms(latency.mean(command, 'db'))} • vẽ {format_ms(latency.mean(command, 'render'))} "
+                 f"• gửi {format_ms(latency.mean(command, 'send'))} • {metrics.COMMAND_QUERIES.mean(command):.1f} SQL")
+        errors = metrics.COMMANDS.get(command, 'error')
+        if errors:
+            value += f" • {errors:.0f} lỗi"
+        embed.add_field(name=f"/{command}", value=value, inline=False)
+    if not commands_seen:
+        embed.add_field(name="ℹ️ Chưa có dữ liệu", value="Chưa có lệnh nào được đo", inline=False)
+
+    embed.add_field(name="⏳ Event loop",
+                    value=f"Trễ p99 {format_ms(metrics.LOOP_LAG.quantile(0.99))} • max {format_ms(loop_lag.worst)}",
+                    inline=True)
+    embed.add_field(name="🖼️ Hàng đợi biểu đồ", value=f"{chart_renderer.pending}/{CONFIG['CHART_MAX_PENDING']}",
+                    inline=True)
+    cache = chart_cache.stats()
+    profile, category = shard().profile_cache.stats(), shard().category_cache.stats()
+    embed.add_field(name="🎯 Tỷ lệ trúng cache",
+                    value=f"Biểu đồ {hit_ratio(cache['hits'] + cache['disk_hits'], cache['misses'])} • "
+                          f"User {hit_ratio(profile['hits'], profile['misses'])} • "
+                          f"Danh mục {hit_ratio(category['hits'], category['misses'])}",
+                    inline=True)
+    if metrics_server is not None:
+        embed.set_footer(text=f"Prometheus: http://{CONFIG['METRICS_HOST']}:{CONFIG['METRICS_PORT']}/metrics")
+    await ctx.send(embed=embed)
+
+def truncate(text, limit):
+    return text if len(text) <= limit else text[:limit - 1] + '…'
+
+@bot.command(name='admin_slow')
+@commands.has_permissions(administrator=True)
+async def admin_slow(ctx, kind: str = "all"):
+    """Các lần event loop bị chặn và câu SQL chậm gần nhất (chi tiết trong file log)"""
+    embed = discord.Embed(title="🐢 Chẩn Đoán Hiệu Năng", color=0xe74c3c)
+    embed.description = (f"Ngưỡng: event loop {format_ms(watchdog.threshold)} • SQL {format_ms(slow_queries.threshold)}"
+                         f"\nChi tiết (stack, query plan): `{CONFIG['DIAGNOSTICS_LOG']}`")
+    if kind in ('all', 'loop'):
+        for entry in watchdog.recent(3 if kind == 'all' else 8):
+            # Frame cuối là đoạn code đang chặn
+            frames = [line for line in entry['stack'].splitlines() if line.strip().startswith('File')]
+            embed.add_field(name=f"⏳ {entry['time']:%H:%M:%S} • {format_ms(entry['seconds'])} • {entry['running']}",
+                            value=f"```{truncate(frames[-1].strip() if frames else '?', 300)}```", inline=False)
+        if not watchdog.total:
+            embed.add_field(name="⏳ Event loop", value="Chưa bị chặn quá ngưỡng", inline=False)
+    if kind in ('all', 'sql'):
+        for entry in slow_queries.recent(5 if kind == 'all' else 8):
+            rows = '?' if entry['rows'] is None else entry['rows']
+            value = f"```sql\n{truncate(entry['sql'], 350)}```{entry['params']} • {rows} dòng"
+            if entry['plan']:
+                value += f"\n```{truncate(entry['plan'], 200)}```"
+            embed.add_field(name=f"🗄️ {entry['time']:%H:%M:%S} • {format_ms(entry['seconds'])} • "
+                                 f"{entry['command'] or 'task nền'}",
+                            value=value, inline=False)
+        if not slow_queries.total:
+            embed.add_field(name="🗄️ SQL", value="Chưa có câu chậm", inline=False)
+    embed.set_footer(text=f"Tổng: {watchdog.total} lần chặn • {slow_queries.total} câu chậm • "
+                          f"/admin_slow loop|sql để xem thêm")
+    await ctx.send(embed=embed)
+
+@bot.command(name='admin_rebuild')
+@commands.has_permissions(administrator=True)
+async def admin_rebuild(ctx, member: discord.Member = None):
+    """Tính lại bảng tổng hợp tháng và bộ đếm thành tích từ transactions (toàn bộ hoặc một user)"""
+    started = time.perf_counter()
+    user_id = member.id if member else None
+    now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    # Một user: shard giữ ví của họ; toàn bộ: mọi shard
+    targets = [router.shard_for(user_id)] if member else router.shards()
+    rows = stats_rows = 0
+    for current in targets:
+        with router.using(current):
+            rows += await db.run(rollup.rebuild, user_id)
+            stats_rows += await db.run(achievements.rebuild, now, user_id)
+        async with leaderboard_lock:
+            current.leaderboards.clear()
+    elapsed = time.perf_counter() - started
+
+    embed = discord.Embed(title="🛠️ Đã Dựng Lại Rollup", color=0xe74c3c)
+    embed.add_field(name="👤 Phạm vi", value=member.display_name if member else f"Toàn bộ ({len(targets)} file)",
+                    inline=True)
+    embed.add_field(name="📦 Số dòng", value=f"{rows} (rollup) • {stats_rows} (thành tích)", inline=True)
+    embed.add_field(name="⏱️ Thời gian", value=f"{elapsed:.2f}s", inline=True)
+    await ctx.send(embed=embed)
+
+@bot.command(name='admin_move_guild')
+@commands.has_permissions(administrator=True)
+@commands.guild_only()
+async def admin_move_guild(ctx):
+    """Chuyển ví của các thành viên server sang file database riêng (cho server có lượng ghi lớn).
+
+    Ví được chuyển hẳn (xóa khỏi database chung), từ đó mọi lệnh của họ, kể
+    cả trong DM hay server khác, đọc ghi file riêng. Chạy lại để chuyển các
+    thành viên mới; thành viên đã ở file của server khác thì giữ nguyên.
+    """
+    guild_id = ctx.guild.id
+    source = router.default
+    path = router.guild_paths.get(guild_id) or router.dedicated_path(guild_id)
+    new_file = guild_id not in router.guild_paths
+    if new_file and os.path.exists(path):
+        await ctx.send(f"❌ File `{path}` đã tồn tại, hãy kiểm tra hoặc xóa trước khi chuyển.")
+        return
+
+    with router.using(source):
+        members = await db.run(shards.guild_member_ids, guild_id, transaction=False)
+    movers = [user_id for user_id in members if router.shard_for(user_id) is source]
+    # Thành viên đã chuyển không còn trong guild_members của file chung: đếm ở file giữ ví của họ
+    here = elsewhere = 0
+    for current in router.shards():
+        if current is source:
+            continue
+        with router.using(current):
+            homed = await db.run(shards.guild_member_ids, guild_id, transaction=False)
+        for user_id in homed:
+            if router.user_paths.get(user_id) == current.path:
+                if current.path == path:
+                    here += 1
+                else:
+                    elsewhere += 1
+    if not movers:
+        await ctx.send(f"ℹ️ Không còn thành viên nào ở database chung ({here} thành viên đã ở file của server này, "
+                       f"{elsewhere} ở file riêng khác)")
+        return
+
+    started = time.perf_counter()
+    router.moving.update(movers)
+    try:
+        # Lệnh mới của các thành viên bị từ chối; chờ các lệnh đang chạy (trừ lệnh này) xong
+        await router.drain(movers, keep=1 if ctx.author.id in movers else 0)
+        await asyncio.to_thread(shards.migrate, path)
+        with router.using(source):
+            await db.run(source.activity.flush)
+            moved = await db.run(shards.move_users, movers, path, transaction=False)
+        target = router.assign(guild_id, path, movers)
+        async with leaderboard_lock:
+            source.forget(movers)
+            target.forget(movers)
+    except BaseException:
+        if new_file and guild_id not in router.guild_paths:
+            for suffix in ('', '-wal', '-shm'):
+                if os.path.exists(path + suffix):
+                    os.remove(path + suffix)
+        raise
+    finally:
+        router.moving.difference_update(movers)
+    elapsed = time.perf_counter() - started
+
+    embed = discord.Embed(title="🗄️ Đã Chuyển Sang Database Riêng", color=0xe74c3c)
+    embed.add_field(name="📁 File", value=f"`{path}`", inline=False)
+    embed.add_field(name="👥 Thành viên", value=f"{moved['users']:,}", inline=True)
+    embed.add_field(name="💳 Giao dịch", value=f"{moved['transactions']:,}", inline=True)
+    embed.add_field(name="⏱️ Thời gian", value=f"{elapsed:.2f}s", inline=True)
+    if here or elsewhere:
+        embed.set_footer(text=f"Giữ nguyên: {here} thành viên đã ở file này từ trước, {elsewhere} ở file riêng khác")
+    await ctx.send(embed=embed)
+
 # ==== SLASH COMMANDS (Nếu muốn) ====
 from discord import app_commands
 
-@bot.tree.command(name="balance", description="Xem số dư và tổng quan tài chính")
-async def slash_balance(interaction: discord.Interaction):
+async def invoke_slash(interaction, command, *args, **kwargs):
+    """Chạy lệnh prefix cho slash command qua cùng hook before/after_invoke
+    (định tuyến shard, chặn khi ví đang chuyển, đếm lệnh đang chạy, metrics)"""
     # Chuyển đổi interaction thành context-like object
     ctx = await bot.get_context(interaction)
-    await balance(ctx)
+    try:
+        await remember_member(ctx)
+    except commands.CommandError as e:
+        await on_command_error(ctx, e)
+        return
+    try:
+        await command(ctx, *args, **kwargs)
+    except commands.CommandError as e:
+        ctx.command_failed = True
+        await on_command_error(ctx, e)
+    except BaseException:
+        ctx.command_failed = True
+        raise
+    finally:
+        await finish_command(ctx)
+
+@bot.tree.command(name="balance", description="Xem số dư và tổng quan tài chính")
+async def slash_balance(interaction: discord.Interaction):
+    await invoke_slash(interaction, balance)
 
 @bot.tree.command(name="quick_add", description="Thêm thu nhập nhanh")
 async def slash_quick_add(interaction: discord.Interaction, amount: int, description: str = "Thu nhập"):
-    ctx = await bot.get_context(interaction)
-    await add(ctx, amount, "Khác", description=description)
+    await invoke_slash(interaction, add, amount, "Khác", description=description)
 
 # ==== CHẠY BOT ====
 if __name__ == "__main__":
+    diagnostics.setup_file_log(CONFIG['DIAGNOSTICS_LOG'], CONFIG['DIAGNOSTICS_LOG_BYTES'],
+                               CONFIG['DIAGNOSTICS_LOG_BACKUPS'])
+
     # Khởi tạo database khi start
+    started = time.perf_counter()
     init_database()
+    STARTUP_TIMINGS['database'] = time.perf_counter() - started
     
     # Sync slash commands
     @bot.event
     async def setup_hook():
+        started = time.perf_counter()
         try:
             synced = await bot.tree.sync()
             print(f"✅ Đồng bộ {len(synced)} slash commands")
         except Exception as e:
             print(f"❌ Lỗi đồng bộ slash commands: {e}")
+        STARTUP_TIMINGS['sync'] = time.perf_counter() - started
+        log_startup_timings()
     
     # Chạy bot
     try:
@@ -1846,3 +2423,11 @@ if __name__ == "__main__":
     except Exception as e:
         print(f"❌ Lỗi khởi động bot: {e}")
         print("💡 Kiểm tra lại BOT_TOKEN và kết nối internet")
+    finally:
+        chart_renderer.close()
+        for current in router.shards():
+            try:
+                current.db.run_sync(current.activity.flush)
+            except Exception as e:
+                logger.error(f"Error flushing last_active ({current.path}): {e}")
+        router.close()
@@ -0,0 +1,58 @@
+import io
+
+# Chạy trong process worker của charts.ChartRenderer: không import gì của bot,
+# worker chỉ nạp module này (và matplotlib khi vẽ)
+
+# Cấu hình giao diện; là một phần của khóa cache nên đổi giao diện sẽ không
+# trả về ảnh cũ
+CHART_STYLE = {
+    'style': 'dark_background',
+    'facecolor': '#2C2F33',
+    'dpi': 100,
+}
+
+# ==== VẼ BIỂU ĐỒ (chạy trong process worker) ====
+def render_chart(data, chart_type, title, width, height, chart_style=CHART_STYLE):
+    """Vẽ biểu đồ bằng API Figure (không dùng state toàn cục của pyplot), trả về PNG"""
+    # Chỉ import trong process worker: tiến trình bot không phải nạp matplotlib
+    from matplotlib import colormaps, style
+    from matplotlib.figure import Figure
+
+    with style.context(chart_style['style']):
+        fig = Figure(figsize=(width, height))
+        ax = fig.subplots()
+
+        if chart_type == 'pie' and data:
+            labels = [item[0] for item in data]
+            sizes = [item[1] for item in data]
+            colors = colormaps['Set3'](range(len(labels)))
+
+            wedges, texts, autotexts = ax.pie(sizes, labels=labels, autopct='%1.1f%%', colors=colors)
+            for autotext in autotexts:
+                autotext.set_color('white')
+                autotext.set_fontweight('bold')
+
+        elif chart_type == 'bar' and data:
+            labels = [item[0] for item in data]
+            values = [item[1] for item in data]
+            colors = colormaps['viridis'](range(len(labels)))
+
+            bars = ax.bar(labels, values, color=colors)
+            ax.set_ylabel('Số tiền (₫)')
+            for label in ax.get_xticklabels():
+                label.set_rotation(45)
+                label.set_horizontalalignment('right')
+
+            # Thêm giá trị trên cột
+            for bar, value in zip(bars, values):
+                height = bar.get_height()
+                ax.text(bar.get_x() + bar.get_width()/2., height,
+                        f'{value:,.0f}₫', ha='center', va='bottom')
+
+        ax.set_title(title, fontsize=16, fontweight='bold', color='white')
+        fig.tight_layout()
+
+        buffer = io.BytesIO()
+        fig.savefig(buffer, format='png', dpi=chart_style['dpi'], bbox_inches='tight',
+                    facecolor=chart_style['facecolor'])
+    return buffer.getvalue()
@@ -0,0 +1,197 @@
+import asyncio
+import hashlib
+import os
+import sys
+import threading
+import types
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing.context import SpawnContext, SpawnProcess
+
+from chart_render import CHART_STYLE, render_chart
+
+class ChartQueueFull(Exception):
+    """Có quá nhiều yêu cầu vẽ biểu đồ đang chờ"""
+
+# ==== CACHE ẢNH BIỂU ĐỒ ====
+def chart_key(chart_type, period, title, data, width, height, chart_style=CHART_STYLE):
+    """Khóa theo nội dung: dữ liệu đổi thì khóa đổi, không cần hết hạn theo thời gian"""
+    payload = repr((chart_type, period, title, [tuple(row) for row in data],
+                    width, height, sorted(chart_style.items())))
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+class ChartCache:
+    """LRU ảnh PNG đã vẽ, giới hạn theo số ảnh và tổng số byte.
+
+    Ảnh bị đẩy khỏi bộ nhớ được ghi ra `spill_dir` (nếu có) và nạp lại khi
+    được hỏi tới; thư mục này cũng được giới hạn bởi `max_disk_entries`.
+    """
+
+    def __init__(self, max_entries=128, max_bytes=32 * 1024 * 1024,
+                 spill_dir=None, max_disk_entries=1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.spill_dir = spill_dir
+        self.max_disk_entries = max_disk_entries
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.size = 0
+        self._entries = OrderedDict()
+        self._disk = None
+        self._lock = threading.Lock()
+
+    def _disk_index(self):
+        # Nạp danh sách file cũ (cũ nhất trước) ở lần dùng đầu tiên
+        if self._disk is None:
+            self._disk = OrderedDict()
+            if self.spill_dir:
+                os.makedirs(self.spill_dir, exist_ok=True)
+                files = [entry for entry in os.scandir(self.spill_dir) if entry.name.endswith('.png')]
+                for entry in sorted(files, key=lambda entry: entry.stat().st_mtime):
+                    self._disk[entry.name[:-4]] = None
+        return self._disk
+
+    def _disk_path(self, key):
+        return os.path.join(self.spill_dir, f'{key}.png')
+
+    def _spill(self, key, png):
+        disk = self._disk_index()
+        try:
+            with open(self._disk_path(key), 'wb') as f:
+                f.write(png)
+        except OSError:
+            return
+        disk[key] = None
+        disk.move_to_end(key)
+        while len(disk) > self.max_disk_entries:
+            old_key, _ = disk.popitem(last=False)
+            try:
+                os.remove(self._disk_path(old_key))
+            except OSError:
+                pass
+
+    def _load_spilled(self, key):
+        disk = self._disk_index()
+        if key not in disk:
+            return None
+        try:
+            with open(self._disk_path(key), 'rb') as f:
+                png = f.read()
+        except OSError:
+            del disk[key]
+            return None
+        return png
+
+    def _store(self, key, png):
+        if key in self._entries:
+            self.size -= len(self._entries.pop(key))
+        self._entries[key] = png
+        self.size += len(png)
+        while self._entries and (len(self._entries) > self.max_entries or self.size > self.max_bytes):
+            old_key, old_png = self._entries.popitem(last=False)
+            self.size -= len(old_png)
+            if self.spill_dir:
+                self._spill(old_key, old_png)
+
+    def get(self, key):
+        with self._lock:
+            png = self._entries.get(key)
+            if png is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return png
+            if self.spill_dir:
+                png = self._load_spilled(key)
+                if png is not None:
+                    self.disk_hits += 1
+                    self._store(key, png)
+                    return png
+            self.misses += 1
+            return None
+
+    def put(self, key, png):
+        with self._lock:
+            self._store(key, png)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self.size,
+                'disk_entries': len(self._disk) if self._disk is not None else 0,
+                'hits': self.hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+            }
+
+# ==== POOL PROCESS VẼ BIỂU ĐỒ ====
+class RenderProcess(SpawnProcess):
+    """Worker spawn không chạy lại __main__ (bot.py): chỉ cần chart_render.
+
+    Spawn ghi đường dẫn của __main__ vào dữ liệu khởi tạo lúc start() và
+    worker import lại file đó (discord, Bot, mở database...). Thay __main__
+    bằng module rỗng trong lúc start() để worker bỏ qua bước này.
+    """
+
+    def start(self):
+        main = sys.modules['__main__']
+        sys.modules['__main__'] = types.ModuleType('__main__')
+        try:
+            super().start()
+        finally:
+            sys.modules['__main__'] = main
+
+class RenderContext(SpawnContext):
+    Process = RenderProcess
+
+class ChartRenderer:
+    """Vẽ biểu đồ trong ProcessPoolExecutor, giới hạn số yêu cầu đang chờ.
+
+    Tối đa `workers` biểu đồ được vẽ cùng lúc; khi đã có `max_pending` yêu
+    cầu (đang vẽ + đang chờ) thì yêu cầu mới bị từ chối bằng ChartQueueFull.
+    Ảnh đã có trong `cache` được trả về ngay, không chiếm chỗ trong hàng đợi.
+    """
+
+    def __init__(self, workers=2, max_pending=8, cache=None):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.cache = cache
+        self.pending = 0
+        self._executor = None
+        self._slots = None
+
+    def _get_executor(self):
+        if self._executor is None:
+            # spawn: không fork tiến trình bot đang có luồng DB chạy
+            self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=RenderContext())
+            self._slots = asyncio.Semaphore(self.workers)
+        return self._executor
+
+    async def render(self, data, chart_type, title, width, height, period=None):
+        key = None
+        if self.cache is not None:
+            key = chart_key(chart_type, period, title, data, width, height)
+            png = self.cache.get(key)
+            if png is not None:
+                return png
+
+        if self.pending >= self.max_pending:
+            raise ChartQueueFull(f'{self.pending} biểu đồ đang chờ')
+        self.pending += 1
+        try:
+            executor = self._get_executor()
+            async with self._slots:
+                loop = asyncio.get_running_loop()
+                png = await loop.run_in_executor(executor, render_chart,
+                                                 data, chart_type, title, width, height)
+        finally:
+            self.pending -= 1
+        if key is not None:
+            self.cache.put(key, png)
+        return png
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
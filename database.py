@@ -0,0 +1,265 @@
+import asyncio
+import calendar
+import contextvars
+import random
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+import metrics
+
+DB_PATH = 'finance_bot.db'
+DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+# ==== MỐC THỜI GIAN ====
+# transactions.ts là số giây epoch của giờ địa phương (coi như UTC), khớp với
+# strftime('%s', date) của SQLite nên backfill và truy vấn luôn nhất quán.
+def to_ts(dt):
+    return calendar.timegm(dt.timetuple())
+
+def from_ts(ts):
+    return datetime.fromtimestamp(ts, timezone.utc).replace(tzinfo=None)
+
+def date_to_ts(date_text):
+    return to_ts(datetime.strptime(date_text, DATE_FORMAT))
+
+def day_start(dt):
+    return dt.replace(hour=0, minute=0, second=0, microsecond=0)
+
+def month_range(dt):
+    """Khoảng [đầu tháng, đầu tháng sau) dạng epoch"""
+    start = day_start(dt).replace(day=1)
+    if start.month == 12:
+        end = start.replace(year=start.year + 1, month=1)
+    else:
+        end = start.replace(month=start.month + 1)
+    return to_ts(start), to_ts(end)
+
+def year_range(dt):
+    """Khoảng [đầu năm, đầu năm sau) dạng epoch"""
+    start = day_start(dt).replace(month=1, day=1)
+    return to_ts(start), to_ts(start.replace(year=start.year + 1))
+
+# ==== POOL KẾT NỐI DATABASE ====
+BUSY_ERROR_CODES = {sqlite3.SQLITE_BUSY, sqlite3.SQLITE_LOCKED} if hasattr(sqlite3, 'SQLITE_BUSY') else set()
+
+def is_busy(error):
+    """Lỗi 'database is locked/busy' (có thể thử lại)"""
+    code = getattr(error, 'sqlite_errorcode', None)
+    if code is not None and BUSY_ERROR_CODES:
+        return (code & 0xff) in BUSY_ERROR_CODES
+    message = str(error).lower()
+    return 'locked' in message or 'busy' in message
+
+class TracedCursor(sqlite3.Cursor):
+    """Cursor đếm số câu SQL cho metrics và báo câu chạy chậm cho slow_query_log.
+
+    Thời gian của câu trả về dòng gồm cả lúc đọc kết quả bằng fetchone/
+    fetchall/fetchmany; khi lặp trực tiếp trên cursor chỉ tính bước execute
+    (số dòng không biết trước).
+    """
+
+    _pending = None  # [sql, tham số, executemany?, thời gian, số dòng] chờ đọc xong kết quả
+
+    def _traced(self, run, sql, parameters, many):
+        metrics.count_query()
+        slow_log = self.connection.slow_query_log
+        if slow_log is None:
+            return run(sql, parameters)
+        self._finish()
+        started = time.perf_counter()
+        result = run(sql, parameters)
+        elapsed = time.perf_counter() - started
+        if self.description is None:
+            slow_log.check(self.connection, sql, parameters, many, self.rowcount, elapsed)
+        else:
+            self._pending = [sql, parameters, many, elapsed, 0]
+        return result
+
+    def _finish(self, rows=0, fetched=0.0, done=True):
+        pending = self._pending
+        if pending is None:
+            return
+        pending[3] += fetched
+        if rows is None:
+            pending[4] = None
+        elif pending[4] is not None:
+            pending[4] += rows
+        if done:
+            self._pending = None
+            sql, parameters, many, elapsed, total_rows = pending
+            self.connection.slow_query_log.check(self.connection, sql, parameters, many, total_rows, elapsed)
+
+    def execute(self, sql, parameters=()):
+        return self._traced(super().execute, sql, parameters, False)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self._traced(super().executemany, sql, seq_of_parameters, True)
+
+    def fetchone(self):
+        if self._pending is None:
+            return super().fetchone()
+        started = time.perf_counter()
+        row = super().fetchone()
+        self._finish(int(row is not None), time.perf_counter() - started)
+        return row
+
+    def fetchall(self):
+        if self._pending is None:
+            return super().fetchall()
+        started = time.perf_counter()
+        rows = super().fetchall()
+        self._finish(len(rows), time.perf_counter() - started)
+        return rows
+
+    def fetchmany(self, size=None):
+        if size is None:
+            size = self.arraysize
+        if self._pending is None:
+            return super().fetchmany(size)
+        started = time.perf_counter()
+        rows = super().fetchmany(size)
+        self._finish(len(rows), time.perf_counter() - started, done=len(rows) < size)
+        return rows
+
+    def __iter__(self):
+        self._finish(rows=None)
+        return self
+
+class TracedConnection(sqlite3.Connection):
+    slow_query_log = None  # diagnostics.SlowQueryLog, do Database gắn vào
+
+    # Connection.execute gốc không đi qua cursor(), nên viết lại theo cùng cách
+    def cursor(self, factory=TracedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+class Database:
+    """Pool kết nối SQLite dùng chung, chạy truy vấn ngoài event loop.
+
+    Mỗi luồng worker giữ một kết nối sống lâu, nên các lệnh không phải
+    mở/đóng file database mỗi lần và event loop không bị chặn bởi sqlite3.
+    """
+
+    def __init__(self, path=DB_PATH, pool_size=4, timeout=5.0, busy_retries=5, busy_backoff=0.05,
+                 slow_query_log=None):
+        self.path = path
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.busy_retries = busy_retries
+        self.busy_backoff = busy_backoff
+        self.busy_retried = 0
+        self.slow_query_log = slow_query_log
+        self._local = threading.local()
+        self._connections = []
+        self._lock = threading.Lock()
+        self._executor = None
+
+    def _connect(self):
+        # isolation_level=None: tự quản lý BEGIN/COMMIT trong run()
+        conn = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None,
+                               check_same_thread=False, factory=TracedConnection)
+        conn.slow_query_log = self.slow_query_log
+        # WAL: người đọc không chặn người ghi; synchronous=NORMAL đủ an toàn với WAL
+        conn.execute('PRAGMA journal_mode = WAL')
+        conn.execute('PRAGMA synchronous = NORMAL')
+        return conn
+
+    def connection(self):
+        """Kết nối riêng của luồng hiện tại (tạo khi dùng lần đầu)"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._connect()
+            self._local.conn = conn
+            with self._lock:
+                self._connections.append(conn)
+        return conn
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.pool_size,
+                                                    thread_name_prefix='finance-db')
+            return self._executor
+
+    def _run_transaction(self, conn, func, args, immediate):
+        conn.execute('BEGIN IMMEDIATE' if immediate else 'BEGIN')
+        try:
+            result = func(conn, *args)
+        except BaseException:
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+            raise
+        if conn.in_transaction:
+            conn.execute('COMMIT')
+        return result
+
+    def run_sync(self, func, *args, transaction=True, immediate=False):
+        """Chạy func(conn, *args) ngay trên luồng hiện tại.
+
+        immediate=True giữ khóa ghi ngay từ BEGIN (cho các thao tác đọc rồi
+        ghi như trừ tiền). Khi database bận quá `timeout`, cả transaction
+        được chạy lại tối đa `busy_retries` lần với backoff tăng dần, nên
+        func phải chạy lại được.
+        """
+        conn = self.connection()
+        if not transaction:
+            return func(conn, *args)
+        attempt = 0
+        while True:
+            try:
+                return self._run_transaction(conn, func, args, immediate)
+            except sqlite3.OperationalError as e:
+                if not is_busy(e) or attempt >= self.busy_retries:
+                    raise
+            attempt += 1
+            self.busy_retried += 1
+            time.sleep(self.busy_backoff * (2 ** (attempt - 1)) * random.uniform(0.5, 1.5))
+
+    async def run(self, func, *args, transaction=True, immediate=False):
+        """Chạy func(conn, *args) trên luồng DB, commit nếu thành công.
+
+        Thời gian chờ (kể cả xếp hàng trong pool) được tính vào phần 'db'
+        của lệnh đang chạy.
+        """
+        loop = asyncio.get_running_loop()
+        ctx = contextvars.copy_context()
+        with metrics.timed('db'):
+            return await loop.run_in_executor(
+                self._get_executor(), ctx.run,
+                lambda: self.run_sync(func, *args, transaction=transaction, immediate=immediate))
+
+    # ---- Helper cho truy vấn đơn ----
+    async def fetchone(self, sql, params=()):
+        return await self.run(lambda conn: conn.execute(sql, params).fetchone(), transaction=False)
+
+    async def fetchall(self, sql, params=()):
+        return await self.run(lambda conn: conn.execute(sql, params).fetchall(), transaction=False)
+
+    async def fetchval(self, sql, params=(), default=None):
+        row = await self.fetchone(sql, params)
+        if row is None or row[0] is None:
+            return default
+        return row[0]
+
+    async def execute(self, sql, params=()):
+        """Chạy một câu lệnh ghi, trả về số dòng bị ảnh hưởng"""
+        return await self.run(lambda conn: conn.execute(sql, params).rowcount)
+
+    def close(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
+        with self._lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections.clear()
+        self._local = threading.local()
@@ -0,0 +1,190 @@
+import asyncio
+import logging
+import re
+import sqlite3
+import sys
+import threading
+import time
+import traceback
+import weakref
+from collections import OrderedDict, deque
+from datetime import datetime
+from logging.handlers import RotatingFileHandler
+
+import metrics
+
+logger = logging.getLogger('finance.diagnostics')
+
+STACK_FRAMES = 20  # số frame cuối của stack được giữ khi event loop bị chặn
+EXPLAINABLE = ('SELECT', 'WITH', 'INSERT', 'UPDATE', 'DELETE', 'REPLACE')
+
+def setup_file_log(path, max_bytes=5 * 1024 * 1024, backup_count=3):
+    """Ghi cảnh báo chẩn đoán ra file xoay vòng (vẫn in ra console như log khác)"""
+    handler = RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backup_count,
+                                  encoding='utf-8', delay=True)
+    handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(message)s'))
+    logger.addHandler(handler)
+    return handler
+
+def running_command():
+    timer = metrics.current_command.get()
+    return timer.command if timer is not None else None
+
+# ==== CÂU SQL CHẠY CHẬM ====
+def params_shape(parameters, many=False):
+    """Kiểu của tham số (không ghi giá trị: dữ liệu tài chính của user)"""
+    if many:
+        return f'{len(parameters)} dòng' if isinstance(parameters, (list, tuple)) else 'nhiều dòng'
+    if isinstance(parameters, dict):
+        return '{' + ', '.join(f'{key}: {type(value).__name__}' for key, value in parameters.items()) + '}'
+    types = [type(value).__name__ for value in parameters]
+    if len(types) > 6:
+        return f"({len(types)} tham số: {'/'.join(sorted(set(types)))})"
+    return '(' + ', '.join(types) + ')'
+
+def format_plan(rows):
+    """Dòng EXPLAIN QUERY PLAN (id, parent, _, detail) thành cây thụt lề"""
+    depth = {0: -1}
+    lines = []
+    for node_id, parent, _, detail in rows:
+        depth[node_id] = depth.get(parent, -1) + 1
+        lines.append('  ' * depth[node_id] + detail)
+    return '\n'.join(lines)
+
+class SlowQueryLog:
+    """Các câu SQL chạy lâu hơn `threshold` giây (TracedCursor gọi check).
+
+    Mỗi câu chậm được ghi kèm kiểu tham số, số dòng trả về, lệnh đang chạy
+    và EXPLAIN QUERY PLAN (cache theo nội dung câu SQL).
+    """
+
+    def __init__(self, threshold=0.1, max_entries=100, max_plans=256):
+        self.threshold = threshold
+        self.max_plans = max_plans
+        self.entries = deque(maxlen=max_entries)
+        self.total = 0
+        self._plans = OrderedDict()
+        self._lock = threading.Lock()
+
+    def explain(self, conn, sql, parameters, many):
+        with self._lock:
+            if sql in self._plans:
+                return self._plans[sql]
+        plan = None
+        if not many and sql.lstrip().upper().startswith(EXPLAINABLE):
+            try:
+                # Cursor thường: không tự đo/ghi lại chính câu EXPLAIN
+                plan = format_plan(conn.cursor(sqlite3.Cursor).execute('EXPLAIN QUERY PLAN ' + sql,
+                                                                       parameters).fetchall())
+            except sqlite3.Error as e:
+                plan = f'(không lấy được plan: {e})'
+        with self._lock:
+            self._plans[sql] = plan
+            while len(self._plans) > self.max_plans:
+                self._plans.popitem(last=False)
+        return plan
+
+    def check(self, conn, sql, parameters, many, rows, elapsed):
+        if elapsed < self.threshold:
+            return
+        entry = {
+            'time': datetime.now(),
+            'seconds': elapsed,
+            'sql': re.sub(r'\s+', ' ', sql).strip(),
+            'params': params_shape(parameters, many),
+            'rows': rows,
+            'command': running_command(),
+            'plan': self.explain(conn, sql, parameters, many),
+        }
+        with self._lock:
+            self.entries.append(entry)
+            self.total += 1
+        logger.warning(f"Slow query {elapsed * 1000:.0f} ms [{entry['command'] or 'nền'}] "
+                       f"rows={'?' if rows is None else rows} params={entry['params']}: {entry['sql']}"
+                       + (f"\n{entry['plan']}" if entry['plan'] else ''))
+
+    def recent(self, limit=None):
+        with self._lock:
+            entries = list(self.entries)
+        return entries[::-1][:limit]
+
+# ==== PHÁT HIỆN EVENT LOOP BỊ CHẶN ====
+class BlockingWatchdog:
+    """Luồng nền kiểm tra nhịp tim của event loop.
+
+    Event loop tự đặt lại `beat` mỗi `interval` giây; khi nhịp tim trễ quá
+    `threshold`, luồng watchdog chụp stack của luồng event loop (đúng đoạn
+    code đang chặn) và lệnh đang chạy trong task hiện tại.
+    """
+
+    def __init__(self, threshold=0.25, interval=0.05, max_entries=50):
+        self.threshold = threshold
+        self.interval = interval
+        self.entries = deque(maxlen=max_entries)
+        self.total = 0
+        self.commands = weakref.WeakKeyDictionary()  # task -> mô tả lệnh đang chạy trong task đó
+        self.beat = time.monotonic()
+        self._loop = None
+        self._loop_thread = None
+        self._handle = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self, loop):
+        """Gọi từ luồng event loop; gọi lại khi đã chạy thì bỏ qua"""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._loop = loop
+        self._loop_thread = threading.get_ident()
+        self._stop.clear()
+        self._beat()
+        self._thread = threading.Thread(target=self._watch, name='finance-watchdog', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+
+    def _beat(self):
+        self.beat = time.monotonic()
+        self._handle = self._loop.call_later(self.interval, self._beat)
+
+    # ---- Ghi nhận lệnh đang chạy (gọi từ before/after_invoke) ----
+    def command_started(self, description):
+        self.commands[asyncio.current_task()] = description
+
+    def command_finished(self):
+        self.commands.pop(asyncio.current_task(), None)
+
+    def _capture(self, late):
+        frame = sys._current_frames().get(self._loop_thread)
+        stack = ''.join(traceback.format_stack(frame)[-STACK_FRAMES:]) if frame is not None else ''
+        task = asyncio.current_task(self._loop)
+        if task is None:
+            running = 'callback ngoài task'
+        else:
+            running = self.commands.get(task) or getattr(task.get_coro(), '__qualname__', task.get_name())
+        return {'time': datetime.now(), 'seconds': late, 'running': running, 'stack': stack}
+
+    def _watch(self):
+        episode = None
+        while not self._stop.wait(self.interval):
+            late = time.monotonic() - self.beat - self.interval
+            if episode is None and late >= self.threshold:
+                episode = self._capture(late)
+                self.entries.append(episode)
+                self.total += 1
+                logger.warning(f"Event loop bị chặn ≥ {late * 1000:.0f} ms khi chạy {episode['running']}:\n"
+                               f"{episode['stack']}")
+            elif episode is not None:
+                if late >= self.threshold:
+                    episode['seconds'] = late
+                else:
+                    logger.warning(f"Event loop chạy lại sau ~{episode['seconds'] * 1000:.0f} ms "
+                                   f"({episode['running']})")
+                    episode = None
+
+    def recent(self, limit=None):
+        return list(self.entries)[::-1][:limit]
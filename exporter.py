@@ -0,0 +1,169 @@
+import csv
+import gzip
+import io
+import json
+import tempfile
+from datetime import datetime
+
+EXPORT_CHUNK_SIZE = 2000
+SPOOL_MEMORY_BYTES = 1024 * 1024  # Quá mức này thì file tạm được ghi ra đĩa
+PART_MARGIN_BYTES = 1024 * 1024  # Chừa chỗ cho phần gzip/TextIOWrapper còn đệm
+FORMATS = ('json', 'csv', 'ndjson')
+
+TRANSACTION_COLUMNS = ('date', 'amount', 'type', 'category', 'description')
+GOAL_COLUMNS = ('name', 'target_amount', 'current_amount', 'deadline')
+
+# ==== FILE TẠM CHIA PHẦN ====
+class ExportParts:
+    """Ghi dữ liệu xuất vào các file tạm, mở phần mới khi phần hiện tại đầy.
+
+    Mỗi phần là một file hoàn chỉnh (có header/footer riêng) để người dùng
+    đọc được từng phần độc lập.
+    """
+
+    def __init__(self, max_bytes, compress=False, header=None, footer=None):
+        self.max_bytes = max(max_bytes - PART_MARGIN_BYTES, PART_MARGIN_BYTES)
+        self.compress = compress
+        self.header = header
+        self.footer = footer
+        self.files = []
+        self.rows_in_part = 0
+        self._raw = None
+        self._text = None
+
+    @property
+    def part(self):
+        return len(self.files)
+
+    def _open(self):
+        self._raw = tempfile.SpooledTemporaryFile(max_size=SPOOL_MEMORY_BYTES)
+        stream = gzip.GzipFile(fileobj=self._raw, mode='wb') if self.compress else self._raw
+        self._text = io.TextIOWrapper(stream, encoding='utf-8', newline='')
+        self.files.append(self._raw)
+        self.rows_in_part = 0
+        if self.header:
+            self.header(self._text, self.part)
+
+    def _close_part(self):
+        if self.footer:
+            self.footer(self._text, self.part)
+        # Tách TextIOWrapper (không đóng file tạm bên dưới), đóng GzipFile để
+        # ghi phần cuối của gzip; GzipFile không đóng fileobj được truyền vào
+        stream = self._text.detach()
+        if self.compress:
+            stream.close()
+        self._raw.seek(0)
+        self._raw = self._text = None
+
+    def stream(self):
+        """TextIO của phần hiện tại (mở phần mới nếu cần)"""
+        if self._text is None:
+            self._open()
+        return self._text
+
+    def row_written(self):
+        self.rows_in_part += 1
+        if self._raw.tell() >= self.max_bytes:
+            self._close_part()
+
+    def finish(self):
+        if self._text is None and not self.files:
+            self._open()  # Không có dòng nào vẫn xuất một file rỗng hợp lệ
+        if self._text is not None:
+            self._close_part()
+        return self.files
+
+    def close(self):
+        for f in self.files:
+            f.close()
+
+# ==== ĐỌC DỮ LIỆU ====
+def iter_transactions(conn, user_id, chunk_size=EXPORT_CHUNK_SIZE):
+    """Duyệt transactions theo từng lô fetchmany, không nạp hết vào RAM"""
+    cursor = conn.execute(f'''
+        SELECT {', '.join(TRANSACTION_COLUMNS)}
+        FROM transactions
+        WHERE user_id = ?
+        ORDER BY ts DESC, id DESC
+    ''', (user_id,))
+    while True:
+        rows = cursor.fetchmany(chunk_size)
+        if not rows:
+            return
+        yield from rows
+
+def load_goals(conn, user_id):
+    return [dict(zip(GOAL_COLUMNS, row)) for row in conn.execute(
+        f'SELECT {", ".join(GOAL_COLUMNS)} FROM savings_goals WHERE user_id = ?', (user_id,))]
+
+# ==== GHI THEO ĐỊNH DẠNG ====
+def export_csv(conn, user_id, parts):
+    writer = None
+    def header(stream, part):
+        nonlocal writer
+        writer = csv.writer(stream)
+        writer.writerow(['Date', 'Amount', 'Type', 'Category', 'Description'])
+    parts.header = header
+
+    count = 0
+    for row in iter_transactions(conn, user_id):
+        parts.stream()
+        writer.writerow(row)
+        parts.row_written()
+        count += 1
+    return count
+
+def export_json(conn, user_id, parts):
+    export_date = datetime.now().isoformat()
+    goals = load_goals(conn, user_id)
+
+    def header(stream, part):
+        # Mục tiêu tiết kiệm chỉ nằm ở phần 1, các phần sau chỉ có giao dịch
+        stream.write(json.dumps({'user_id': user_id, 'export_date': export_date, 'part': part},
+                                ensure_ascii=False)[:-1])
+        stream.write(', "savings_goals": ')
+        stream.write(json.dumps(goals if part == 1 else [], ensure_ascii=False))
+        stream.write(', "transactions": [\n')
+
+    def footer(stream, part):
+        stream.write('\n]}\n')
+
+    parts.header, parts.footer = header, footer
+    count = 0
+    for row in iter_transactions(conn, user_id):
+        stream = parts.stream()
+        if parts.rows_in_part:
+            stream.write(',\n')
+        stream.write(json.dumps(dict(zip(TRANSACTION_COLUMNS, row)), ensure_ascii=False))
+        parts.row_written()
+        count += 1
+    return count
+
+def export_ndjson(conn, user_id, parts):
+    goals = load_goals(conn, user_id)
+
+    def header(stream, part):
+        if part == 1:
+            for goal in goals:
+                stream.write(json.dumps({'record': 'savings_goal', **goal}, ensure_ascii=False) + '\n')
+    parts.header = header
+
+    count = 0
+    for row in iter_transactions(conn, user_id):
+        record = {'record': 'transaction', **dict(zip(TRANSACTION_COLUMNS, row))}
+        parts.stream().write(json.dumps(record, ensure_ascii=False) + '\n')
+        parts.row_written()
+        count += 1
+    return count
+
+EXPORTERS = {'json': export_json, 'csv': export_csv, 'ndjson': export_ndjson}
+
+def export_user(conn, user_id, format_type, max_bytes, compress=False):
+    """Xuất dữ liệu của user ra các file tạm; trả về (số giao dịch, [file])"""
+    parts = ExportParts(max_bytes, compress=compress)
+    try:
+        count = EXPORTERS[format_type](conn, user_id, parts)
+        return count, parts.finish()
+    except BaseException:
+        parts.close()
+        raise
@@ -0,0 +1,44 @@
+import re
+
+# ==== CHUẨN HÓA TỪ KHÓA ====
+# Tokenizer unicode61 remove_diacritics 2 đã bỏ dấu và chữ hoa, riêng "đ"
+# không phải dấu nên phải đổi sang "d" ở cả trigger lẫn câu truy vấn.
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+def fold(text):
+    return (text or '').replace('đ', 'd').replace('Đ', 'D')
+
+def match_query(user_id, keyword):
+    """Câu MATCH: đúng user, mọi từ khóa khớp theo tiền tố. None nếu không có từ nào"""
+    tokens = TOKEN_RE.findall(fold(keyword))
+    if not tokens:
+        return None
+    terms = ' AND '.join(f'"{token}"*' for token in tokens)
+    return f'user_id : "{int(user_id)}" AND {{description category}} : ({terms})'
+
+# ==== GHI CHỈ MỤC ====
+# Giao dịch mới được index ngay trong đường ghi (không dùng trigger INSERT):
+# trigger chạy mỗi dòng trong một savepoint riêng, khiến FTS5 ghi segment
+# cho từng dòng và làm chậm nhập hàng loạt gần 10 lần.
+def index_rows(conn, rows):
+    """rows: [(id, description, category, user_id)]"""
+    conn.executemany('''
+        INSERT INTO transactions_fts (rowid, description, category, user_id)
+        VALUES (?, ?, ?, ?)
+    ''', [(tx_id, fold(description), fold(category), user_id)
+          for tx_id, description, category, user_id in rows])
+
+# ==== TÌM KIẾM ====
+def search(conn, user_id, keyword, limit=20):
+    """[(amount, type, category, description, date)] xếp theo độ khớp rồi mới nhất"""
+    query = match_query(user_id, keyword)
+    if query is None:
+        return []
+    return conn.execute('''
+        SELECT t.amount, t.type, t.category, t.description, t.date
+        FROM transactions_fts
+        JOIN transactions t ON t.id = transactions_fts.rowid
+        WHERE transactions_fts MATCH ?
+        ORDER BY transactions_fts.rank, t.ts DESC, t.id DESC
+        LIMIT ?
+    ''', (query, limit)).fetchall()
@@ -0,0 +1,258 @@
+import csv
+import io
+import json
+from datetime import datetime
+
+import achievements
+import fulltext
+import rollup
+from database import DATE_FORMAT, to_ts
+
+IMPORT_BATCH_SIZE = 5000
+PROGRESS_EVERY = 10000
+MAX_ERRORS_REPORTED = 10
+FORMATS = ('csv', 'json', 'ndjson')
+TYPES = ('income', 'expense')
+DATE_FORMATS = ('%d/%m/%Y %H:%M:%S', '%d/%m/%Y %H:%M', '%d/%m/%Y')
+
+class ImportFormatError(ValueError):
+    """File không đọc được theo định dạng đã chọn"""
+
+def detect_format(filename):
+    """Định dạng và có nén gzip hay không, theo đuôi file (vd. data.csv.gz)"""
+    name = filename.lower()
+    compressed = name.endswith('.gz')
+    if compressed:
+        name = name[:-3]
+    extension = name.rsplit('.', 1)[-1]
+    return (extension if extension in FORMATS else None), compressed
+
+# ==== ĐỌC FILE THEO DÒNG ====
+def open_text(fileobj, compressed):
+    if compressed:
+        import gzip
+        fileobj = gzip.GzipFile(fileobj=fileobj, mode='rb')
+    # utf-8-sig: bỏ BOM của file CSV xuất từ Excel; newline='' theo yêu cầu của csv
+    return io.TextIOWrapper(fileobj, encoding='utf-8-sig', newline='')
+
+def read_csv(stream):
+    reader = csv.DictReader(stream)
+    if not reader.fieldnames:
+        return
+    # Tên cột không phân biệt hoa thường (file /export dùng Date, Amount, ...)
+    reader.fieldnames = [name.strip().lower() for name in reader.fieldnames]
+    for row in reader:
+        yield reader.line_num, row
+
+def read_ndjson(stream):
+    for line_num, line in enumerate(stream, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError:
+            yield line_num, None
+            continue
+        # Bỏ qua các dòng mục tiêu tiết kiệm trong file /export ndjson
+        if isinstance(record, dict) and record.get('record', 'transaction') != 'transaction':
+            continue
+        yield line_num, record
+
+def read_json(stream):
+    # File JSON là một document duy nhất; kích thước đã bị giới hạn bởi file đính kèm
+    try:
+        document = json.load(stream)
+    except ValueError as e:
+        raise ImportFormatError(f'JSON không hợp lệ: {e}') from None
+    records = document.get('transactions') if isinstance(document, dict) else document
+    if not isinstance(records, list):
+        raise ImportFormatError('JSON phải là danh sách hoặc có khóa "transactions"')
+    yield from enumerate(records, 1)
+
+READERS = {'csv': read_csv, 'json': read_json, 'ndjson': read_ndjson}
+
+# ==== KIỂM TRA DÒNG ====
+def parse_date(value):
+    """datetime từ 'YYYY-MM-DD[ HH:MM[:SS]]' (nhanh, fromisoformat) hoặc dd/mm/YYYY"""
+    value = str(value or '').strip()
+    try:
+        return datetime.fromisoformat(value).replace(tzinfo=None, microsecond=0)
+    except ValueError:
+        pass
+    for date_format in DATE_FORMATS:
+        try:
+            return datetime.strptime(value, date_format)
+        except ValueError:
+            continue
+    raise ValueError(f'ngày không hợp lệ: {value!r}')
+
+def validate(record):
+    """Trả về (amount, type, category, description, date) hoặc raise ValueError"""
+    if not isinstance(record, dict):
+        raise ValueError('dòng không đọc được')
+    amount = record.get('amount')
+    try:
+        if isinstance(amount, (int, float)) and not isinstance(amount, bool):
+            amount = int(amount)
+        else:
+            # Chuỗi có thể có dấu phân cách hàng nghìn: 1.000.000 hoặc 1,000,000
+            amount = int(str(amount or '').strip().replace('.', '').replace(',', ''))
+    except (ValueError, OverflowError):
+        raise ValueError(f"số tiền không hợp lệ: {record.get('amount')!r}") from None
+    if amount <= 0:
+        raise ValueError('số tiền phải lớn hơn 0')
+    tx_type = str(record.get('type') or '').strip().lower()
+    if tx_type not in TYPES:
+        raise ValueError(f'loại phải là income/expense: {tx_type!r}')
+    category = str(record.get('category') or '').strip()[:50] or 'Khác'
+    description = str(record.get('description') or '').strip()[:200]
+    return amount, tx_type, category, description, parse_date(record.get('date'))
+
+# ==== NHẬP VÀO DATABASE ====
+class ImportResult:
+    def __init__(self):
+        self.imported = 0
+        self.skipped = 0
+        self.errors = []  # [(dòng, lý do)], tối đa MAX_ERRORS_REPORTED
+        self.net = 0  # thay đổi số dư
+        self.income = 0
+        self.days = set()  # các ngày có giao dịch, cho bộ đếm thành tích
+        self.rejected = []  # [(user_id, số dư hiện tại, thay đổi số dư, số dòng)] bị hoàn tác vì số dư sẽ âm
+
+    def reject(self, user_id, balance):
+        """Cả lô của user bị hoàn tác: ghi lại lý do, không còn dòng nào được nhập"""
+        self.rejected.append((user_id, balance, self.net, self.imported))
+        self.imported = 0
+        self.net = 0
+        self.income = 0
+        self.days.clear()
+
+    def error(self, line_num, reason):
+        self.skipped += 1
+        if len(self.errors) < MAX_ERRORS_REPORTED:
+            self.errors.append((line_num, reason))
+
+def import_transactions(conn, user_id, fileobj, format_type, compressed=False,
+                        max_rows=None, progress=None, guild_id=None):
+    """Nhập giao dịch theo hai bước để giữ khóa ghi ngắn.
+
+    Đọc và kiểm tra file vào bảng tạm temp.import_rows (chỉ ghi database
+    temp của kết nối, không khóa file chính) và gộp rollup theo nhóm
+    (tháng, loại, danh mục). Sau đó mới mở một transaction IMMEDIATE để
+    cập nhật số dư, chép bảng tạm vào transactions và chỉ mục tìm kiếm,
+    cộng rollup. progress(số dòng) được gọi mỗi PROGRESS_EVERY dòng. Như
+    ledger.post, số dư không được âm: nếu tổng thay đổi làm số dư âm thì cả
+    lô bị hoàn tác và user nằm trong result.rejected.
+    """
+    result = ImportResult()
+    stream = open_text(fileobj, compressed)
+    groups = {}
+    batch = []
+
+    def flush():
+        conn.executemany('''
+            INSERT INTO temp.import_rows (seq, amount, type, category, description, date, ts,
+                                          fts_description, fts_category)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', batch)
+        batch.clear()
+
+    conn.execute('''
+        CREATE TEMP TABLE IF NOT EXISTS import_rows (
+            seq INTEGER PRIMARY KEY, amount INTEGER, type TEXT, category TEXT, description TEXT,
+            date TEXT, ts INTEGER, fts_description TEXT, fts_category TEXT
+        )
+    ''')
+    try:
+        conn.execute('DELETE FROM temp.import_rows')
+        # ---- Bước 1: đọc, kiểm tra, ghi bảng tạm (chưa khóa ghi file chính) ----
+        conn.execute('BEGIN')
+        try:
+            for line_num, record in READERS[format_type](stream):
+                if max_rows is not None and result.imported >= max_rows:
+                    result.error(line_num, f'vượt quá giới hạn {max_rows} dòng')
+                    continue
+                try:
+                    amount, tx_type, category, description, date = validate(record)
+                except ValueError as e:
+                    result.error(line_num, str(e))
+                    continue
+
+                date_text = date.strftime(DATE_FORMAT)
+                batch.append((result.imported, amount, tx_type, category, description, date_text, to_ts(date),
+                              fulltext.fold(description), fulltext.fold(category)))
+                key = (date_text[:7], tx_type, category)
+                group = groups.get(key)
+                if group is None:
+                    groups[key] = [amount, 1, amount, amount]
+                else:
+                    group[0] += amount
+                    group[1] += 1
+                    group[2] = min(group[2], amount)
+                    group[3] = max(group[3], amount)
+                if tx_type == 'income':
+                    result.net += amount
+                    result.income += amount
+                else:
+                    result.net -= amount
+                result.days.add(date_text[:10])
+                result.imported += 1
+
+                if len(batch) >= IMPORT_BATCH_SIZE:
+                    flush()
+                if progress and result.imported % PROGRESS_EVERY == 0:
+                    progress(result.imported)
+            if batch:
+                flush()
+            conn.execute('COMMIT')
+        except (UnicodeDecodeError, csv.Error, EOFError, OSError) as e:
+            conn.execute('ROLLBACK')
+            raise ImportFormatError(f'không đọc được file: {e}') from None
+        except BaseException:
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+            raise
+
+        # ---- Bước 2: áp dụng trong một transaction IMMEDIATE ngắn ----
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute('''
+                UPDATE users SET balance = balance + ?
+                WHERE user_id = ? AND balance + ? >= 0
+                RETURNING balance
+            ''', (result.net, user_id, result.net)).fetchone()
+            if row is None:
+                conn.execute('ROLLBACK')
+                balance = conn.execute('SELECT balance FROM users WHERE user_id = ?', (user_id,)).fetchone()
+                result.reject(user_id, balance[0] if balance else 0)
+                return result
+            # Tự cấp id (đang giữ khóa ghi) để index FTS cùng lúc; không dùng
+            # lại id cũ giống AUTOINCREMENT nên lấy max với sqlite_sequence
+            first_id = conn.execute('''
+                SELECT MAX(COALESCE((SELECT seq FROM sqlite_sequence WHERE name = 'transactions'), 0),
+                           COALESCE((SELECT MAX(id) FROM transactions), 0)) + 1
+            ''').fetchone()[0]
+            conn.execute('''
+                INSERT INTO transactions (id, user_id, amount, type, category, description, date, ts, guild_id)
+                SELECT ? + seq, ?, amount, type, category, description, date, ts, ?
+                FROM temp.import_rows ORDER BY seq
+            ''', (first_id, user_id, guild_id))
+            conn.execute('''
+                INSERT INTO transactions_fts (rowid, description, category, user_id)
+                SELECT ? + seq, fts_description, fts_category, ?
+                FROM temp.import_rows ORDER BY seq
+            ''', (first_id, user_id))
+            rollup.apply_many(conn, [(user_id, month, tx_type, category, *totals)
+                                     for (month, tx_type, category), totals in groups.items()])
+            if result.imported:
+                achievements.record_many(conn, user_id, result.imported, result.income, result.days,
+                                         datetime.now().strftime(DATE_FORMAT))
+            conn.execute('COMMIT')
+        except BaseException:
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+            raise
+    finally:
+        conn.execute('DROP TABLE IF EXISTS temp.import_rows')
+    return result
@@ -0,0 +1,206 @@
+from bisect import bisect_left, insort
+from collections import ChainMap, OrderedDict
+from heapq import merge
+from itertools import islice
+from datetime import datetime
+
+from database import DATE_FORMAT
+
+# (mã, tên hiển thị)
+METRICS = (
+    ('balance', 'Số dư'),
+    ('savings_rate', 'Tỷ lệ tiết kiệm'),
+    ('streak', 'Chuỗi ngày dài nhất'),
+)
+METRIC_NAMES = dict(METRICS)
+REFRESH_CHUNK_SIZE = 500  # số tham số tối đa mỗi truy vấn IN (...)
+
+# ==== THÀNH VIÊN GUILD ====
+def add_member(conn, guild_id, user_id):
+    """Ghi nhận user đã dùng bot trong guild; trả về True nếu là thành viên mới"""
+    return conn.execute('''
+        INSERT OR IGNORE INTO guild_members (guild_id, user_id, joined_date) VALUES (?, ?, ?)
+    ''', (guild_id, user_id, datetime.now().strftime(DATE_FORMAT))).rowcount > 0
+
+def remove_guild(conn, guild_id):
+    return conn.execute('DELETE FROM guild_members WHERE guild_id = ?', (guild_id,)).rowcount
+
+# ==== ĐIỂM ====
+# Điểm được suy ra từ các bộ đếm đã cập nhật ở đường ghi (users.balance,
+# user_stats) nên không cần bảng điểm riêng
+SCORE_COLUMNS = '''
+    u.user_id, u.username, u.balance, COALESCE(s.total_income, 0), COALESCE(s.best_streak, 0)
+'''
+
+def scores(row):
+    """(user_id, username, {metric: điểm}) từ một dòng SCORE_COLUMNS"""
+    user_id, username, balance, total_income, best_streak = row
+    values = {'balance': balance or 0, 'streak': best_streak}
+    if total_income > 0:
+        # Phần vạn để so sánh bằng số nguyên; số dư = tổng thu - tổng chi
+        values['savings_rate'] = (balance or 0) * 10000 // total_income
+    return user_id, username, values
+
+def load_guild(conn, guild_id):
+    return [scores(row) for row in conn.execute(f'''
+        SELECT {SCORE_COLUMNS}
+        FROM guild_members m
+        JOIN users u ON u.user_id = m.user_id
+        LEFT JOIN user_stats s ON s.user_id = m.user_id
+        WHERE m.guild_id = ?
+    ''', (guild_id,))]
+
+def load_users(conn, user_ids):
+    user_ids = list(user_ids)
+    rows = []
+    for start in range(0, len(user_ids), REFRESH_CHUNK_SIZE):
+        chunk = user_ids[start:start + REFRESH_CHUNK_SIZE]
+        rows.extend(scores(row) for row in conn.execute(f'''
+            SELECT {SCORE_COLUMNS}
+            FROM users u LEFT JOIN user_stats s ON s.user_id = u.user_id
+            WHERE u.user_id IN ({', '.join('?' * len(chunk))})
+        ''', chunk))
+    return rows
+
+# ==== BẢNG XẾP HẠNG TRONG RAM ====
+class Leaderboard:
+    """Bảng xếp hạng của một guild: mỗi metric là một list đã sắp xếp.
+
+    Khóa (-điểm, user_id) nên top-N là một lát cắt và hạng của một user là
+    một lần bisect (O(log n)); cập nhật một user chỉ xóa/chèn đúng khóa đó.
+    """
+
+    def __init__(self, rows=()):
+        self.ranks = {metric: [] for metric, _ in METRICS}
+        self.values = {}  # user_id -> {metric: điểm}
+        self.names = {}
+        for user_id, username, values in rows:
+            self.values[user_id] = values
+            self.names[user_id] = username
+            for metric, score in values.items():
+                self.ranks[metric].append((-score, user_id))
+        for keys in self.ranks.values():
+            keys.sort()
+
+    @classmethod
+    def load(cls, conn, guild_id):
+        """Nạp và sắp xếp trên luồng DB (guild lớn mất vài trăm ms)"""
+        return cls(load_guild(conn, guild_id))
+
+    def __contains__(self, user_id):
+        return user_id in self.values
+
+    def update(self, user_id, username, values):
+        old = self.values.get(user_id, {})
+        for metric, keys in self.ranks.items():
+            if old.get(metric) == values.get(metric):
+                continue
+            if metric in old:
+                del keys[bisect_left(keys, (-old[metric], user_id))]
+            if metric in values:
+                insort(keys, (-values[metric], user_id))
+        self.values[user_id] = values
+        self.names[user_id] = username
+
+    def size(self, metric):
+        return len(self.ranks[metric])
+
+    def rank(self, metric, user_id):
+        """Hạng (bắt đầu từ 1) hoặc None nếu user không có điểm metric này"""
+        score = self.values.get(user_id, {}).get(metric)
+        if score is None:
+            return None
+        return bisect_left(self.ranks[metric], (-score, user_id)) + 1
+
+    def page(self, metric, offset, limit):
+        """[(hạng, user_id, tên, điểm)]"""
+        return [(offset + index + 1, user_id, self.names[user_id], -negative)
+                for index, (negative, user_id) in enumerate(self.ranks[metric][offset:offset + limit])]
+
+class MergedLeaderboard:
+    """Bảng của một guild có thành viên ở nhiều shard: ghép các bảng con.
+
+    Mỗi user chỉ nằm trong một shard nên các khóa (-điểm, user_id) không
+    trùng nhau; hạng là tổng số khóa đứng trước ở từng bảng.
+    """
+
+    def __init__(self, boards):
+        self.boards = boards
+        self.values = ChainMap(*(board.values for board in boards))
+        self.names = ChainMap(*(board.names for board in boards))
+
+    def __contains__(self, user_id):
+        return user_id in self.values
+
+    def size(self, metric):
+        return sum(board.size(metric) for board in self.boards)
+
+    def rank(self, metric, user_id):
+        score = self.values.get(user_id, {}).get(metric)
+        if score is None:
+            return None
+        return sum(bisect_left(board.ranks[metric], (-score, user_id)) for board in self.boards) + 1
+
+    def page(self, metric, offset, limit):
+        keys = islice(merge(*(board.ranks[metric] for board in self.boards)), offset, offset + limit)
+        return [(offset + index + 1, user_id, self.names[user_id], -negative)
+                for index, (negative, user_id) in enumerate(keys)]
+
+class Leaderboards:
+    """Các bảng xếp hạng đã nạp (LRU theo guild), làm mới tăng dần.
+
+    Đường ghi chỉ gọi mark_dirty(user_ids); lần đọc kế tiếp nạp lại điểm
+    của đúng các user đó và cập nhật mọi bảng đang chứa họ. Mọi thao tác
+    trên bảng chạy trên event loop, chỉ việc đọc DB chạy ở luồng DB.
+    """
+
+    def __init__(self, max_guilds=256):
+        self.max_guilds = max_guilds
+        self.boards = OrderedDict()
+        self.dirty = set()
+        self.joined = set()  # (guild_id, user_id) mới, chưa có trong bảng đã nạp
+        self.known = set()  # (guild_id, user_id) chắc chắn có trong guild_members
+        self.loading = 0  # số bảng đang nạp; lệnh ghi trong lúc nạp vẫn phải được ghi nhận
+
+    def mark_dirty(self, *user_ids):
+        if self.boards or self.loading:
+            self.dirty.update(user_ids)
+
+    def member_joined(self, guild_id, user_id):
+        self.known.add((guild_id, user_id))
+        if guild_id in self.boards or self.loading:
+            self.joined.add((guild_id, user_id))
+
+    def drop(self, guild_id):
+        self.boards.pop(guild_id, None)
+        self.known = {key for key in self.known if key[0] != guild_id}
+
+    def clear(self):
+        """Bỏ mọi bảng đã nạp (sau khi có user chuyển đi/đến shard hoặc dựng lại bộ đếm)"""
+        self.boards.clear()
+        self.known.clear()
+
+    def get(self, guild_id):
+        board = self.boards.get(guild_id)
+        if board is not None:
+            self.boards.move_to_end(guild_id)
+        return board
+
+    def put(self, guild_id, board):
+        self.boards[guild_id] = board
+        self.boards.move_to_end(guild_id)
+        while len(self.boards) > self.max_guilds:
+            self.boards.popitem(last=False)
+
+    def take_pending(self):
+        """Lấy (và xóa) tập user cần nạp lại điểm"""
+        joined, self.joined = self.joined, set()
+        user_ids = self.dirty | {user_id for _, user_id in joined}
+        self.dirty = set()
+        return user_ids, joined
+
+    def apply(self, rows, joined):
+        for user_id, username, values in rows:
+            for guild_id, board in self.boards.items():
+                if user_id in board or (guild_id, user_id) in joined:
+                    board.update(user_id, username, values)
@@ -0,0 +1,65 @@
+import achievements
+import rollup
+
+# ==== SỔ CÁI: MỌI THAY ĐỔI SỐ DƯ ====
+# Các hàm ở đây chạy trong một transaction IMMEDIATE ngắn
+# (db.run(..., immediate=True)). Trừ tiền dùng UPDATE có điều kiện
+# `balance >= ?` nên hai lệnh chạy song song không thể cùng tiêu một khoản
+# tiền; số dư và transaction luôn được ghi cùng nhau hoặc không ghi gì.
+# guild_id (None nếu lệnh chạy trong DM) chỉ để thống kê theo guild.
+
+def get_balance(conn, user_id):
+    row = conn.execute('SELECT balance FROM users WHERE user_id = ?', (user_id,)).fetchone()
+    return row[0] if row else 0
+
+def post(conn, user_id, tx_type, amount, category, description, date, guild_id=None):
+    """Ghi một giao dịch income/expense kèm thay đổi số dư.
+
+    Trả về (thành công, số dư sau lệnh, id transaction). Expense chỉ được ghi
+    khi đủ số dư.
+    """
+    if tx_type == 'income':
+        row = conn.execute('UPDATE users SET balance = balance + ? WHERE user_id = ? RETURNING balance',
+                           (amount, user_id)).fetchone()
+    else:
+        row = conn.execute('''
+            UPDATE users SET balance = balance - ?
+            WHERE user_id = ? AND balance >= ?
+            RETURNING balance
+        ''', (amount, user_id, amount)).fetchone()
+    if row is None:
+        return False, get_balance(conn, user_id), None
+    tx_id = rollup.insert_transaction(conn, user_id, amount, tx_type, category, description, date, guild_id)
+    achievements.record(conn, user_id, tx_type, amount, date, row[0])
+    return True, row[0], tx_id
+
+def credit(conn, user_id, amount, category, description, date, guild_id=None):
+    """Cộng tiền và ghi transaction income; trả về số dư mới"""
+    return post(conn, user_id, 'income', amount, category, description, date, guild_id)[1]
+
+def debit(conn, user_id, amount, category, description, date, guild_id=None):
+    """Trừ tiền nếu đủ số dư; trả về (thành công, số dư sau lệnh)"""
+    ok, balance, _ = post(conn, user_id, 'expense', amount, category, description, date, guild_id)
+    return ok, balance
+
+def transfer(conn, sender_id, recipient_id, amount, sent_description, received_description, date,
+             guild_id=None):
+    """Chuyển tiền giữa hai user; trả về (thành công, số dư người gửi)"""
+    ok, balance = debit(conn, sender_id, amount, 'Chuyển tiền', sent_description, date, guild_id)
+    if ok and not post(conn, recipient_id, 'income', amount, 'Chuyển tiền', received_description, date,
+                       guild_id)[0]:
+        # Người nhận không có trong file này (ví ở shard khác): hủy cả lệnh, không để mất tiền
+        raise LookupError(f'user {recipient_id} không có trong database này')
+    return ok, balance
+
+def deposit_to_goal(conn, user_id, goal_id, amount, description, date, guild_id=None):
+    """Chuyển tiền từ số dư vào mục tiêu tiết kiệm; trả về (thành công, số dư, số tiền đã tiết kiệm)"""
+    ok, balance = debit(conn, user_id, amount, 'Tiết kiệm', description, date, guild_id)
+    if not ok:
+        return False, balance, None
+    saved = conn.execute('''
+        UPDATE savings_goals SET current_amount = current_amount + ?
+        WHERE id = ?
+        RETURNING current_amount
+    ''', (amount, goal_id)).fetchone()[0]
+    return True, balance, saved
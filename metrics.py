@@ -0,0 +1,263 @@
+import asyncio
+import contextvars
+import threading
+import time
+from bisect import bisect_left
+from collections import defaultdict
+from contextlib import contextmanager
+
+# Mốc histogram (giây), giống mặc định của client Prometheus
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 250, 1000)
+LAG_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+PHASES = ('db', 'render', 'send')  # phần thời gian của một lệnh được đo riêng
+
+# ==== LOẠI METRIC ====
+# Mỗi metric giữ giá trị theo bộ nhãn (tuple), có khóa vì luồng DB cũng ghi vào
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{escape(value)}"' for name, value in pairs) + '}'
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self.values = defaultdict(float)
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self.values[label_values] += amount
+
+    def set(self, value, *label_values):
+        """Chép giá trị từ bộ đếm có sẵn ở nơi khác (vd. hit/miss của cache)"""
+        with self._lock:
+            self.values[label_values] = value
+
+    def get(self, *label_values):
+        return self.values.get(label_values, 0)
+
+    def lines(self):
+        with self._lock:
+            items = sorted(self.values.items())
+        for label_values, value in items:
+            yield f'{self.name}{format_labels(self.labels, label_values)} {format_value(value)}'
+
+class Gauge(Counter):
+    kind = 'gauge'
+
+    def clear(self):
+        with self._lock:
+            self.values.clear()
+
+class Histogram:
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self.buckets = tuple(buckets)
+        self.series = {}  # nhãn -> [đếm theo bucket (không cộng dồn)..., tổng, số mẫu]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self.series.get(label_values)
+            if series is None:
+                series = self.series[label_values] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+            series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def count(self, *label_values):
+        series = self.series.get(label_values)
+        return series[-1] if series else 0
+
+    def mean(self, *label_values):
+        series = self.series.get(label_values)
+        return series[-2] / series[-1] if series else 0.0
+
+    def quantile(self, q, *label_values):
+        """Ước lượng phân vị từ bucket (nội suy tuyến tính như histogram_quantile)"""
+        with self._lock:
+            series = list(self.series.get(label_values) or ())
+        if not series or not series[-1]:
+            return 0.0
+        rank = q * series[-1]
+        seen = 0
+        for index, upper in enumerate(self.buckets):
+            if series[index] and seen + series[index] >= rank:
+                lower = self.buckets[index - 1] if index else 0.0
+                return lower + (upper - lower) * (rank - seen) / series[index]
+            seen += series[index]
+        return self.buckets[-1]
+
+    def label_sets(self):
+        with self._lock:
+            return list(self.series)
+
+    def lines(self):
+        with self._lock:
+            items = sorted((key, list(series)) for key, series in self.series.items())
+        for label_values, series in items:
+            cumulative = 0
+            for upper, count in zip(self.buckets + (float('inf'),), series):
+                cumulative += count
+                le = format_labels(self.labels, label_values, [('le', format_value(float(upper)))])
+                yield f'{self.name}_bucket{le} {cumulative}'
+            labels = format_labels(self.labels, label_values)
+            yield f'{self.name}_sum{labels} {format_value(series[-2])}'
+            yield f'{self.name}_count{labels} {series[-1]}'
+
+class Registry:
+    """Tập metric và các hàm thu thập chạy mỗi lần /metrics được đọc"""
+
+    def __init__(self):
+        self.metrics = []
+        self.collectors = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, help_text, labels=()):
+        return self.register(Counter(name, help_text, labels))
+
+    def gauge(self, name, help_text, labels=()):
+        return self.register(Gauge(name, help_text, labels))
+
+    def histogram(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name, help_text, labels, buckets))
+
+    def collect(self):
+        for collector in self.collectors:
+            collector()
+
+    def render(self):
+        """Định dạng văn bản của Prometheus (text exposition 0.0.4)"""
+        self.collect()
+        output = []
+        for metric in self.metrics:
+            output.append(f'# HELP {metric.name} {metric.help_text}')
+            output.append(f'# TYPE {metric.name} {metric.kind}')
+            output.extend(metric.lines())
+        return '\n'.join(output) + '\n'
+
+REGISTRY = Registry()
+COMMAND_SECONDS = REGISTRY.histogram('finance_command_seconds',
+                                     'Thời gian xử lý lệnh, tổng và theo phần (db, render, send)',
+                                     ('command', 'phase'))
+COMMANDS = REGISTRY.counter('finance_commands_total', 'Số lệnh đã chạy theo kết quả', ('command', 'status'))
+COMMAND_QUERIES = REGISTRY.histogram('finance_command_db_queries', 'Số câu SQL mỗi lệnh', ('command',),
+                                     QUERY_BUCKETS)
+DB_QUERIES = REGISTRY.counter('finance_db_queries_total', 'Số câu SQL đã chạy (kể cả task định kỳ)')
+LOOP_LAG = REGISTRY.histogram('finance_event_loop_lag_seconds', 'Độ trễ của event loop so với lịch',
+                              buckets=LAG_BUCKETS)
+
+# ==== ĐO THEO LỆNH ====
+# Lệnh đang chạy nằm trong một ContextVar; Database.run copy context sang
+# luồng DB nên thời gian và số câu SQL được cộng đúng vào lệnh đã gọi.
+class CommandTimer:
+    def __init__(self, command, started=None):
+        self.command = command
+        self.started = started if started is not None else time.perf_counter()
+        self.phases = dict.fromkeys(PHASES, 0.0)
+        self.queries = 0
+        self._lock = threading.Lock()
+
+    def add(self, phase, seconds):
+        with self._lock:
+            self.phases[phase] += seconds
+
+current_command = contextvars.ContextVar('finance_command', default=None)
+
+def start_command(command, started=None):
+    timer = CommandTimer(command, started)
+    current_command.set(timer)
+    return timer
+
+def finish_command(timer, failed=False):
+    total = time.perf_counter() - timer.started
+    COMMAND_SECONDS.observe(total, timer.command, 'total')
+    for phase, seconds in timer.phases.items():
+        COMMAND_SECONDS.observe(seconds, timer.command, phase)
+    COMMAND_QUERIES.observe(timer.queries, timer.command)
+    COMMANDS.inc(timer.command, 'error' if failed else 'ok')
+    return total
+
+@contextmanager
+def timed(phase):
+    """Cộng thời gian của khối lệnh vào phần `phase` của lệnh đang chạy (nếu có)"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timer = current_command.get()
+        if timer is not None:
+            timer.add(phase, time.perf_counter() - started)
+
+def count_query():
+    DB_QUERIES.inc()
+    timer = current_command.get()
+    if timer is not None:
+        with timer._lock:
+            timer.queries += 1
+
+# ==== ĐỘ TRỄ EVENT LOOP ====
+class LoopLagMonitor:
+    """Ngủ `interval` giây rồi đo phần bị trễ: event loop bị chặn bao lâu"""
+
+    def __init__(self, interval=0.5):
+        self.interval = interval
+        self.last = 0.0
+        self.worst = 0.0
+        self._task = None
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            self.last = max(loop.time() - expected, 0.0)
+            self.worst = max(self.worst, self.last)
+            LOOP_LAG.observe(self.last)
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+# ==== HTTP /metrics ====
+async def start_http_server(host, port, registry=REGISTRY):
+    """Phục vụ GET /metrics (chỉ nên mở trên localhost); trả về runner để dọn dẹp"""
+    from aiohttp import web
+
+    async def handle(request):
+        return web.Response(body=registry.render().encode('utf-8'),
+                            headers={'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'})
+
+    app = web.Application()
+    app.router.add_get('/metrics', handle)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
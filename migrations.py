@@ -0,0 +1,362 @@
+import time
+from datetime import datetime
+
+import achievements
+import rollup
+
+BACKFILL_BATCH_SIZE = 5000
+
+# ==== DANH SÁCH MIGRATION ====
+# Mỗi migration có số phiên bản tăng dần; PRAGMA user_version lưu phiên bản
+# cuối cùng đã chạy. Migration phải chạy lại được (IF NOT EXISTS, kiểm tra
+# cột trước khi thêm, backfill theo điều kiện) vì backfill commit theo từng lô.
+MIGRATIONS = []
+
+def migration(version, name):
+    def decorator(func):
+        MIGRATIONS.append((version, name, func))
+        MIGRATIONS.sort(key=lambda item: item[0])
+        return func
+    return decorator
+
+# ==== HÀM PHỤ ====
+def column_names(conn, table):
+    return [row[1] for row in conn.execute(f'PRAGMA table_info({table})')]
+
+def add_column(conn, table, column, declaration):
+    """Thêm cột nếu bảng chưa có"""
+    if column not in column_names(conn, table):
+        conn.execute(f'ALTER TABLE {table} ADD COLUMN {column} {declaration}')
+
+def backfill(conn, table, assignment, condition, batch_size=BACKFILL_BATCH_SIZE):
+    """UPDATE theo từng lô nhỏ, commit sau mỗi lô để không giữ khóa ghi lâu"""
+    total = 0
+    while True:
+        conn.execute('BEGIN IMMEDIATE')
+        cursor = conn.execute(f'''
+            UPDATE {table} SET {assignment}
+            WHERE rowid IN (SELECT rowid FROM {table} WHERE {condition} LIMIT ?)
+        ''', (batch_size,))
+        conn.execute('COMMIT')
+        total += cursor.rowcount
+        if cursor.rowcount < batch_size:
+            return total
+
+# ==== MIGRATIONS ====
+@migration(1, 'base_schema')
+def base_schema(conn):
+    # Bảng users nâng cấp
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS users (
+            user_id INTEGER PRIMARY KEY,
+            username TEXT,
+            balance INTEGER DEFAULT 0,
+            goal INTEGER DEFAULT 0,
+            monthly_budget INTEGER DEFAULT 0,
+            savings_goal INTEGER DEFAULT 0,
+            currency TEXT DEFAULT 'VND',
+            timezone TEXT DEFAULT 'Asia/Ho_Chi_Minh',
+            notifications BOOLEAN DEFAULT 1,
+            created_date TEXT,
+            last_active TEXT
+        )
+    ''')
+
+    # Bảng transactions nâng cấp
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS transactions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            amount INTEGER,
+            type TEXT,
+            category TEXT,
+            description TEXT,
+            date TEXT,
+            recurring BOOLEAN DEFAULT 0,
+            recurring_interval INTEGER DEFAULT 0,
+            tags TEXT,
+            FOREIGN KEY (user_id) REFERENCES users (user_id)
+        )
+    ''')
+
+    # Bảng categories
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS categories (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            name TEXT,
+            type TEXT,
+            color TEXT,
+            icon TEXT,
+            budget_limit INTEGER DEFAULT 0,
+            FOREIGN KEY (user_id) REFERENCES users (user_id)
+        )
+    ''')
+
+    # Bảng budgets
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS budgets (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            category TEXT,
+            amount INTEGER,
+            period TEXT,
+            start_date TEXT,
+            end_date TEXT,
+            FOREIGN KEY (user_id) REFERENCES users (user_id)
+        )
+    ''')
+
+    # Bảng savings_goals
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS savings_goals (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            name TEXT,
+            target_amount INTEGER,
+            current_amount INTEGER DEFAULT 0,
+            deadline TEXT,
+            description TEXT,
+            created_date TEXT,
+            FOREIGN KEY (user_id) REFERENCES users (user_id)
+        )
+    ''')
+
+    # Bảng notifications
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS notifications (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            message TEXT,
+            type TEXT,
+            read BOOLEAN DEFAULT 0,
+            created_date TEXT,
+            FOREIGN KEY (user_id) REFERENCES users (user_id)
+        )
+    ''')
+
+    # Thêm categories mặc định
+    if conn.execute('SELECT COUNT(*) FROM categories').fetchone()[0] == 0:
+        default_categories = [
+            ('🍔', 'Ăn uống', 'expense', '#FF6B6B'),
+            ('🚗', 'Giao thông', 'expense', '#4ECDC4'),
+            ('🏠', 'Nhà cửa', 'expense', '#45B7D1'),
+            ('💊', 'Y tế', 'expense', '#96CEB4'),
+            ('🎮', 'Giải trí', 'expense', '#FFEAA7'),
+            ('👕', 'Quần áo', 'expense', '#DDA0DD'),
+            ('📚', 'Giáo dục', 'expense', '#98D8C8'),
+            ('💰', 'Lương', 'income', '#00B894'),
+            ('💼', 'Kinh doanh', 'income', '#FDCB6E'),
+            ('🎁', 'Quà tặng', 'income', '#E17055')
+        ]
+        conn.executemany('INSERT INTO categories (user_id, name, type, color, icon) VALUES (0, ?, ?, ?, ?)',
+                         [(name, cat_type, color, icon) for icon, name, cat_type, color in default_categories])
+
+@migration(2, 'legacy_columns')
+def legacy_columns(conn):
+    """Bổ sung cột cho database tạo từ phiên bản bot cũ"""
+    for column, declaration in [
+        ('username', 'TEXT'),
+        ('monthly_budget', 'INTEGER DEFAULT 0'),
+        ('savings_goal', 'INTEGER DEFAULT 0'),
+        ('currency', "TEXT DEFAULT 'VND'"),
+        ('timezone', "TEXT DEFAULT 'Asia/Ho_Chi_Minh'"),
+        ('notifications', 'BOOLEAN DEFAULT 1'),
+        ('last_active', 'TEXT'),
+    ]:
+        add_column(conn, 'users', column, declaration)
+
+    for column, declaration in [
+        ('category', "TEXT DEFAULT 'Khác'"),
+        ('recurring', 'BOOLEAN DEFAULT 0'),
+        ('recurring_interval', 'INTEGER DEFAULT 0'),
+        ('tags', 'TEXT'),
+    ]:
+        add_column(conn, 'transactions', column, declaration)
+
+@migration(3, 'transaction_ts')
+def transaction_ts(conn):
+    """Cột ts (epoch) cho transactions, backfill từ cột date"""
+    add_column(conn, 'transactions', 'ts', 'INTEGER')
+    backfill(conn, 'transactions',
+             "ts = CAST(strftime('%s', date) AS INTEGER)",
+             "ts IS NULL AND strftime('%s', date) IS NOT NULL")
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_transactions_user_ts ON transactions (user_id, ts)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_transactions_user_type_ts ON transactions (user_id, type, ts)')
+
+@migration(4, 'hot_path_indexes')
+def hot_path_indexes(conn):
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_transactions_user_type_category_ts '
+                 'ON transactions (user_id, type, category, ts)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_transactions_user_category_ts '
+                 'ON transactions (user_id, category, ts)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_budgets_user_category_period '
+                 'ON budgets (user_id, category, period)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_savings_goals_user_name ON savings_goals (user_id, name)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_categories_user_type ON categories (user_id, type)')
+
+@migration(5, 'monthly_rollup')
+def monthly_rollup(conn):
+    """Bảng tổng hợp theo (user, tháng, loại, danh mục), dựng từ dữ liệu cũ"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS monthly_rollup (
+            user_id INTEGER,
+            month TEXT,
+            type TEXT,
+            category TEXT,
+            total INTEGER DEFAULT 0,
+            count INTEGER DEFAULT 0,
+            min_amount INTEGER,
+            max_amount INTEGER,
+            PRIMARY KEY (user_id, month, type, category)
+        ) WITHOUT ROWID
+    ''')
+    conn.execute('BEGIN IMMEDIATE')
+    rollup.rebuild(conn)
+    conn.execute('COMMIT')
+
+@migration(6, 'transactions_fts')
+def transactions_fts(conn):
+    """Chỉ mục FTS5 cho description/category, đồng bộ bằng trigger"""
+    conn.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS transactions_fts USING fts5 (
+            description, category, user_id,
+            tokenize = 'unicode61 remove_diacritics 2',
+            prefix = '2 3'
+        )
+    ''')
+    # "đ" không được remove_diacritics bỏ dấu nên đổi sang "d" trước khi index
+    fold = "replace(replace(COALESCE({0}, ''), 'đ', 'd'), 'Đ', 'D')"
+    insert_row = f'''
+        INSERT INTO transactions_fts (rowid, description, category, user_id)
+        VALUES (new.id, {fold.format('new.description')}, {fold.format('new.category')}, new.user_id);
+    '''
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS transactions_fts_insert AFTER INSERT ON transactions BEGIN
+            {insert_row}
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS transactions_fts_delete AFTER DELETE ON transactions BEGIN
+            DELETE FROM transactions_fts WHERE rowid = old.id;
+        END
+    ''')
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS transactions_fts_update
+        AFTER UPDATE OF description, category, user_id ON transactions BEGIN
+            DELETE FROM transactions_fts WHERE rowid = old.id;
+            {insert_row}
+        END
+    ''')
+
+    conn.execute('BEGIN IMMEDIATE')
+    conn.execute('DELETE FROM transactions_fts')
+    conn.execute(f'''
+        INSERT INTO transactions_fts (rowid, description, category, user_id)
+        SELECT id, {fold.format('description')}, {fold.format('category')}, user_id FROM transactions
+    ''')
+    conn.execute('COMMIT')
+
+@migration(7, 'fts_index_on_write')
+def fts_index_on_write(conn):
+    """Bỏ trigger INSERT của FTS; đường ghi tự index (xem fulltext.index_rows)"""
+    conn.execute('DROP TRIGGER IF EXISTS transactions_fts_insert')
+
+@migration(8, 'notification_outcomes')
+def notification_outcomes(conn):
+    """Trạng thái gửi thông báo và index cho tóm tắt hàng ngày"""
+    add_column(conn, 'notifications', 'status', 'TEXT')
+    add_column(conn, 'notifications', 'ref', 'TEXT')  # vd. ngày của tóm tắt hàng ngày
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_notifications_type_ref_user '
+                 'ON notifications (type, ref, user_id)')
+    # Quét giao dịch của tất cả user trong một ngày
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_transactions_ts ON transactions (ts)')
+
+@migration(9, 'recurring_next_due')
+def recurring_next_due(conn):
+    """Lịch giao dịch định kỳ: next_due (epoch) với partial index chỉ gồm dòng recurring"""
+    add_column(conn, 'transactions', 'next_due', 'INTEGER')
+    backfill(conn, 'transactions', 'next_due = ts + recurring_interval * 86400',
+             'recurring = 1 AND recurring_interval > 0 AND next_due IS NULL AND ts IS NOT NULL')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_transactions_next_due '
+                 'ON transactions (next_due) WHERE recurring = 1')
+
+@migration(10, 'achievement_counters')
+def achievement_counters(conn):
+    """Bộ đếm thành tích theo user, cập nhật khi ghi giao dịch"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS user_stats (
+            user_id INTEGER PRIMARY KEY,
+            tx_count INTEGER NOT NULL DEFAULT 0,
+            total_income INTEGER NOT NULL DEFAULT 0,
+            active_days INTEGER NOT NULL DEFAULT 0,
+            current_streak INTEGER NOT NULL DEFAULT 0,
+            best_streak INTEGER NOT NULL DEFAULT 0,
+            last_day TEXT
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS user_active_days (
+            user_id INTEGER,
+            day TEXT,
+            PRIMARY KEY (user_id, day)
+        ) WITHOUT ROWID
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS user_achievements (
+            user_id INTEGER,
+            code TEXT,
+            unlocked_date TEXT,
+            announced INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (user_id, code)
+        ) WITHOUT ROWID
+    ''')
+    conn.execute('BEGIN IMMEDIATE')
+    achievements.rebuild(conn, datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+    conn.execute('COMMIT')
+
+@migration(11, 'guild_members')
+def guild_members(conn):
+    """User đã dùng bot trong guild nào, cho bảng xếp hạng theo guild"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS guild_members (
+            guild_id INTEGER,
+            user_id INTEGER,
+            joined_date TEXT,
+            PRIMARY KEY (guild_id, user_id)
+        ) WITHOUT ROWID
+    ''')
+
+@migration(12, 'transaction_guild')
+def transaction_guild(conn):
+    """Guild nơi giao dịch được ghi, để thống kê theo guild không quét cả bảng"""
+    add_column(conn, 'transactions', 'guild_id', 'INTEGER')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_transactions_guild_ts '
+                 'ON transactions (guild_id, ts) WHERE guild_id IS NOT NULL')
+
+@migration(13, 'user_homes')
+def user_homes(conn):
+    """File database đang giữ ví của user đã chuyển khỏi database chung (chỉ dùng ở file chung)"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS user_homes (
+            user_id INTEGER PRIMARY KEY,
+            path TEXT NOT NULL
+        )
+    ''')
+
+# ==== CHẠY MIGRATION ====
+def run_migrations(conn):
+    """Chạy các migration chưa áp dụng, trả về [(version, name, giây)]"""
+    current = conn.execute('PRAGMA user_version').fetchone()[0]
+    applied = []
+    for version, name, func in MIGRATIONS:
+        if version <= current:
+            continue
+        started = time.perf_counter()
+        func(conn)
+        if conn.in_transaction:
+            conn.execute('COMMIT')
+        conn.execute(f'PRAGMA user_version = {version}')
+        elapsed = time.perf_counter() - started
+        applied.append((version, name, elapsed))
+    return applied
@@ -0,0 +1,106 @@
+import asyncio
+import time
+from datetime import timedelta
+
+from database import DATE_FORMAT, day_start, to_ts
+
+DAILY_SUMMARY = 'daily_summary'
+FINAL_STATUSES = ('sent', 'forbidden', 'not_found')  # không gửi lại; 'failed' được thử lại
+RECORD_BATCH_SIZE = 500
+
+# ==== TÓM TẮT HÀNG NGÀY ====
+def load_daily_summaries(conn, day):
+    """Tóm tắt ngày `day` của mọi user bật thông báo, trong một truy vấn GROUP BY.
+
+    Trả về [(user_id, thu, chi, số giao dịch, số dư)]; bỏ qua user không có
+    giao dịch trong ngày và user đã có kết quả cuối cùng (FINAL_STATUSES).
+    """
+    start = day_start(day)
+    ref = start.strftime('%Y-%m-%d')
+    return conn.execute('''
+        SELECT t.user_id,
+               SUM(CASE WHEN t.type = 'income' THEN t.amount ELSE 0 END),
+               SUM(CASE WHEN t.type = 'expense' THEN t.amount ELSE 0 END),
+               COUNT(*),
+               u.balance
+        FROM transactions t
+        JOIN users u ON u.user_id = t.user_id
+        WHERE t.ts >= ? AND t.ts < ?
+          AND u.notifications = 1
+          AND NOT EXISTS (
+              SELECT 1 FROM notifications n
+              WHERE n.type = ? AND n.ref = ? AND n.user_id = t.user_id AND n.status IN (?, ?, ?)
+          )
+        GROUP BY t.user_id
+    ''', (to_ts(start), to_ts(start + timedelta(days=1)), DAILY_SUMMARY, ref, *FINAL_STATUSES)).fetchall()
+
+def record_outcomes(conn, rows):
+    """rows: [(user_id, message, type, status, ref, created_date)]"""
+    conn.executemany('''
+        INSERT INTO notifications (user_id, message, type, status, ref, created_date)
+        VALUES (?, ?, ?, ?, ?, ?)
+    ''', rows)
+
+# ==== GỬI CÓ GIỚI HẠN TỐC ĐỘ ====
+class RateLimiter:
+    """Token bucket: tối đa `rate` lần mỗi giây, cho phép dồn `burst` lần"""
+
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = burst
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+async def fan_out(items, send, rate, concurrency, on_result=None):
+    """Gọi `await send(item)` cho từng item, song song tối đa `concurrency`
+    và không quá `rate` lần/giây. send trả về trạng thái (vd. 'sent');
+    on_result(item, status) được gọi sau mỗi lần gửi. Trả về {status: số lượng}.
+    """
+    limiter = RateLimiter(rate)
+    queue = iter(items)
+    counts = {}
+
+    async def worker():
+        for item in queue:
+            await limiter.acquire()
+            try:
+                status = await send(item)
+            except Exception:
+                status = 'failed'
+            counts[status] = counts.get(status, 0) + 1
+            if on_result:
+                await on_result(item, status)
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return counts
+
+class OutcomeRecorder:
+    """Gom kết quả gửi và ghi vào bảng notifications theo lô"""
+
+    def __init__(self, db, notification_type, ref):
+        self.db = db
+        self.type = notification_type
+        self.ref = ref
+        self.rows = []
+
+    async def add(self, user_id, message, status, when):
+        self.rows.append((user_id, message, self.type, status, self.ref, when.strftime(DATE_FORMAT)))
+        if len(self.rows) >= RECORD_BATCH_SIZE:
+            await self.flush()
+
+    async def flush(self):
+        rows, self.rows = self.rows, []
+        if rows:
+            await self.db.run(record_outcomes, rows)
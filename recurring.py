@@ -0,0 +1,89 @@
+from datetime import datetime
+
+import ledger
+import notifier
+from database import DATE_FORMAT, from_ts
+
+DAY = 86400
+RECURRING = 'recurring'  # notifications.type của lần định kỳ bị bỏ qua
+DUE_BATCH_SIZE = 500  # số quy tắc xử lý trong một transaction
+MAX_CATCH_UP = 400  # số lần bù tối đa cho một quy tắc mỗi lô; phần còn lại để lô sau
+
+# ==== QUY TẮC ĐỊNH KỲ ====
+# Quy tắc là chính giao dịch đầu tiên, đánh dấu recurring = 1 với
+# recurring_interval (ngày) và next_due (epoch). Mỗi lần đến hạn, một bản
+# sao recurring = 0 được ghi qua ledger; next_due được dời trong cùng
+# transaction nên chạy lại sau khi bot khởi động lại không tạo trùng.
+
+def create_rule(conn, user_id, tx_type, amount, category, description, date, interval_days, guild_id=None):
+    """Ghi giao dịch đầu tiên và biến nó thành quy tắc; trả về (thành công, số dư, id)"""
+    ok, balance, tx_id = ledger.post(conn, user_id, tx_type, amount, category, description, date, guild_id)
+    if ok:
+        conn.execute('''
+            UPDATE transactions
+            SET recurring = 1, recurring_interval = ?, next_due = ts + ?
+            WHERE id = ?
+        ''', (interval_days, interval_days * DAY, tx_id))
+    return ok, balance, tx_id
+
+def list_rules(conn, user_id):
+    return conn.execute('''
+        SELECT id, type, amount, category, description, recurring_interval, next_due
+        FROM transactions
+        WHERE user_id = ? AND recurring = 1
+        ORDER BY next_due
+    ''', (user_id,)).fetchall()
+
+def stop_rule(conn, user_id, rule_id):
+    return conn.execute('''
+        UPDATE transactions SET recurring = 0, next_due = NULL
+        WHERE id = ? AND user_id = ? AND recurring = 1
+    ''', (rule_id, user_id)).rowcount
+
+# ==== SINH GIAO DỊCH ĐẾN HẠN ====
+class DueResult:
+    def __init__(self):
+        self.rules = 0
+        self.created = 0
+        self.skipped = []  # [(user_id, rule_id, amount, date)] không đủ số dư
+        self.users = set()
+
+def materialize_due(conn, now_ts, batch_size=DUE_BATCH_SIZE):
+    """Sinh các lần đến hạn (kể cả bù lần bị lỡ) cho tối đa batch_size quy tắc.
+
+    Chạy trong một transaction IMMEDIATE; chỉ đọc partial index
+    idx_transactions_next_due nên không quét bảng transactions.
+    """
+    result = DueResult()
+    rules = conn.execute('''
+        SELECT id, user_id, type, amount, category, description, recurring_interval, next_due, guild_id
+        FROM transactions
+        WHERE recurring = 1 AND next_due <= ?
+        ORDER BY next_due
+        LIMIT ?
+    ''', (now_ts, batch_size)).fetchall()
+
+    for rule_id, user_id, tx_type, amount, category, description, interval_days, next_due, guild_id in rules:
+        result.rules += 1
+        result.users.add(user_id)
+        step = max(interval_days or 0, 1) * DAY
+        occurrences = 0
+        while next_due <= now_ts and occurrences < MAX_CATCH_UP:
+            date = from_ts(next_due).strftime(DATE_FORMAT)
+            ok, _, _ = ledger.post(conn, user_id, tx_type, amount, category, description, date, guild_id)
+            if ok:
+                result.created += 1
+            else:
+                result.skipped.append((user_id, rule_id, amount, date))
+            next_due += step
+            occurrences += 1
+        conn.execute('UPDATE transactions SET next_due = ? WHERE id = ?', (next_due, rule_id))
+
+    if result.skipped:
+        # Ghi lại trong cùng transaction để user xem được lần nào bị bỏ qua
+        created_date = datetime.now().strftime(DATE_FORMAT)
+        notifier.record_outcomes(conn, [
+            (user_id, f'Không đủ số dư cho giao dịch định kỳ #{rule_id} ({amount:,} VND) ngày {date}',
+             RECURRING, 'insufficient', f'{rule_id}:{date}', created_date)
+            for user_id, rule_id, amount, date in result.skipped])
+    return result
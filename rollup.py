@@ -0,0 +1,92 @@
+import fulltext
+from database import date_to_ts
+
+# ==== GHI ====
+def apply(conn, user_id, month, tx_type, category, amount):
+    """Cộng một giao dịch vào dòng (user, tháng, loại, danh mục)"""
+    conn.execute('''
+        INSERT INTO monthly_rollup (user_id, month, type, category, total, count, min_amount, max_amount)
+        VALUES (?, ?, ?, ?, ?, 1, ?, ?)
+        ON CONFLICT (user_id, month, type, category) DO UPDATE SET
+            total = total + excluded.total,
+            count = count + 1,
+            min_amount = MIN(min_amount, excluded.min_amount),
+            max_amount = MAX(max_amount, excluded.max_amount)
+    ''', (user_id, month, tx_type, category, amount, amount, amount))
+
+def apply_many(conn, rows):
+    """Cộng dồn nhiều nhóm đã gộp sẵn:
+    [(user_id, month, type, category, total, count, min, max)]"""
+    conn.executemany('''
+        INSERT INTO monthly_rollup (user_id, month, type, category, total, count, min_amount, max_amount)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT (user_id, month, type, category) DO UPDATE SET
+            total = total + excluded.total,
+            count = count + excluded.count,
+            min_amount = MIN(min_amount, excluded.min_amount),
+            max_amount = MAX(max_amount, excluded.max_amount)
+    ''', rows)
+
+def insert_transaction(conn, user_id, amount, tx_type, category, description, date, guild_id=None):
+    """Thêm transaction, cập nhật rollup và chỉ mục tìm kiếm trong cùng transaction SQL"""
+    cursor = conn.execute('''
+        INSERT INTO transactions (user_id, amount, type, category, description, date, ts, guild_id)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ''', (user_id, amount, tx_type, category, description, date, date_to_ts(date), guild_id))
+    apply(conn, user_id, date[:7], tx_type, category, amount)
+    fulltext.index_rows(conn, [(cursor.lastrowid, description, category, user_id)])
+    return cursor.lastrowid
+
+def rebuild(conn, user_id=None):
+    """Tính lại rollup từ bảng transactions (toàn bộ hoặc một user)"""
+    where, params = ('WHERE user_id = ?', (user_id,)) if user_id is not None else ('', ())
+    conn.execute(f'DELETE FROM monthly_rollup {where}', params)
+    cursor = conn.execute(f'''
+        INSERT INTO monthly_rollup (user_id, month, type, category, total, count, min_amount, max_amount)
+        SELECT user_id, substr(date, 1, 7), type, COALESCE(category, 'Khác'),
+               SUM(amount), COUNT(*), MIN(amount), MAX(amount)
+        FROM transactions
+        {where}
+        GROUP BY user_id, substr(date, 1, 7), type, COALESCE(category, 'Khác')
+    ''', params)
+    return cursor.rowcount
+
+# ==== ĐỌC ====
+def month_key(dt):
+    return dt.strftime('%Y-%m')
+
+def month_bounds(dt):
+    """Khoảng [tháng này, tháng sau) theo khóa 'YYYY-MM'"""
+    if dt.month == 12:
+        return month_key(dt), f'{dt.year + 1}-01'
+    return month_key(dt), f'{dt.year}-{dt.month + 1:02d}'
+
+def year_bounds(dt):
+    return f'{dt.year}-01', f'{dt.year + 1}-01'
+
+def type_totals(conn, user_id, start_month, end_month):
+    """[(type, tổng, số giao dịch)] trong khoảng tháng"""
+    return conn.execute('''
+        SELECT type, SUM(total), SUM(count)
+        FROM monthly_rollup
+        WHERE user_id = ? AND month >= ? AND month < ?
+        GROUP BY type
+    ''', (user_id, start_month, end_month)).fetchall()
+
+def category_totals(conn, user_id, tx_type, start_month, end_month, limit=-1):
+    """[(category, tổng, số giao dịch)] giảm dần theo tổng"""
+    return conn.execute('''
+        SELECT category, SUM(total), SUM(count)
+        FROM monthly_rollup
+        WHERE user_id = ? AND type = ? AND month >= ? AND month < ?
+        GROUP BY category
+        ORDER BY SUM(total) DESC
+        LIMIT ?
+    ''', (user_id, tx_type, start_month, end_month, limit)).fetchall()
+
+def category_spent(conn, user_id, category, month):
+    row = conn.execute('''
+        SELECT total FROM monthly_rollup
+        WHERE user_id = ? AND month = ? AND type = "expense" AND category = ?
+    ''', (user_id, month, category)).fetchone()
+    return row[0] if row else 0
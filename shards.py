@@ -0,0 +1,265 @@
+import asyncio
+import contextvars
+import json
+import os
+import sqlite3
+from contextlib import contextmanager
+
+import fulltext
+import leaderboard
+import users
+from database import Database
+from migrations import run_migrations
+
+COPY_CHUNK_SIZE = 5000
+# Bảng theo user_id: ví của user nằm trọn trong một file, được chuyển cả khối
+MEMBER_TABLES = ('users', 'transactions', 'categories', 'budgets', 'savings_goals', 'notifications',
+                 'monthly_rollup', 'user_stats', 'user_active_days', 'user_achievements', 'guild_members')
+
+# ==== SHARD ====
+class Shard:
+    """Một file database cùng các cache gắn với nó.
+
+    Mỗi user có đúng một ví, nằm trong đúng một shard (xem ShardRouter), nên
+    tập user đã biết, cache hồ sơ/danh mục và bảng xếp hạng đều đi theo shard.
+    """
+
+    def __init__(self, path, pool_size=4, cache_entries=2048, cache_ttl=300, max_boards=256, slow_query_log=None):
+        self.name = os.path.splitext(os.path.basename(path))[0]
+        self.path = path
+        self.db = Database(path, pool_size=pool_size, slow_query_log=slow_query_log)
+        self.activity = users.ActivityTracker()
+        self.profile_cache = users.TTLCache(cache_entries, cache_ttl)
+        self.category_cache = users.TTLCache(cache_entries, cache_ttl)
+        self.default_categories = None  # danh mục user_id = 0, chỉ nạp một lần
+        self.leaderboards = leaderboard.Leaderboards(max_boards)
+
+    def forget(self, user_ids):
+        """Bỏ mọi thứ đã cache về các user vừa chuyển đi/đến shard này"""
+        self.profile_cache.invalidate(*user_ids)
+        self.category_cache.invalidate(*user_ids)
+        self.activity.known.difference_update(user_ids)
+        self.leaderboards.clear()
+
+def migrate(path):
+    """Chạy migration cho một file shard (tạo mới nếu chưa có)"""
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    conn = sqlite3.connect(path, isolation_level=None)
+    try:
+        return run_migrations(conn)
+    finally:
+        conn.close()
+
+# ==== ĐỊNH TUYẾN ====
+class ShardRouter:
+    """Chọn shard theo user: ví của mỗi user nằm ở đúng một file.
+
+    User chưa chuyển đi (và mọi user mới) ở shard mặc định; bảng user_homes
+    trong file mặc định ghi file của các user đã chuyển sang file riêng của
+    một guild, và được đổi cùng transaction xóa dữ liệu của họ khỏi file
+    mặc định. Bản đồ {guild_id: file} (JSON) chỉ ghi guild nào đã có file
+    riêng. Shard của lệnh đang chạy nằm trong một ContextVar, nên
+    Database.run (copy context sang luồng DB) và các task con tự theo đúng shard.
+    """
+
+    def __init__(self, default_path, map_path=None, shard_dir='shards', **shard_options):
+        self.map_path = map_path
+        self.shard_dir = shard_dir
+        self.shard_options = shard_options
+        self.guild_paths = self.load_map()
+        self.default = Shard(default_path, **shard_options)
+        self._shards = {default_path: self.default}
+        self._current = contextvars.ContextVar('finance_shard', default=None)
+        self.user_paths = self.load_homes()
+        self.moving = set()  # user đang được chuyển sang file khác
+        self.inflight = {}  # số lệnh đang chạy theo user
+
+    def load_map(self):
+        if not self.map_path or not os.path.exists(self.map_path):
+            return {}
+        with open(self.map_path, encoding='utf-8') as f:
+            return {int(guild_id): path for guild_id, path in json.load(f).items()}
+
+    def save_map(self):
+        temp_path = self.map_path + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump({str(guild_id): path for guild_id, path in sorted(self.guild_paths.items())}, f, indent=2)
+        os.replace(temp_path, self.map_path)
+
+    def load_homes(self):
+        """{user_id: file} từ file mặc định ({} nếu chưa migrate tới user_homes)"""
+        if not os.path.exists(self.default.path):
+            return {}
+        conn = sqlite3.connect(self.default.path)
+        try:
+            return dict(conn.execute('SELECT user_id, path FROM user_homes'))
+        except sqlite3.OperationalError:
+            return {}
+        finally:
+            conn.close()
+
+    def paths(self):
+        """Mọi file database cần migrate khi khởi động (file mặc định trước)"""
+        others = set(self.guild_paths.values()) | set(self.user_paths.values())
+        return [self.default.path] + sorted(others - {self.default.path})
+
+    def dedicated_path(self, guild_id):
+        return os.path.join(self.shard_dir, f'guild-{guild_id}.db')
+
+    def shard_at(self, path):
+        shard = self._shards.get(path)
+        if shard is None:
+            shard = self._shards[path] = Shard(path, **self.shard_options)
+        return shard
+
+    def shard_for(self, user_id):
+        """Shard giữ ví của user"""
+        path = self.user_paths.get(user_id)
+        return self.default if path is None else self.shard_at(path)
+
+    def shards(self):
+        """Mọi shard (mở các shard chưa dùng tới) cho các task định kỳ và thống kê theo guild"""
+        for path in self.paths():
+            self.shard_at(path)
+        return list(self._shards.values())
+
+    def current(self):
+        return self._current.get() or self.default
+
+    def use(self, user_id):
+        """Định tuyến lệnh hiện tại (và mọi việc nó gọi) tới shard giữ ví của user"""
+        shard = self.shard_for(user_id)
+        self._current.set(shard)
+        return shard
+
+    @contextmanager
+    def using(self, shard):
+        token = self._current.set(shard)
+        try:
+            yield shard
+        finally:
+            self._current.reset(token)
+
+    def assign(self, guild_id, path, user_ids):
+        """Ghi nhận guild có file riêng và các user vừa chuyển sang file đó (user_homes đã commit)"""
+        self.guild_paths[guild_id] = path
+        if self.map_path:
+            self.save_map()
+        for user_id in user_ids:
+            self.user_paths[user_id] = path
+        return self.shard_at(path)
+
+    # ---- Đếm lệnh đang chạy để chuyển user an toàn ----
+    def enter(self, user_id):
+        self.inflight[user_id] = self.inflight.get(user_id, 0) + 1
+
+    def leave(self, user_id):
+        count = self.inflight.get(user_id, 0) - 1
+        if count > 0:
+            self.inflight[user_id] = count
+        else:
+            self.inflight.pop(user_id, None)
+
+    async def drain(self, user_ids, keep=0, poll=0.05, timeout=30.0):
+        """Chờ các lệnh đang chạy của các user xong (trừ `keep` lệnh, vd. lệnh admin đang gọi)"""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while sum(self.inflight.get(user_id, 0) for user_id in user_ids) > keep:
+            if loop.time() > deadline:
+                raise TimeoutError('vẫn còn lệnh đang chạy của user cần chuyển')
+            await asyncio.sleep(poll)
+
+    def close(self):
+        for shard in self._shards.values():
+            shard.db.close()
+
+class RoutedDatabase:
+    """Giao diện như Database, chuyển mỗi lời gọi tới shard hiện tại"""
+
+    def __init__(self, router):
+        self._router = router
+
+    def __getattr__(self, name):
+        return getattr(self._router.current().db, name)
+
+# ==== CHUYỂN VÍ SANG FILE RIÊNG ====
+def table_columns(conn, table):
+    return [row[1] for row in conn.execute(f'PRAGMA table_info({table})')]
+
+def guild_member_ids(conn, guild_id):
+    return [row[0] for row in conn.execute('SELECT user_id FROM guild_members WHERE guild_id = ?', (guild_id,))]
+
+def move_users(conn, user_ids, target_path):
+    """Chuyển toàn bộ ví của user_ids từ shard nguồn (conn) sang target_path.
+
+    target_path phải đã được migrate. Khóa ghi của nguồn được giữ suốt quá
+    trình: dữ liệu được sao sang đích và commit ở đích trước, rồi mới xóa ở
+    nguồn cùng lúc ghi user_homes trong một transaction. Dừng giữa chừng thì
+    nguồn vẫn nguyên vẹn và vẫn là ví duy nhất; bản sao dở ở đích bị xóa ở
+    lần chuyển sau. Id (giao dịch, mục tiêu, ngân sách...) được cấp lại ở
+    đích để không trùng với dữ liệu đã có. Trả về {bảng: số dòng}.
+    """
+    target = sqlite3.connect(target_path, isolation_level=None)
+    moved = {}
+    try:
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            for db_conn in (conn, target):
+                db_conn.execute('CREATE TEMP TABLE IF NOT EXISTS moving_users (user_id INTEGER PRIMARY KEY)')
+                db_conn.execute('DELETE FROM temp.moving_users')
+                db_conn.executemany('INSERT INTO temp.moving_users (user_id) VALUES (?)',
+                                    [(user_id,) for user_id in user_ids])
+            members = 'user_id IN (SELECT user_id FROM temp.moving_users)'
+
+            target.execute('BEGIN IMMEDIATE')
+            try:
+                for table in MEMBER_TABLES:
+                    target.execute(f'DELETE FROM {table} WHERE {members}')
+                first_id = target.execute('''
+                    SELECT MAX(COALESCE((SELECT seq FROM sqlite_sequence WHERE name = 'transactions'), 0),
+                               COALESCE((SELECT MAX(id) FROM transactions), 0)) + 1
+                ''').fetchone()[0]
+                for table in MEMBER_TABLES:
+                    names = table_columns(target, table)
+                    order = ' ORDER BY id' if 'id' in names else ''
+                    names = [name for name in names if name != 'id']
+                    columns = ', '.join(names)
+                    insert = f'INSERT INTO {table} ({columns}) VALUES ({", ".join("?" * len(names))})'
+                    cursor = conn.execute(f'SELECT {columns} FROM {table} WHERE {members}{order}')
+                    moved[table] = 0
+                    while True:
+                        rows = cursor.fetchmany(COPY_CHUNK_SIZE)
+                        if not rows:
+                            break
+                        target.executemany(insert, rows)
+                        moved[table] += len(rows)
+                # Giao dịch ở đích có id mới: index tìm kiếm cho đúng các dòng vừa chép
+                cursor = target.execute('SELECT id, description, category, user_id FROM transactions WHERE id >= ?',
+                                        (first_id,))
+                while True:
+                    rows = cursor.fetchmany(COPY_CHUNK_SIZE)
+                    if not rows:
+                        break
+                    fulltext.index_rows(target, rows)
+                target.execute('COMMIT')
+            except BaseException:
+                if target.in_transaction:
+                    target.execute('ROLLBACK')
+                raise
+
+            for table in MEMBER_TABLES:
+                conn.execute(f'DELETE FROM {table} WHERE {members}')
+            conn.executemany('INSERT OR REPLACE INTO user_homes (user_id, path) VALUES (?, ?)',
+                             [(user_id, target_path) for user_id in user_ids])
+            conn.execute('COMMIT')
+        except BaseException:
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+            raise
+        finally:
+            conn.execute('DROP TABLE IF EXISTS temp.moving_users')
+    finally:
+        target.close()
+    return moved
@@ -0,0 +1,124 @@
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+from database import DATE_FORMAT
+
+# ==== THEO DÕI HOẠT ĐỘNG (WRITE-BEHIND) ====
+class ActivityTracker:
+    """Gom các lần cập nhật users.last_active trong RAM rồi ghi một lần.
+
+    `known` là các user chắc chắn đã có dòng trong bảng users, nên lệnh chỉ
+    đọc của họ không phải ghi gì xuống database. `pending` giữ last_active
+    mới nhất của từng user cho tới lần flush kế tiếp.
+    """
+
+    def __init__(self):
+        self.known = set()
+        self.pending = {}
+        self.flushed = 0
+        self._lock = threading.Lock()
+
+    def touch(self, user_id, when=None):
+        when = (when or datetime.now()).strftime(DATE_FORMAT)
+        with self._lock:
+            self.pending[user_id] = when
+
+    def flush(self, conn):
+        """Ghi toàn bộ last_active đang chờ bằng một executemany; trả về số user"""
+        with self._lock:
+            pending, self.pending = self.pending, {}
+        if not pending:
+            return 0
+        try:
+            conn.executemany('UPDATE users SET last_active = ? WHERE user_id = ?',
+                             [(when, user_id) for user_id, when in pending.items()])
+        except BaseException:
+            # Ghi lỗi: trả lại buffer, giữ giá trị mới hơn nếu đã có
+            with self._lock:
+                for user_id, when in pending.items():
+                    self.pending.setdefault(user_id, when)
+            raise
+        self.flushed += len(pending)
+        return len(pending)
+
+def create_user(conn, user_id, username):
+    """Tạo dòng users nếu chưa có (không cập nhật gì nếu đã tồn tại)"""
+    now = datetime.now().strftime(DATE_FORMAT)
+    conn.execute('''INSERT OR IGNORE INTO users
+                    (user_id, username, balance, goal, created_date, last_active)
+                    VALUES (?, ?, 0, 0, ?, ?)''',
+                 (user_id, username, now, now))
+
+# ==== CACHE ĐỌC ====
+PROFILE_COLUMNS = ('user_id', 'username', 'balance', 'goal', 'monthly_budget',
+                   'currency', 'timezone', 'notifications')
+CATEGORY_COLUMNS = 'id, user_id, name, type, color, icon, budget_limit'
+
+class TTLCache:
+    """LRU có hạn sống cho từng mục, kèm bộ đếm hit/miss/eviction.
+
+    Dữ liệu được làm mới bằng invalidate() ở đường ghi; TTL chỉ là lưới an
+    toàn cho những thay đổi không đi qua bot.
+    """
+
+    def __init__(self, max_entries=2048, ttl=300.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.version = 0  # tăng mỗi lần invalidate
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires, value = entry
+                if expires > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, value, version=None):
+        """Lưu giá trị; bỏ qua nếu đã có invalidate kể từ `version` (dữ liệu đọc có thể cũ)"""
+        with self._lock:
+            if version is not None and version != self.version:
+                return
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, *keys):
+        with self._lock:
+            self.version += 1
+            for key in keys:
+                self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._entries), 'hits': self.hits,
+                    'misses': self.misses, 'evictions': self.evictions}
+
+def load_profile(conn, user_id):
+    """Dòng users dạng dict theo tên cột (None nếu chưa có)"""
+    row = conn.execute(f'SELECT {", ".join(PROFILE_COLUMNS)} FROM users WHERE user_id = ?',
+                       (user_id,)).fetchone()
+    return dict(zip(PROFILE_COLUMNS, row)) if row else None
+
+def load_categories(conn, user_id):
+    """Danh mục của user (user_id = 0 là danh mục mặc định)"""
+    return conn.execute(f'SELECT {CATEGORY_COLUMNS} FROM categories WHERE user_id = ? ORDER BY id',
+                        (user_id,)).fetchall()